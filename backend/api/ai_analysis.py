@@ -0,0 +1,271 @@
+from functools import partial
+from threading import Lock
+from weakref import WeakKeyDictionary
+import asyncio
+import json
+import os
+import time
+
+from django.conf import settings
+from dotenv import load_dotenv
+
+from azure.ai.inference import ChatCompletionsClient
+from azure.ai.inference.aio import ChatCompletionsClient as AsyncChatCompletionsClient
+from azure.ai.inference.models import SystemMessage, UserMessage
+from azure.core.credentials import AzureKeyCredential
+
+from core.metrics import registry
+
+from .ai_cache import AIResultCache, listing_set_key
+from .ranking import rank_properties, top_candidates
+
+AI_ENDPOINT = "https://models.github.ai/inference"
+AI_MODEL = "openai/gpt-4.1"
+RANKING_ENGINES = ("auto", "ai", "local")
+
+ai_cache = AIResultCache(settings.AI_CACHE_FILE,
+                         max_entries=settings.AI_CACHE_MAX_ENTRIES,
+                         ttl_seconds=settings.AI_CACHE_TTL_HOURS * 3600)
+
+AI_REQUEST_SECONDS = registry.histogram(
+    "ai_request_seconds", "Latency of AI ranking requests.",
+    ["type", "outcome"], buckets=(1, 2, 5, 10, 20, 30, 60, 120))
+AI_TOKENS = registry.counter(
+    "ai_tokens_total", "Tokens used by AI ranking requests.", ["type", "kind"])
+
+_client = None
+_client_lock = Lock()
+# Async clients are bound to the event loop that created them.
+_async_clients = WeakKeyDictionary()
+
+
+def _client_options():
+    load_dotenv()
+    return {
+        "endpoint": AI_ENDPOINT,
+        "credential": AzureKeyCredential(os.getenv("AI_API_TOKEN")),
+        "connection_timeout": settings.AI_REQUEST_TIMEOUT_SECONDS,
+        "read_timeout": settings.AI_REQUEST_TIMEOUT_SECONDS,
+    }
+
+
+def get_ai_client():
+    # One client per process, so its connection pool (and TLS session) is
+    # reused by every analysis instead of being rebuilt per call.
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ChatCompletionsClient(**_client_options())
+    return _client
+
+
+def get_async_ai_client():
+    # Same as get_ai_client for async views: one aiohttp-backed client per
+    # event loop, so concurrent requests on an ASGI worker share its pool.
+    # Only for long-lived loops; see analyze_sales_and_rentals_async.
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncChatCompletionsClient(
+            **_client_options())
+    return client
+
+
+def _properties_for_ai(property_list, property_type):
+    # Only the best-valued listings are sent, which keeps the prompt size
+    # bounded no matter how many listings the city has.
+    candidates = top_candidates(
+        property_list, property_type, settings.AI_PRERANK_TOP_K)
+
+    properties_for_ai = []
+    for prop in candidates:
+        clean_prop = {
+            "link": prop.get("link"),
+            "area_m2": prop.get("area_m2"),
+            "building_age": prop.get("building_age"),
+            "room_count": prop.get("room_count"),
+        }
+        for key in ("total_price_toman", "price_per_m2_toman", "monthly_rent_toman"):
+            if prop.get(key) is not None:
+                clean_prop[key] = prop[key]
+        # Divar calls the rent deposit "deposit", Sheypoor calls it "mortgage".
+        deposit = prop.get("deposit_toman", prop.get("mortgage_toman"))
+        if deposit is not None:
+            clean_prop["deposit_toman"] = deposit
+
+        properties_for_ai.append(clean_prop)
+    return properties_for_ai
+
+
+def _build_messages(properties_for_ai, property_type):
+    type_in_persian = "فروش" if property_type == "sale" else "اجاره"
+    system_prompt = "شما یک دستیار هوش مصنوعی و متخصص در تحلیل و ارزیابی املاک در ایران هستید. وظیفه شما انتخاب بهترین گزینه‌ها و ارائه دلیل برای هر انتخاب است."
+
+    user_prompt = f"""
+    در ادامه لیستی از آگهی‌های مسکن برای {type_in_persian} آمده است.
+    لطفاً حداقل ۳ و حداکثر ۵ مورد برتر را بر اساس بهترین ارزش (نسبت قیمت به متراژ، سن بنا و ویژگی‌های دیگر) انتخاب کن.
+
+    برای هر ملک که انتخاب می‌کنی، یک توضیح کوتاه ۲ تا ۳ جمله‌ای به زبان فارسی بنویس که چرا آن را به عنوان یک گزینه خوب انتخاب کردی.
+
+    پاسخ خود را **فقط و فقط** در قالب یک آرایه JSON معتبر برگردان.
+    هر آبجکت در این آرایه باید دقیقاً دو کلید داشته باشد:
+    ۱. "link" (که مقدار آن لینک آگهی است)
+    ۲. "explanation" (که مقدار آن توضیح شماست)
+
+    مثال فرمت خروجی:
+    [
+    {{"link": "https://divar.ir/v/...", "explanation": "این ملک به دلیل قیمت بسیار مناسب به ازای هر متر و سن کم بنا، یک گزینه عالی برای سرمایه‌گذاری است."}},
+    {{"link": "https://divar.ir/v/...", "explanation": "با توجه به متراژ بالا و تعداد اتاق خواب، این آپارتمان برای خانواده‌های پرجمعیت بسیار ارزشمند است."}}
+    ]
+
+    لیست آگهی‌ها:
+    {json.dumps(properties_for_ai, ensure_ascii=False, separators=(",", ":"))}
+    """
+
+    return [
+        SystemMessage(system_prompt),
+        UserMessage(user_prompt),
+    ]
+
+
+def _parse_response(response):
+    ai_response_content = response.choices[0].message.content
+    print("[AI] Raw response received from AI.")
+
+    ai_results = json.loads(ai_response_content)
+
+    if not isinstance(ai_results, list):
+        ai_results = next((value for value in ai_results.values()
+                           if isinstance(value, list)), [])
+    return ai_results
+
+
+def _record_request(property_type, started, response=None):
+    outcome = "ok" if response is not None else "error"
+    AI_REQUEST_SECONDS.observe(
+        time.perf_counter() - started, type=property_type, outcome=outcome)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        AI_TOKENS.inc(usage.prompt_tokens or 0, type=property_type, kind="prompt")
+        AI_TOKENS.inc(usage.completion_tokens or 0, type=property_type, kind="completion")
+
+
+def _cached_analysis(property_list, property_type):
+    # Returns (cache_key, properties_for_ai, cached_result).
+    properties_for_ai = _properties_for_ai(property_list, property_type)
+    cache_key = listing_set_key(property_type, AI_MODEL, properties_for_ai)
+    cached_result = ai_cache.get(cache_key)
+    if cached_result is not None:
+        print(f"[AI] Using cached {property_type} analysis.")
+    return cache_key, properties_for_ai, cached_result
+
+
+def analyze_properties_with_ai(property_list, property_type):
+
+    if not property_list:
+        print("[WARN] Property list is empty. Skipping AI analysis.")
+        return []
+
+    cache_key, properties_for_ai, cached_result = _cached_analysis(
+        property_list, property_type)
+    if cached_result is not None:
+        return cached_result
+
+    started = time.perf_counter()
+    response = None
+    try:
+        response = get_ai_client().complete(
+            messages=_build_messages(properties_for_ai, property_type),
+            model=AI_MODEL
+        )
+        _record_request(property_type, started, response)
+        ai_results = _parse_response(response)
+        if ai_results:
+            ai_cache.put(cache_key, ai_results)
+        return ai_results
+
+    except Exception as e:
+        if response is None:
+            _record_request(property_type, started)
+        print(f"[ERROR] AI request failed: {e}")
+        return []
+
+
+async def analyze_properties_with_ai_async(property_list, property_type):
+
+    if not property_list:
+        print("[WARN] Property list is empty. Skipping AI analysis.")
+        return []
+
+    cache_key, properties_for_ai, cached_result = _cached_analysis(
+        property_list, property_type)
+    if cached_result is not None:
+        return cached_result
+
+    started = time.perf_counter()
+    response = None
+    try:
+        response = await get_async_ai_client().complete(
+            messages=_build_messages(properties_for_ai, property_type),
+            model=AI_MODEL
+        )
+        _record_request(property_type, started, response)
+        ai_results = _parse_response(response)
+        if ai_results:
+            # The cache is persisted to disk on every put.
+            await asyncio.to_thread(ai_cache.put, cache_key, ai_results)
+        return ai_results
+
+    except Exception as e:
+        if response is None:
+            _record_request(property_type, started)
+        print(f"[ERROR] AI request failed: {e}")
+        return []
+
+
+async def analyze_sales_and_rentals_async(all_sales, all_rentals, engine="auto", async_client=True):
+    # Returns the top sales and rentals, and whether the chosen engine
+    # answered for every non-empty list, i.e. no AI call failed or timed out.
+    # "local" ranks with the offline scoring engine only, "ai" asks the model
+    # only, and "auto" asks the model and falls back to local ranking when
+    # the request fails or times out. Both AI calls are awaited together, so
+    # the AI phase takes at most one timeout.
+    # Under WSGI, Django runs async views on a new event loop per request,
+    # so async_client=False makes the calls with the process-wide sync
+    # client on threads rather than opening an async client per request.
+    if engine == "local":
+        return list(await asyncio.gather(
+            asyncio.to_thread(rank_properties, all_sales, "sale"),
+            asyncio.to_thread(rank_properties, all_rentals, "rent"))), True
+
+    analyze = analyze_properties_with_ai_async if async_client else partial(
+        asyncio.to_thread, analyze_properties_with_ai)
+    tasks = {
+        "sale": asyncio.ensure_future(analyze(all_sales, "sale")),
+        "rent": asyncio.ensure_future(analyze(all_rentals, "rent")),
+    }
+    await asyncio.wait(tasks.values(), timeout=settings.AI_REQUEST_TIMEOUT_SECONDS)
+
+    results = []
+    complete = True
+    for property_type, task in tasks.items():
+        property_list = all_sales if property_type == "sale" else all_rentals
+        if task.done():
+            result = task.result()
+        else:
+            task.cancel()
+            print(f"[ERROR] AI {property_type} analysis timed out.")
+            result = []
+        complete = complete and bool(result or not property_list)
+        results.append(await asyncio.to_thread(
+            _with_fallback, result, property_list, property_type, engine))
+    return results, complete
+
+
+def _with_fallback(result, property_list, property_type, engine):
+    if not result and property_list and engine == "auto":
+        print(
+            f"[AI] Falling back to local ranking for {property_type} listings.")
+        return rank_properties(property_list, property_type)
+    return result
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import json
+import time
+
+from core.utils import write_json_atomic
+
+
+def listing_set_key(property_type: str, model: str, properties_for_ai: list):
+    # Key stays the same for the same listings regardless of scrape order.
+    ordered = sorted(properties_for_ai, key=lambda p: p.get("link") or "")
+    payload = json.dumps(ordered, ensure_ascii=False,
+                         sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return f"{property_type}:{model}:{digest}"
+
+
+class AIResultCache:
+    # LRU + TTL cache of AI top picks, persisted to a JSON file so results
+    # survive restarts and are shared by workers started later.
+    def __init__(self, path: str, max_entries: int = 512, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return OrderedDict()
+        return OrderedDict(sorted(entries.items(), key=lambda item: item[1]["used_at"]))
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry["created_at"] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            entry["used_at"] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, key: str, result: list):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "created_at": now,
+                "used_at": now,
+                "result": result,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            entries = dict(self._entries)
+        write_json_atomic(self.path, entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,158 @@
+from collections import OrderedDict, defaultdict, deque
+from datetime import timedelta
+from functools import wraps
+from threading import Lock
+import hashlib
+import secrets
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import AuthToken
+
+
+def _digest(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    # Valid tokens recently seen, so authenticated requests skip the
+    # database. Entries carry the token's own expiry and are evicted LRU.
+    # The cache is per process and a logout only evicts the token in the
+    # process that handled it, so entries are also dropped ttl_seconds after
+    # they were read from the database; other workers notice a revoked token
+    # within that time.
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, digest: str):
+        with self._lock:
+            cached = self._entries.get(digest)
+            if cached is None:
+                return None
+            entry, cached_until = cached
+            if entry["expires_at"] <= timezone.now() or cached_until <= time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return entry
+
+    def put(self, digest: str, user_id: int, username: str, expires_at):
+        with self._lock:
+            self._entries[digest] = ({
+                "user_id": user_id,
+                "username": username,
+                "expires_at": expires_at,
+            }, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, digest: str):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+
+token_cache = TokenCache(ttl_seconds=settings.AUTH_TOKEN_CACHE_SECONDS)
+
+
+def issue_token(user):
+    token = secrets.token_urlsafe(32)
+    now = timezone.now()
+    expires_at = now + timedelta(hours=settings.AUTH_TOKEN_TTL_HOURS)
+    # Expired tokens can no longer authenticate; they are purged here so the
+    # table does not grow with every login.
+    AuthToken.objects.filter(expires_at__lte=now).delete()
+    AuthToken.objects.create(
+        key_digest=_digest(token), user=user, expires_at=expires_at)
+    token_cache.put(_digest(token), user.id, user.username, expires_at)
+    return token, expires_at
+
+
+def authenticate_token(token: str):
+    digest = _digest(token)
+    entry = token_cache.get(digest)
+    if entry is not None:
+        return entry
+
+    auth_token = (AuthToken.objects.select_related("user")
+                  .filter(key_digest=digest, expires_at__gt=timezone.now()).first())
+    if auth_token is None:
+        return None
+    token_cache.put(digest, auth_token.user_id,
+                    auth_token.user.username, auth_token.expires_at)
+    return {
+        "user_id": auth_token.user_id,
+        "username": auth_token.user.username,
+        "expires_at": auth_token.expires_at,
+    }
+
+
+def revoke_token(token: str):
+    digest = _digest(token)
+    token_cache.discard(digest)
+    AuthToken.objects.filter(key_digest=digest).delete()
+
+
+def token_from_request(request):
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "token" or not token:
+        return None
+    return token.strip()
+
+
+def token_required(view):
+    # Views behind this get request.auth = {"user_id", "username", ...}.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = token_from_request(request)
+        auth = authenticate_token(token) if token else None
+        if auth is None:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        request.auth = auth
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+class LoginRateLimiter:
+    # Sliding-window limit on login attempts, checked before the password
+    # hash is computed so brute-force attempts cannot burn CPU on PBKDF2.
+    def __init__(self, max_attempts: int, window_seconds: float):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self._attempts = defaultdict(deque)
+        self._lock = Lock()
+
+    def _sweep(self, now):
+        for key in [key for key, attempts in self._attempts.items()
+                    if not attempts or now - attempts[-1] > self.window_seconds]:
+            del self._attempts[key]
+
+    def allow(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._attempts) > 10000:
+                self._sweep(now)
+            for key in keys:
+                attempts = self._attempts[key]
+                while attempts and now - attempts[0] > self.window_seconds:
+                    attempts.popleft()
+                if len(attempts) >= self.max_attempts:
+                    return False
+            for key in keys:
+                self._attempts[key].append(now)
+            return True
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+login_rate_limiter = LoginRateLimiter(
+    settings.LOGIN_RATE_LIMIT_ATTEMPTS, settings.LOGIN_RATE_LIMIT_WINDOW_SECONDS)
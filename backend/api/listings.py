@@ -0,0 +1,127 @@
+from datetime import datetime
+import base64
+import json
+
+from django.db.models import Q
+
+from core.city_data import current_listings
+from core.models import Listing
+
+# Sort keys accepted by the listings endpoint. "price" means the total price
+# for sales and the monthly rent for rentals.
+SORT_FIELDS = {
+    "price": {"sale": "total_price_toman", "rent": "monthly_rent_toman"},
+    "price_per_m2": {"sale": "price_per_m2_toman", "rent": "price_per_m2_toman"},
+    "area": {"sale": "area_m2", "rent": "area_m2"},
+    "age": {"sale": "age_order", "rent": "age_order"},
+    "newest": {"sale": "first_seen", "rent": "first_seen"},
+}
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class InvalidQuery(Exception):
+    pass
+
+
+def _int_param(params, name):
+    value = params.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidQuery(f"'{name}' must be an integer")
+
+
+def encode_cursor(value, pk):
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    payload = json.dumps([value, pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort_field):
+    # The cursor comes from the client, so its value must match the type of
+    # the sort field: an ISO timestamp for first_seen, an integer otherwise.
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidQuery("Invalid cursor")
+    if type(pk) is not int:
+        raise InvalidQuery("Invalid cursor")
+    if sort_field == "first_seen":
+        try:
+            datetime.fromisoformat(value)
+        except (ValueError, TypeError):
+            raise InvalidQuery("Invalid cursor")
+    elif type(value) is not int:
+        raise InvalidQuery("Invalid cursor")
+    return value, pk
+
+
+def query_listings(city_name, params):
+    listing_type = params.get("type", "sale")
+    if listing_type not in ("sale", "rent"):
+        raise InvalidQuery("'type' must be 'sale' or 'rent'")
+
+    sort = params.get("sort", "price")
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    if sort_key not in SORT_FIELDS:
+        raise InvalidQuery(
+            f"'sort' must be one of: {', '.join(SORT_FIELDS)} (prefix with '-' for descending)")
+    sort_field = SORT_FIELDS[sort_key][listing_type]
+
+    limit = _int_param(params, "limit") or DEFAULT_LIMIT
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    if params.get("history") == "true":
+        listings = Listing.objects.filter(
+            city=city_name, listing_type=listing_type)
+    else:
+        listings = current_listings(city_name, listing_type)
+
+    price_field = SORT_FIELDS["price"][listing_type]
+    filters = {
+        f"{price_field}__gte": _int_param(params, "min_price"),
+        f"{price_field}__lte": _int_param(params, "max_price"),
+        "area_m2__gte": _int_param(params, "min_area"),
+        "area_m2__lte": _int_param(params, "max_area"),
+        "room_count": _int_param(params, "rooms"),
+    }
+    listings = listings.filter(
+        **{key: value for key, value in filters.items() if value is not None})
+
+    max_age = _int_param(params, "max_age")
+    if max_age is not None:
+        listings = listings.filter(building_age__lte=max_age, older_than_30=False)
+
+    # Keyset pagination: rows without a value for the sort key cannot be
+    # placed in the order, so they are left out.
+    listings = listings.filter(**{f"{sort_field}__isnull": False})
+    if params.get("cursor"):
+        value, pk = decode_cursor(params["cursor"], sort_field)
+        op = "lt" if descending else "gt"
+        listings = listings.filter(
+            Q(**{f"{sort_field}__{op}": value})
+            | Q(**{sort_field: value, f"id__{op}": pk}))
+
+    prefix = "-" if descending else ""
+    page = list(listings.order_by(
+        f"{prefix}{sort_field}", f"{prefix}id")[:limit + 1])
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor(getattr(last, sort_field), last.id)
+
+    return {
+        "city": city_name,
+        "type": listing_type,
+        "sort": sort,
+        "results": [listing.to_dict() for listing in page],
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,47 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import UserAccount
+
+
+class Command(BaseCommand):
+    help = 'Imports users from the old database/users.json file into the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', default=settings.USERS_FILE,
+            help='Path of the users JSON file.')
+
+    def handle(self, *args, **kwargs):
+        try:
+            with open(kwargs['file'], 'r') as f:
+                users = json.load(f)
+        except FileNotFoundError:
+            self.stderr.write(self.style.ERROR(f"{kwargs['file']} not found."))
+            return
+        except json.JSONDecodeError:
+            users = []
+
+        existing_usernames = set(
+            UserAccount.objects.values_list('username', flat=True))
+        existing_emails = set(
+            UserAccount.objects.values_list('email', flat=True))
+
+        new_accounts = []
+        skipped = 0
+        for user in users:
+            if user['username'] in existing_usernames or user['email'] in existing_emails:
+                skipped += 1
+                continue
+            existing_usernames.add(user['username'])
+            existing_emails.add(user['email'])
+            # Passwords are already Django hashes, so they are copied as-is.
+            new_accounts.append(UserAccount(
+                username=user['username'], email=user['email'], password=user['password']))
+
+        with transaction.atomic():
+            UserAccount.objects.bulk_create(new_accounts, batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {len(new_accounts)} users, skipped {skipped} already present.'))
@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+import secrets
+import time
+
+import numpy as np
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Sends concurrent get-data requests to a running server while timing '
+            'logins, to compare a WSGI deployment with an ASGI one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='Base URL of the running server.')
+        parser.add_argument(
+            '--cities', nargs='+', default=['tehran', 'karaj', 'mashhad', 'isfahan'],
+            help='Cities requested from get-data, in turn.')
+        parser.add_argument(
+            '--engine', default=None,
+            help='Ranking engine passed to get-data.')
+        parser.add_argument(
+            '--requests', type=int, default=40,
+            help='Total number of get-data requests.')
+        parser.add_argument(
+            '--concurrency', type=int, default=20,
+            help='Number of get-data requests in flight at the same time.')
+        parser.add_argument(
+            '--logins', type=int, default=10,
+            help='Number of logins sent while get-data requests are running.')
+        parser.add_argument(
+            '--timeout', type=float, default=900,
+            help='Timeout of a single request in seconds.')
+
+    def handle(self, *args, **kwargs):
+        base_url = kwargs['url'].rstrip('/')
+        timeout = kwargs['timeout']
+        params = {'engine': kwargs['engine']} if kwargs['engine'] else {}
+
+        username = f"loadtest-{secrets.token_hex(4)}"
+        password = secrets.token_urlsafe(12)
+        requests.post(f"{base_url}/api/register/", timeout=timeout, json={
+            "username": username, "email": f"{username}@example.com", "password": password})
+
+        def get_data(index):
+            city = kwargs['cities'][index % len(kwargs['cities'])]
+            started = time.perf_counter()
+            try:
+                response = requests.get(
+                    f"{base_url}/api/get-data/{city}/", params=params, timeout=timeout)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            return ok, time.perf_counter() - started
+
+        def login(_):
+            started = time.perf_counter()
+            try:
+                response = requests.post(f"{base_url}/api/login/", timeout=timeout, json={
+                    "username": username, "password": password})
+                # A 429 from the login rate limiter still means the server
+                # answered, which is what is being measured.
+                ok = response.status_code < 500
+            except requests.RequestException:
+                ok = False
+            return ok, time.perf_counter() - started
+
+        self.stdout.write(
+            f"Sending {kwargs['requests']} get-data requests ({kwargs['concurrency']} at a time) "
+            f"and {kwargs['logins']} logins to {base_url}...")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max(1, kwargs['concurrency'])) as data_pool, \
+                ThreadPoolExecutor(1) as login_pool:
+            data_results = data_pool.map(get_data, range(kwargs['requests']))
+            # Logins start once the get-data requests are in flight.
+            time.sleep(0.5)
+            login_results = login_pool.map(login, range(kwargs['logins']))
+            data_results = list(data_results)
+            elapsed = time.perf_counter() - started
+            login_results = list(login_results)
+
+        self.report('get-data', data_results, elapsed)
+        self.report('login', login_results)
+
+    def report(self, name, results, elapsed=None):
+        latencies = np.array([latency for ok, latency in results if ok])
+        errors = sum(1 for ok, _ in results if not ok)
+        line = f"{name}: {latencies.size} ok, {errors} failed"
+        if elapsed is not None:
+            line += f", {latencies.size / elapsed:.2f} req/s over {elapsed:.1f}s"
+        if latencies.size:
+            p50, p95 = np.percentile(latencies, [50, 95])
+            line += f", latency p50 {p50:.3f}s p95 {p95:.3f}s max {latencies.max():.3f}s"
+        self.stdout.write(self.style.SUCCESS(line) if not errors else self.style.WARNING(line))
@@ -1,3 +1,25 @@
 from django.db import models
 
-# Create your models here.
+
+class UserAccount(models.Model):
+    username = models.CharField(max_length=150, unique=True)
+    email = models.EmailField(max_length=254, unique=True)
+    # Django password hash, as produced by make_password.
+    password = models.CharField(max_length=128)
+    date_joined = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.username
+
+
+class AuthToken(models.Model):
+    # Only a SHA-256 digest of the token is stored; the token itself is
+    # handed to the client once, at login.
+    key_digest = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(
+        UserAccount, on_delete=models.CASCADE, related_name="tokens")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user} until {self.expires_at:%Y-%m-%d %H:%M}"
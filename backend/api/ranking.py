@@ -0,0 +1,126 @@
+import numpy as np
+from persian_tools import digits, separator
+
+from core.listing_arrays import listing_arrays
+
+# Common market rate for converting a rent deposit into monthly rent:
+# every toman of deposit is worth 3% of itself per month.
+DEPOSIT_MONTHLY_RATE = 0.03
+
+WEIGHTS = {
+    "cost": 1.0,
+    "age": 0.4,
+    "area": 0.2,
+    "rooms": 0.2,
+}
+
+
+def zscores(values):
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.zeros_like(values)
+    mean = values[finite].mean()
+    std = values[finite].std()
+    if std == 0:
+        return np.zeros_like(values)
+    return np.where(finite, (values - mean) / std, 0.0)
+
+
+def cost_per_m2(arrays, property_type):
+    area = np.where(arrays["area"] > 0, arrays["area"], np.nan)
+    if property_type == "sale":
+        price_per_m2 = arrays["price_per_m2"]
+        return np.where(np.isfinite(price_per_m2), price_per_m2, arrays["total_price"] / area)
+    monthly_cost = np.nan_to_num(arrays["monthly_rent"]) + \
+        np.nan_to_num(arrays["deposit"]) * DEPOSIT_MONTHLY_RATE
+    return np.where(monthly_cost > 0, monthly_cost, np.nan) / area
+
+
+def _score_arrays(arrays, property_type):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cost = cost_per_m2(arrays, property_type)
+        scores = (
+            - WEIGHTS["cost"] * zscores(cost)
+            - WEIGHTS["age"] * zscores(arrays["age"])
+            + WEIGHTS["area"] * zscores(arrays["area"])
+            + WEIGHTS["rooms"] * zscores(arrays["rooms"])
+        )
+    return np.where(np.isfinite(cost), scores, -np.inf), cost
+
+
+def value_scores(property_list, property_type):
+    # Higher is better. Every metric is a z-score against the other listings
+    # of the same city, so scores are comparable across cities of any price
+    # level. Listings without a usable price get -inf.
+    scores, _ = _score_arrays(listing_arrays(property_list), property_type)
+    return scores
+
+
+def top_candidates(property_list, property_type, k):
+    if len(property_list) <= k:
+        return list(property_list)
+    scores = value_scores(property_list, property_type)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [property_list[i] for i in top]
+
+
+def _fa_number(value):
+    return digits.convert_to_fa(separator.add(int(round(value))))
+
+
+def _explain(prop, property_type, cost, median_cost, cost_z):
+    # cost_z is the listing's cost z-score; below 0 it is cheaper than the
+    # city's average.
+    sentences = []
+
+    if property_type == "sale":
+        cost_label = "قیمت هر متر این ملک"
+    else:
+        cost_label = "هزینه ماهانه هر متر (اجاره به‌همراه ارزش ودیعه)"
+    difference = (median_cost - cost) / median_cost * 100 if median_cost else 0
+    if difference >= 1:
+        sentences.append(
+            f"{cost_label} حدود {_fa_number(difference)}٪ کمتر از میانه آگهی‌های این شهر است.")
+    else:
+        sentences.append(
+            f"{cost_label} با {_fa_number(cost)} تومان نزدیک به میانه آگهی‌های این شهر است.")
+
+    age = prop.get("building_age")
+    if age == "more than 30" and cost_z < 0:
+        sentences.append("بنا بیش از ۳۰ سال قدمت دارد، اما قیمت آن این موضوع را جبران می‌کند.")
+    elif age == "more than 30":
+        sentences.append("بنا بیش از ۳۰ سال قدمت دارد.")
+    elif isinstance(age, int) and age <= 2:
+        sentences.append("ساختمان نوساز است و هزینه نگهداری کمی خواهد داشت.")
+    elif isinstance(age, int):
+        sentences.append(f"بنا {_fa_number(age)} سال ساخت است.")
+
+    area = prop.get("area_m2")
+    rooms = prop.get("room_count")
+    if isinstance(area, int) and isinstance(rooms, int):
+        rooms_text = "بدون اتاق خواب" if rooms == 0 else f"{_fa_number(rooms)} اتاق خواب"
+        sentences.append(
+            f"متراژ {_fa_number(area)} متر با {rooms_text} آن را به گزینه‌ای مناسب تبدیل کرده است.")
+
+    return " ".join(sentences)
+
+
+def rank_properties(property_list, property_type, k=5):
+    # Deterministic, local alternative to the AI analysis. Returns the same
+    # shape as the model: a list of {"link", "explanation"} dicts.
+    if not property_list:
+        return []
+    scores, cost = _score_arrays(listing_arrays(property_list), property_type)
+
+    valid = np.isfinite(scores)
+    if not valid.any():
+        return []
+    median_cost = float(np.median(cost[valid]))
+    cost_z = zscores(cost)
+    order = np.argsort(-scores, kind="stable")[:min(k, int(valid.sum()))]
+
+    return [{
+        "link": property_list[i].get("link"),
+        "explanation": _explain(property_list[i], property_type, float(cost[i]), median_cost, float(cost_z[i])),
+    } for i in order]
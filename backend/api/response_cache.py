@@ -0,0 +1,116 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+import gzip
+import hashlib
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.utils import write_bytes_atomic
+
+# body is the gzip-compressed JSON payload.
+CachedResponse = namedtuple("CachedResponse", ["etag", "body"])
+
+
+def _etag(body: bytes):
+    # Weak, since the same ETag is sent for the gzip and identity encodings.
+    return f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def encode_response(data: dict):
+    payload = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False,
+                         separators=(",", ":")).encode("utf-8")
+    # mtime=0 keeps the output, and so the ETag, the same for the same payload.
+    body = gzip.compress(payload, compresslevel=6, mtime=0)
+    return CachedResponse(_etag(body), body)
+
+
+class ResponseCache:
+    # LRU of serialized, gzip-compressed responses. With a directory, entries
+    # are also written there, so other worker processes can serve them
+    # without rebuilding. Keys carry the data version, so entries are never
+    # invalidated, only evicted.
+    def __init__(self, max_entries: int = 256, directory: str = None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def _path(self, key: str):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json.gz")
+
+    def get(self, key: str):
+        # Memory only, so it is safe to call from the event loop. On a miss,
+        # load() checks the directory.
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            elif not self.directory:
+                self.misses += 1
+            return cached
+
+    def load(self, key: str):
+        try:
+            with open(self._path(key), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        cached = CachedResponse(_etag(body), body)
+        self._remember(key, cached)
+        with self._lock:
+            self.hits += 1
+        return cached
+
+    def put(self, key: str, cached: CachedResponse):
+        self._remember(key, cached)
+        if self.directory:
+            write_bytes_atomic(self._path(key), cached.body)
+            self._prune_directory()
+
+    def _remember(self, key: str, cached: CachedResponse):
+        with self._lock:
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune_directory(self):
+        try:
+            paths = [entry.path for entry in os.scandir(self.directory)
+                     if entry.name.endswith(".json.gz")]
+        except FileNotFoundError:
+            return
+        if len(paths) <= self.max_entries:
+            return
+
+        def mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except FileNotFoundError:
+                return 0
+
+        paths.sort(key=mtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+            }
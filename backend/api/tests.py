@@ -1,3 +1,465 @@
-from django.test import TestCase
+from contextlib import redirect_stdout
+from datetime import timedelta
+from unittest import mock
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from core import city_data
+from core.models import CityRefresh, Listing
+
+from . import ai_analysis, auth, views
+from .ai_cache import AIResultCache, listing_set_key
+from .ranking import _explain, rank_properties, zscores
+from .listings import encode_cursor
+from .models import AuthToken, UserAccount
+from .response_cache import ResponseCache, encode_response
+from .views import accepts_gzip
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+class ListingsCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        CityRefresh.objects.create(city="tehran", refreshed_at=now)
+        for i in range(3):
+            Listing.objects.create(
+                link=f"https://divar.ir/v/test/{i}", source="divar", city="tehran",
+                listing_type="sale", area_m2=80 + i, building_age=5 + i,
+                total_price_toman=1000000000 * (i + 1), price_per_m2_toman=10000000,
+                first_seen=now, last_seen=now)
+
+    def get(self, **params):
+        return self.client.get("/api/listings/tehran/", params)
+
+    def test_pages_follow_the_cursor(self):
+        first = self.get(limit=2).json()
+        self.assertEqual(len(first["results"]), 2)
+        second = self.get(limit=2, cursor=first["next_cursor"]).json()
+        self.assertEqual([listing["link"] for listing in second["results"]],
+                         ["https://divar.ir/v/test/2"])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_first_seen_cursor(self):
+        listing = Listing.objects.order_by("id").first()
+        response = self.get(sort="newest", cursor=encode_cursor(listing.first_seen, listing.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+    def test_malformed_cursors_are_rejected(self):
+        cases = [
+            ("price", "not base64 json"),
+            ("price", raw_cursor(["abc", 1])),
+            ("price", raw_cursor([5, "x"])),
+            ("price", raw_cursor([[1], 2])),
+            ("price", raw_cursor([5, None])),
+            ("price", raw_cursor([5, True])),
+            ("price", raw_cursor([5, 1, 2])),
+            ("price", raw_cursor({"value": 5})),
+            ("newest", raw_cursor([5, 1])),
+            ("newest", raw_cursor(["yesterday", 1])),
+        ]
+        for sort, cursor in cases:
+            with self.subTest(sort=sort, cursor=cursor):
+                response = self.get(sort=sort, cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "Invalid cursor"})
+
+
+class ListingsAgeSortTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        CityRefresh.objects.create(city="tehran", refreshed_at=now)
+        for name, age in [("new", 2), ("old", "more than 30"), ("mid", 20), ("unknown", None)]:
+            Listing.from_dict({"link": f"https://divar.ir/v/test/{name}", "building_age": age},
+                              "tehran", "sale", now).save()
+
+    def links(self, **params):
+        links = []
+        cursor = None
+        while True:
+            data = self.client.get("/api/listings/tehran/", {**params, "limit": 1, **({"cursor": cursor} if cursor else {})}).json()
+            links += [listing["link"].rsplit("/", 1)[1] for listing in data["results"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return links
+
+    def test_older_than_30_sorts_as_oldest(self):
+        self.assertEqual(self.links(sort="age"), ["new", "mid", "old"])
+        self.assertEqual(self.links(sort="-age"), ["old", "mid", "new"])
+
+
+class AuthTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserAccount.objects.create(
+            username="reza", email="reza@example.com", password="unused")
+
+    def setUp(self):
+        self.cache = auth.TokenCache(ttl_seconds=60)
+        patcher = mock.patch.object(auth, "token_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_revocation_in_another_process_is_seen_after_the_cache_ttl(self):
+        token, _ = auth.issue_token(self.user)
+        self.assertEqual(auth.authenticate_token(token)["username"], "reza")
+
+        # Another worker logged the token out: the row is gone, but this
+        # process still has the token cached.
+        AuthToken.objects.all().delete()
+        self.assertIsNotNone(auth.authenticate_token(token))
+
+        with mock.patch.object(auth.time, "monotonic", return_value=auth.time.monotonic() + 61):
+            self.assertIsNone(auth.authenticate_token(token))
+
+    def test_issuing_a_token_purges_expired_ones(self):
+        expired = AuthToken.objects.create(
+            key_digest="0" * 64, user=self.user,
+            expires_at=timezone.now() - timedelta(seconds=1))
+        auth.issue_token(self.user)
+        self.assertFalse(AuthToken.objects.filter(pk=expired.pk).exists())
+        self.assertEqual(AuthToken.objects.count(), 1)
+
+
+class AcceptEncodingTests(SimpleTestCase):
+    def test_q_values_are_honoured(self):
+        cases = [
+            ("", False),
+            ("gzip", True),
+            ("gzip, deflate, br", True),
+            ("br;q=1.0, GZIP;q=0.5", True),
+            ("gzip;q=0", False),
+            ("gzip; q=0.000", False),
+            ("identity, gzip;q=0", False),
+            ("*", True),
+            ("*;q=0", False),
+            ("gzip;q=0, *", False),
+            ("*;q=0, gzip", True),
+            ("deflate, br", False),
+            ("gzip;q=abc", False),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(accepts_gzip(header), expected)
+
+
+@override_settings(CITY_DATA_STALE_WHILE_REVALIDATE=False, CITY_LOCK_TIMEOUT_SECONDS=0)
+class CityListingsScrapeTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(city_data, "LOCK_DIR", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stale_data_is_served_while_another_worker_scrapes(self):
+        refreshed_at = timezone.now() - timedelta(days=2)
+        CityRefresh.objects.create(city="tehran", refreshed_at=refreshed_at)
+        Listing.objects.create(
+            link="https://divar.ir/v/test/stale", source="divar", city="tehran",
+            listing_type="sale", first_seen=refreshed_at, last_seen=refreshed_at)
+
+        with city_data.city_lock("tehran"), mock.patch.object(views, "scrape_city") as scrape_city:
+            all_sales, all_rentals, is_stale, served_at = views.get_city_listings("tehran")
+        scrape_city.assert_not_called()
+        self.assertEqual([listing["link"] for listing in all_sales], ["https://divar.ir/v/test/stale"])
+        self.assertEqual((all_rentals, is_stale, served_at), ([], True, refreshed_at))
+
+    def test_a_partial_scrape_keeps_the_failed_sources_listings_and_stays_stale(self):
+        refreshed_at = timezone.now() - timedelta(days=2)
+        CityRefresh.objects.create(city="tehran", refreshed_at=refreshed_at)
+        Listing.objects.create(
+            link="https://www.sheypoor.com/v/old.html", source="sheypoor", city="tehran",
+            listing_type="sale", first_seen=refreshed_at, last_seen=refreshed_at)
+        scraped = ([{"link": "https://divar.ir/v/new", "area_m2": 80}], [], ["sheypoor"])
+
+        with mock.patch.object(views, "scrape_city", return_value=scraped), \
+                mock.patch.object(city_data.snapshot_store, "append"):
+            all_sales, _, is_stale, served_at = views.get_city_listings("tehran")
+        self.assertEqual(sorted(listing["link"] for listing in all_sales),
+                         ["https://divar.ir/v/new", "https://www.sheypoor.com/v/old.html"])
+        self.assertEqual((is_stale, served_at), (True, refreshed_at))
+
+    def test_a_city_without_data_fails(self):
+        with city_data.city_lock("tehran"), self.assertRaises(views.ScrapeError):
+            views.get_city_listings("tehran")
+
+
+class AIResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/ai_cache.json"
+
+    def test_key_ignores_listing_order(self):
+        a = {"link": "https://divar.ir/v/a", "area_m2": 80}
+        b = {"link": "https://divar.ir/v/b", "area_m2": 90}
+        self.assertEqual(listing_set_key("sale", "gpt", [a, b]), listing_set_key("sale", "gpt", [b, a]))
+        self.assertNotEqual(listing_set_key("sale", "gpt", [a, b]), listing_set_key("rent", "gpt", [a, b]))
+        self.assertNotEqual(listing_set_key("sale", "gpt", [a]), listing_set_key("sale", "gpt", [a, b]))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = AIResultCache(self.path, max_entries=2)
+        cache.put("a", [{"link": "a"}])
+        cache.put("b", [{"link": "b"}])
+        cache.get("a")
+        cache.put("c", [{"link": "c"}])
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [{"link": "a"}])
+        self.assertEqual(cache.get("c"), [{"link": "c"}])
+        self.assertEqual(cache.stats(), {
+            "hits": 3, "misses": 1, "hit_ratio": 0.75, "size": 2, "max_entries": 2})
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = AIResultCache(self.path, ttl_seconds=60)
+        with mock.patch("api.ai_cache.time.time", return_value=1000):
+            cache.put("a", [{"link": "a"}])
+        with mock.patch("api.ai_cache.time.time", return_value=1060):
+            self.assertEqual(cache.get("a"), [{"link": "a"}])
+        with mock.patch("api.ai_cache.time.time", return_value=1061):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_entries_survive_a_restart(self):
+        cache = AIResultCache(self.path, max_entries=2)
+        cache.put("a", [{"link": "a"}])
+        cache.put("b", [{"link": "b"}])
+
+        restarted = AIResultCache(self.path, max_entries=2)
+        restarted.put("c", [{"link": "c"}])
+        self.assertIsNone(restarted.get("a"))
+        self.assertEqual(restarted.get("b"), [{"link": "b"}])
+        self.assertEqual(restarted.get("c"), [{"link": "c"}])
+
+
+class PropertiesForAITests(SimpleTestCase):
+    def test_rent_prices_are_sent_for_both_sites(self):
+        rentals = [
+            {"link": "https://divar.ir/v/a", "area_m2": 80, "building_age": 5, "room_count": 2,
+             "deposit_toman": 0, "monthly_rent_toman": 20000000},
+            {"link": "https://www.sheypoor.com/v/b.html", "area_m2": 90, "building_age": 10, "room_count": 2,
+             "mortgage_toman": 300000000, "monthly_rent_toman": 10000000},
+        ]
+        properties = {prop["link"]: prop for prop in ai_analysis._properties_for_ai(rentals, "rent")}
+        self.assertEqual(properties["https://divar.ir/v/a"]["deposit_toman"], 0)
+        self.assertEqual(properties["https://divar.ir/v/a"]["monthly_rent_toman"], 20000000)
+        self.assertEqual(properties["https://www.sheypoor.com/v/b.html"]["deposit_toman"], 300000000)
+        self.assertEqual(properties["https://www.sheypoor.com/v/b.html"]["monthly_rent_toman"], 10000000)
+        self.assertNotIn("mortgage_toman", properties["https://www.sheypoor.com/v/b.html"])
+
+
+class RankingTests(SimpleTestCase):
+    def sale(self, name, price_per_m2, age=10, area=100, rooms=2):
+        return {"link": f"https://divar.ir/v/{name}", "area_m2": area, "building_age": age,
+                "room_count": rooms, "price_per_m2_toman": price_per_m2,
+                "total_price_toman": price_per_m2 * area if price_per_m2 else None}
+
+    def test_zscores(self):
+        np.testing.assert_allclose(zscores(np.array([1.0, 2.0, 3.0, np.nan])),
+                                   [-1.224745, 0, 1.224745, 0], atol=1e-6)
+        np.testing.assert_array_equal(zscores(np.array([5.0, 5.0])), [0, 0])
+        np.testing.assert_array_equal(zscores(np.array([np.nan, np.nan])), [0, 0])
+
+    def test_cheapest_listings_rank_first(self):
+        listings = [self.sale("mid", 100000000), self.sale("unpriced", None),
+                    self.sale("cheap", 60000000), self.sale("dear", 150000000)]
+        ranked = rank_properties(listings, "sale")
+        self.assertEqual([item["link"].rsplit("/", 1)[1] for item in ranked], ["cheap", "mid", "dear"])
+        self.assertEqual(len(rank_properties(listings, "sale", k=2)), 2)
+        self.assertEqual(rank_properties([self.sale("unpriced", None)], "sale"), [])
+
+    def test_newer_and_larger_listings_win_at_the_same_price(self):
+        listings = [self.sale("old", 100000000, age=25), self.sale("new", 100000000, age=1),
+                    self.sale("small", 100000000, age=10, area=60, rooms=1)]
+        # A third listing keeps the price spread from being zero.
+        listings.append(self.sale("dear", 200000000))
+        ranked = rank_properties(listings, "sale")
+        self.assertEqual(ranked[0]["link"], "https://divar.ir/v/new")
+
+    def test_old_buildings_are_only_excused_by_a_low_price(self):
+        excuse = "اما قیمت آن این موضوع را جبران می‌کند"
+        old = self.sale("old", 60000000, age="more than 30")
+        cheap = _explain(old, "sale", 60000000, 100000000, cost_z=-1.0)
+        self.assertIn(excuse, cheap)
+        self.assertIn("۴۰٪ کمتر از میانه", cheap)
+
+        dear = _explain(old, "sale", 150000000, 100000000, cost_z=1.0)
+        self.assertNotIn(excuse, dear)
+        self.assertIn("بیش از ۳۰ سال قدمت دارد.", dear)
+
+    def test_rent_explanation(self):
+        rental = {"link": "https://www.sheypoor.com/v/a.html", "area_m2": 80, "building_age": 1,
+                  "room_count": 0, "mortgage_toman": 100000000, "monthly_rent_toman": 5000000}
+        ranked = rank_properties([rental], "rent")
+        self.assertEqual(ranked[0]["link"], rental["link"])
+        self.assertIn("نوساز", ranked[0]["explanation"])
+        self.assertIn("بدون اتاق خواب", ranked[0]["explanation"])
+
+
+class CityEndpointTests(TestCase):
+    def test_unknown_cities_are_not_found(self):
+        for url in ("/api/get-data/atlantis/", "/api/listings/atlantis/",
+                    "/api/stats/atlantis/", "/api/trends/atlantis/"):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {"error": "City not found."})
+
+    def test_city_search(self):
+        results = self.client.get("/api/cities/", {"q": "tabr"}).json()["results"]
+        self.assertEqual(results[0]["english"], "Tabriz")
+        self.assertEqual(self.client.get("/api/cities/", {"q": "ta", "limit": "x"}).status_code, 400)
+
+
+class AnalyzeSalesAndRentalsTests(SimpleTestCase):
+    sales = [{"link": f"https://divar.ir/v/{i}", "area_m2": 100, "building_age": i, "room_count": 2,
+              "price_per_m2_toman": 100000000 + i, "total_price_toman": 10000000000 + 100 * i}
+             for i in range(8)]
+    rentals = [{"link": "https://www.sheypoor.com/v/a.html", "area_m2": 70, "room_count": 1,
+                "mortgage_toman": 100000000, "monthly_rent_toman": 5000000}]
+
+    def analyze(self, engine, ai_result):
+        # Runs the WSGI path, with the model returning ai_result.
+        with mock.patch.object(ai_analysis, "analyze_properties_with_ai", return_value=ai_result):
+            return asyncio.run(ai_analysis.analyze_sales_and_rentals_async(
+                self.sales, self.rentals, engine, async_client=False))
+
+    def test_local_engine_ranks_without_the_model(self):
+        with mock.patch.object(ai_analysis, "analyze_properties_with_ai") as analyze:
+            results, complete = asyncio.run(ai_analysis.analyze_sales_and_rentals_async(
+                self.sales, self.rentals, "local"))
+        analyze.assert_not_called()
+        self.assertEqual(results, [rank_properties(self.sales, "sale"), rank_properties(self.rentals, "rent")])
+        self.assertTrue(complete)
+
+    def test_model_answers_are_used(self):
+        picks = [{"link": "https://divar.ir/v/3", "explanation": "..."}]
+        self.assertEqual(self.analyze("auto", picks), ([picks, picks], True))
+
+    def test_auto_falls_back_to_local_ranking(self):
+        with redirect_stdout(io.StringIO()):
+            results, complete = self.analyze("auto", [])
+        self.assertEqual(results, [rank_properties(self.sales, "sale"), rank_properties(self.rentals, "rent")])
+        self.assertFalse(complete)
+
+    def test_ai_engine_does_not_fall_back(self):
+        self.assertEqual(self.analyze("ai", []), ([[], []], False))
+
+
+class CityDataStreamTests(SimpleTestCase):
+    def test_wsgi_stream_sends_events_before_the_result(self):
+        # The test client is a WSGI client, so a buffered stream would only
+        # return its first chunk once the listings are released.
+        release = threading.Event()
+
+        def load_city_listings(city_name):
+            release.wait(5)
+            return [], [], False, timezone.now()
+
+        with mock.patch.object(views, "load_city_listings", side_effect=load_city_listings), \
+                mock.patch.object(views, "STREAM_KEEPALIVE_SECONDS", 0.05):
+            response = self.client.get("/api/get-data/tehran/stream/", {"engine": "local"})
+            chunks = iter(response.streaming_content)
+            started = time.monotonic()
+            self.assertIn(b'"phase":"started"', next(chunks))
+            self.assertEqual(next(chunks), b": keep-alive\n\n")
+            self.assertLess(time.monotonic() - started, 1)
+            release.set()
+            rest = b"".join(chunks).decode()
+
+        self.assertIn('"phase":"listings_loaded"', rest)
+        self.assertIn('"phase":"analysis_finished"', rest)
+        self.assertIn("event: result\n", rest)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_encoding_is_deterministic(self):
+        cached = encode_response({"city": "تهران"})
+        self.assertEqual(cached, encode_response({"city": "تهران"}))
+        self.assertNotEqual(cached.etag, encode_response({"city": "tehran"}).etag)
+        self.assertTrue(cached.etag.startswith('W/"'))
+        self.assertEqual(json.loads(gzip.decompress(cached.body)), {"city": "تهران"})
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache(max_entries=2)
+        for key in ("a", "b"):
+            cache.put(key, encode_response({"key": key}))
+        cache.get("a")
+        cache.put("c", encode_response({"key": "c"}))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "hit_ratio": 2 / 3,
+                                         "size": 2, "max_entries": 2})
+
+    def test_directory_is_shared_between_caches(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        writer = ResponseCache(max_entries=2, directory=directory.name)
+        for key in ("a", "b", "c"):
+            writer.put(key, encode_response({"key": key}))
+        self.assertEqual(len(os.listdir(directory.name)), 2)
+
+        reader = ResponseCache(max_entries=2, directory=directory.name)
+        self.assertIsNone(reader.get("c"))
+        self.assertEqual(reader.load("c"), writer.get("c"))
+        self.assertEqual(reader.get("c"), writer.get("c"))
+        self.assertEqual(reader.stats()["hits"], 2)
+
+
+class CityDataResponseTests(SimpleTestCase):
+    sales = [{"link": f"https://divar.ir/v/{i}", "area_m2": 100, "building_age": i, "room_count": 2,
+              "price_per_m2_toman": 100000000 + i, "total_price_toman": 10000000000 + 100 * i}
+             for i in range(3)]
+
+    def setUp(self):
+        # The view reads the database on executor threads, so the loaders
+        # are replaced by the data they would return.
+        refreshed_at = timezone.now()
+        for name, value in (("response_cache", ResponseCache()),
+                            ("city_version", mock.Mock(return_value=refreshed_at)),
+                            ("load_city_listings", mock.Mock(return_value=(self.sales, [], False, refreshed_at)))):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, **headers):
+        return self.client.get("/api/get-data/tehran/", {"engine": "local"}, headers=headers)
+
+    def test_matching_etag_is_not_modified(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn("Content-Encoding", first)
+        etag = first["ETag"]
+
+        second = self.get(if_none_match=etag)
+        views.load_city_listings.assert_called_once()
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second["ETag"], etag)
+        self.assertEqual(second.content, b"")
+
+        self.assertEqual(self.get(if_none_match='W/"other"').status_code, 200)
+
+    def test_gzip_body_is_sent_when_accepted(self):
+        plain = self.get()
+        compressed = self.get(accept_encoding="gzip")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(compressed["ETag"], plain["ETag"])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertIn("Accept-Encoding", compressed["Vary"])
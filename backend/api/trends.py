@@ -0,0 +1,39 @@
+from core.models import Listing
+from core.snapshots import snapshot_store
+
+from .listings import InvalidQuery, _int_param
+
+DEFAULT_DAYS = 90
+MAX_DAYS = 730
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def query_trends(city_name, params):
+    # Daily price series of the city and its listings that got cheaper since
+    # they were first snapshotted, both read from the snapshot store.
+    listing_type = params.get("type", "sale")
+    if listing_type not in ("sale", "rent"):
+        raise InvalidQuery("'type' must be 'sale' or 'rent'")
+
+    days = _int_param(params, "days") or DEFAULT_DAYS
+    days = max(1, min(days, MAX_DAYS))
+    limit = _int_param(params, "limit") or DEFAULT_LIMIT
+    limit = max(1, min(limit, MAX_LIMIT))
+    min_drop = _int_param(params, "min_drop") or 0
+
+    drops = snapshot_store.price_drops(city_name, listing_type, min_drop, limit)
+    listings = Listing.objects.in_bulk([drop["id"] for drop in drops])
+    price_drops = []
+    for drop in drops:
+        listing = listings.get(drop.pop("id"))
+        if listing is not None:
+            price_drops.append({**listing.to_dict(), **drop})
+
+    return {
+        "city": city_name,
+        "type": listing_type,
+        "days": days,
+        "series": snapshot_store.trend(city_name, listing_type, days),
+        "price_drops": price_drops,
+    }
@@ -1,8 +1,18 @@
 from django.urls import path
-from .views import get_city_data_view, register_view, login_view
+from .views import get_city_data_view, city_data_stream_view, register_view, login_view, ai_cache_stats_view, listings_view, city_stats_view, city_trends_view, city_search_view, logout_view, me_view, metrics_view, response_cache_stats_view
 
 urlpatterns = [
+    path('cities/', city_search_view, name='city-search'),
     path('get-data/<str:city_name>/', get_city_data_view, name='get-data'),
+    path('get-data/<str:city_name>/stream/', city_data_stream_view, name='get-data-stream'),
+    path('listings/<str:city_name>/', listings_view, name='listings'),
+    path('stats/<str:city_name>/', city_stats_view, name='city-stats'),
+    path('trends/<str:city_name>/', city_trends_view, name='city-trends'),
     path('register/', register_view, name='register'),
     path('login/', login_view, name='login'),
+    path('logout/', logout_view, name='logout'),
+    path('me/', me_view, name='me'),
+    path('ai-cache/stats/', ai_cache_stats_view, name='ai-cache-stats'),
+    path('response-cache/stats/', response_cache_stats_view, name='response-cache-stats'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
@@ -1,184 +1,463 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.hashers import make_password, check_password
-
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from asgiref.sync import async_to_sync, sync_to_async
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+from queue import Empty, Queue
+import asyncio
+import gzip
 import json
-import os
 
-from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage
-from azure.core.credentials import AzureKeyCredential
+from .auth import issue_token, login_rate_limiter, revoke_token, token_from_request, token_required
+from .listings import InvalidQuery, query_listings
+from .models import UserAccount
+from .ai_analysis import RANKING_ENGINES, ai_cache, analyze_sales_and_rentals_async
+from .response_cache import ResponseCache, encode_response
+from .trends import query_trends
+from core.city_data import city_lock, city_refreshed_at, get_city_stats, is_refresh_stale, load_city_data, refresh_city_data, save_city_data, scrape_city
+from core.cities import city_key, city_slugs, get_city_registry
+from core.metrics import registry
+from core.progress import ProgressHub
+from core.refresh_queue import refresh_queue
+from core.singleflight import AsyncSingleFlight, LockTimeout, SingleFlight
+
+
+# Coalesces requests for a city within this process. Only scrapes take the
+# cross-process city lock, so reads never wait for a background refresh.
+city_data_flight = SingleFlight()
+analysis_flight = AsyncSingleFlight()
+city_progress = ProgressHub()
+response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_ENTRIES,
+                               settings.RESPONSE_CACHE_DIR)
+# A comment line is sent this often while no event is due, so proxies and
+# clients do not drop a stream during a long scrape.
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+class ScrapeError(Exception):
+    pass
+
+
+def city_not_found():
+    return JsonResponse({"error": "City not found."}, status=404)
+
+
+def city_and_engine(request, city_name):
+    # Returns (city_name, engine, error_response) for the get-data views.
+    city = get_city_registry().get(city_name)
+    if city is None:
+        return None, None, city_not_found()
+
+    engine = request.GET.get("engine", settings.RANKING_ENGINE)
+    if engine not in RANKING_ENGINES:
+        return None, None, JsonResponse({"error": f"Unknown ranking engine: {engine}"}, status=400)
+    return city_key(city), engine, None
+
+
+def response_cache_key(city_name, engine, refreshed_at, is_stale):
+    # refreshed_at versions the city's data, so a refresh changes every key.
+    return f"{city_name}:{engine}:{refreshed_at.isoformat()}:{'stale' if is_stale else 'fresh'}"
+
+
+def accepts_gzip(accept_encoding):
+    # Whether an Accept-Encoding header allows gzip, honouring q-values: an
+    # explicit "gzip;q=0" refuses it, and "*" covers gzip unless gzip is
+    # listed on its own.
+    gzip_q = any_q = None
+    for coding in accept_encoding.split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        name = name.lower()
+        if name in ("gzip", "x-gzip"):
+            gzip_q = q if gzip_q is None else max(gzip_q, q)
+        elif name == "*":
+            any_q = q
+    if gzip_q is None:
+        gzip_q = any_q
+    return gzip_q is not None and gzip_q > 0
+
+
+def city_data_response(request, cached, refreshed_at):
+    # Sends a cached get-data body, or 304 when the client's copy matches.
+    response = HttpResponse(content_type="application/json")
+    response["ETag"] = cached.etag
+    response["Last-Modified"] = http_date(refreshed_at.timestamp())
+    response["Cache-Control"] = "no-cache"
+    patch_vary_headers(response, ("Accept-Encoding",))
+
+    conditional = get_conditional_response(
+        request, etag=cached.etag, last_modified=int(refreshed_at.timestamp()), response=response)
+    if conditional is not response:
+        return conditional
+
+    if accepts_gzip(request.headers.get("Accept-Encoding", "")):
+        response["Content-Encoding"] = "gzip"
+        response.content = cached.body
+    else:
+        response.content = gzip.decompress(cached.body)
+    return response
 
-from core.scrapers.divaar_scrap import DivarScraper
-from core.scrapers.sheypoor_scrap import SheypoorScraper
 
+def city_version(city_name):
+    # Runs on an executor thread, see load_city_listings.
+    try:
+        return city_refreshed_at(city_name)
+    finally:
+        close_old_connections()
+
+
+async def get_city_data_view(request, city_name):
+    # Async so that an ASGI worker is not held while a city is scraped or
+    # analysed. The scrape and database work run on executor threads, and
+    # the AI requests are awaited on the event loop.
+    city_name, engine, error = city_and_engine(request, city_name)
+    if error is not None:
+        return error
+
+    # Cities analysed before are answered from the response cache with one
+    # indexed lookup of the data version.
+    refreshed_at = await sync_to_async(city_version, thread_sensitive=False)(city_name)
+    is_stale = is_refresh_stale(refreshed_at)
+    if refreshed_at is not None and (not is_stale or settings.CITY_DATA_STALE_WHILE_REVALIDATE):
+        key = response_cache_key(city_name, engine, refreshed_at, is_stale)
+        cached = response_cache.get(key)
+        if cached is None and response_cache.directory:
+            cached = await asyncio.to_thread(response_cache.load, key)
+        if cached is not None:
+            if is_stale:
+                schedule_refresh(city_name)
+            return city_data_response(request, cached, refreshed_at)
+
+    # Concurrent requests for the same city share a single scrape, and a
+    # single analysis per ranking engine and data version.
+    try:
+        all_sales, all_rentals, is_stale, refreshed_at = await sync_to_async(
+            load_city_listings, thread_sensitive=False)(city_name)
+    except ScrapeError:
+        return JsonResponse({"error": "Failed to scrape data."}, status=500)
+
+    _, cached = await analysis_flight.do(
+        response_cache_key(city_name, engine, refreshed_at, is_stale),
+        build_city_response, city_name, all_sales, all_rentals, is_stale, refreshed_at, engine,
+        isinstance(request, ASGIRequest))
+    return city_data_response(request, cached, refreshed_at)
+
+
+async def city_data_stream_view(request, city_name):
+    # Server-sent events version of get-data. Progress events are streamed
+    # while the city is scraped and analysed, then a "result" event carries
+    # the same payload get-data returns.
+    city_name, engine, error = city_and_engine(request, city_name)
+    if error is not None:
+        return error
+
+    # Under WSGI Django collects an async iterator completely before sending
+    # it, so WSGI servers get a generator that blocks its own thread instead.
+    if isinstance(request, ASGIRequest):
+        events = city_data_events(city_name, engine)
+    else:
+        events = city_data_events_sync(city_name, engine)
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stops nginx from buffering the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
 
-def get_city_data_view(request, city_name):
 
-    sale_filename = f"database/scrap/{city_name}_sales.json"
-    should_scrape = False
+def sse_event(event: str, data):
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n"
 
-    if os.path.exists(sale_filename):
-        file_mod_time = os.path.getmtime(sale_filename)
-        if datetime.now() - datetime.fromtimestamp(file_mod_time) > timedelta(hours=12):
-            print(
-                f"[INFO] Data for {city_name} is outdated. Scraping required.")
-            should_scrape = True
-    else:
-        print(
-            f"[INFO] No existing data found for {city_name}. Scraping required.")
-        should_scrape = True
 
-    if should_scrape:
+async def city_data_events(city_name, engine):
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
 
-        with open('database/cities.json', 'r', encoding='utf-8') as f:
-            cities_data = json.load(f)
-        for city in cities_data:
-            if city["english"].lower() == city_name:
-                divar_city_name = city["divar"]
-                sheypoor_city_name = city["sheypoor"]
+    def on_progress(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    city_progress.subscribe(city_name, on_progress)
+    try:
+        yield sse_event("progress", {"phase": "started", "city": city_name})
+        listings = asyncio.ensure_future(sync_to_async(
+            load_city_listings, thread_sensitive=False)(city_name))
+        while True:
+            next_event = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait(
+                {next_event, listings}, timeout=STREAM_KEEPALIVE_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED)
+            if next_event in done:
+                yield sse_event("progress", next_event.result())
+                continue
+            next_event.cancel()
+            if listings in done:
                 break
+            yield ": keep-alive\n\n"
+        while not events.empty():
+            yield sse_event("progress", events.get_nowait())
+    finally:
+        city_progress.unsubscribe(city_name, on_progress)
 
-        print("[SCRAPER] Starting scraping process...")
-        try :
-            with DivarScraper() as divar_scraper:
-                divar_sale, divar_rent = divar_scraper.scrape(divar_city_name, 2)
-            with SheypoorScraper() as sheypoor_scraper:
-                sheypoor_sale, sheypoor_rent = sheypoor_scraper.scrape(sheypoor_city_name, 8)
-            all_sales = divar_sale + sheypoor_sale
-            all_rentals = divar_rent + sheypoor_rent
-        except Exception as e:
-            print(f"[ERROR] A critical scraping error occurred: {e}")
-            return JsonResponse({"error": "Failed to scrape data."}, status=500)
-
-        os.makedirs(os.path.dirname(sale_filename),
-                    exist_ok=True)
-        with open(sale_filename, 'w', encoding='utf-8') as f:
-            json.dump(all_sales, f, ensure_ascii=False, indent=2)
-        with open(f"database/scrap/{city_name}_rentals.json", 'w', encoding='utf-8') as f:
-            json.dump(all_rentals, f, ensure_ascii=False, indent=2)
-
-        print("[SCRAPER] Scraping and saving completed successfully.")
-    else:
-        with open(sale_filename, 'r', encoding='utf-8') as f:
-            all_sales = json.load(f)
-        with open(f"database/scrap/{city_name}_rentals.json", 'r', encoding='utf-8') as f:
-            all_rentals = json.load(f)
+    try:
+        all_sales, all_rentals, is_stale, refreshed_at = listings.result()
+    except ScrapeError:
+        yield sse_event("error", {"error": "Failed to scrape data."})
+        return
+    yield sse_event("progress", {"phase": "listings_loaded", "sales": len(all_sales), "rentals": len(all_rentals), "stale": is_stale})
+
+    yield sse_event("progress", {"phase": "analysis_started", "engine": engine})
+    analysis = asyncio.ensure_future(analysis_flight.do(
+        response_cache_key(city_name, engine, refreshed_at, is_stale),
+        build_city_response, city_name, all_sales, all_rentals, is_stale, refreshed_at, engine))
+    while True:
+        done, _ = await asyncio.wait({analysis}, timeout=STREAM_KEEPALIVE_SECONDS)
+        if done:
+            break
+        yield ": keep-alive\n\n"
+    response_data, _ = analysis.result()
+    yield sse_event("progress", {"phase": "analysis_finished", "engine": engine})
+    yield sse_event("result", response_data)
+
+
+def city_data_events_sync(city_name, engine):
+    # city_data_events for WSGI. The listings and the analysis run on a
+    # worker thread while this generator relays progress and keepalives.
+    events = Queue()
+    city_progress.subscribe(city_name, events.put)
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        try:
+            yield sse_event("progress", {"phase": "started", "city": city_name})
+            listings = executor.submit(load_city_listings, city_name)
+            # Wakes the loop below once the listings are loaded.
+            listings.add_done_callback(lambda _: events.put(None))
+            while True:
+                try:
+                    event = events.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield sse_event("progress", event)
+            while not events.empty():
+                event = events.get_nowait()
+                if event is not None:
+                    yield sse_event("progress", event)
+        finally:
+            city_progress.unsubscribe(city_name, events.put)
 
-    print("[AI] Sending data to Azure AI for analysis...")
-    top_sales_links = analyze_properties_with_ai(all_sales, "sale")
-    top_rentals_links = analyze_properties_with_ai(all_rentals, "rent")
+        try:
+            all_sales, all_rentals, is_stale, refreshed_at = listings.result()
+        except ScrapeError:
+            yield sse_event("error", {"error": "Failed to scrape data."})
+            return
+        yield sse_event("progress", {"phase": "listings_loaded", "sales": len(all_sales), "rentals": len(all_rentals), "stale": is_stale})
+
+        yield sse_event("progress", {"phase": "analysis_started", "engine": engine})
+        analysis = executor.submit(
+            async_to_sync(analysis_flight.do),
+            response_cache_key(city_name, engine, refreshed_at, is_stale),
+            build_city_response, city_name, all_sales, all_rentals, is_stale, refreshed_at, engine,
+            False)
+        while True:
+            try:
+                response_data, _ = analysis.result(timeout=STREAM_KEEPALIVE_SECONDS)
+                break
+            except FutureTimeout:
+                yield ": keep-alive\n\n"
+        yield sse_event("progress", {"phase": "analysis_finished", "engine": engine})
+        yield sse_event("result", response_data)
+    finally:
+        # A client that disconnects must not hold the request thread until
+        # the scrape ends; the work finishes on the executor thread.
+        executor.shutdown(wait=False)
+
+
+def load_city_listings(city_name):
+    # Runs on an executor thread, which Django's request signals never
+    # reach, so its database connection is closed here. Scrape progress is
+    # published to every stream waiting on the city.
+    try:
+        return city_data_flight.do(city_name, get_city_listings, city_name,
+                                   partial(city_progress.publish, city_name))
+    finally:
+        city_progress.finish(city_name)
+        close_old_connections()
+
+
+def schedule_refresh(city_name):
+    divar_city_name, sheypoor_city_name = city_slugs(city_name)
+    refresh_queue.enqueue(city_name, refresh_city_data,
+                          city_name, divar_city_name, sheypoor_city_name)
+
+
+def needs_scrape(refreshed_at):
+    # Stale data is only scraped in the request when it may not be served
+    # while a background refresh runs.
+    if refreshed_at is None:
+        return True
+    return is_refresh_stale(refreshed_at) and not settings.CITY_DATA_STALE_WHILE_REVALIDATE
+
+
+def get_city_listings(city_name, progress=None):
+
+    refreshed_at = city_refreshed_at(city_name)
+    is_stale = is_refresh_stale(refreshed_at)
+
+    if refreshed_at is None:
+        print(
+            f"[INFO] No existing data found for {city_name}. Scraping required.")
+    elif is_stale and settings.CITY_DATA_STALE_WHILE_REVALIDATE:
+        print(
+            f"[INFO] Data for {city_name} is outdated. Serving it while refreshing in the background.")
+        schedule_refresh(city_name)
+    elif is_stale:
+        print(
+            f"[INFO] Data for {city_name} is outdated. Scraping required.")
+
+    if needs_scrape(refreshed_at):
+        # Shares the city lock with background refreshes and
+        # scrape_hot_cities. Another worker may have scraped the city while
+        # this one waited for it, so the data is checked again.
+        try:
+            with city_lock(city_name, settings.CITY_LOCK_TIMEOUT_SECONDS):
+                refreshed_at = city_refreshed_at(city_name)
+                is_stale = is_refresh_stale(refreshed_at)
+                if needs_scrape(refreshed_at):
+                    divar_city_name, sheypoor_city_name = city_slugs(city_name)
+
+                    print("[SCRAPER] Starting scraping process...")
+                    if progress is not None:
+                        progress({"phase": "scrape_started"})
+                    try :
+                        all_sales, all_rentals, failed_sources = scrape_city(
+                            divar_city_name, sheypoor_city_name, progress)
+                    except Exception as e:
+                        print(f"[ERROR] A critical scraping error occurred: {e}")
+                        raise ScrapeError(str(e)) from e
+
+                    refreshed_at = save_city_data(city_name, all_sales, all_rentals, failed_sources)
+                    print("[SCRAPER] Scraping and saving completed successfully.")
+                    if not failed_sources:
+                        return all_sales, all_rentals, False, refreshed_at
+                    # The failed sources' listings come from the database.
+                    is_stale = is_refresh_stale(refreshed_at)
+        except LockTimeout as e:
+            if refreshed_at is None:
+                print(f"[ERROR] {city_name} is still being scraped by another worker.")
+                raise ScrapeError(str(e)) from e
+            print(f"[INFO] {city_name} is still being scraped by another worker. Serving the stale data.")
+
+    all_sales, all_rentals = load_city_data(city_name)
+    return all_sales, all_rentals, is_stale, refreshed_at
+
+
+async def build_city_response(city_name, all_sales, all_rentals, is_stale, refreshed_at, engine, async_client=True):
+    # Returns the payload and its cached, compressed form. async_client is
+    # False under WSGI, see analyze_sales_and_rentals_async.
+
+    print(f"[AI] Analysing listings with the {engine} ranking engine...")
+    (top_sales_links, top_rentals_links), complete = await analyze_sales_and_rentals_async(
+        all_sales, all_rentals, engine, async_client)
 
     sales_explanation_map = {item.get('link'): item.get(
         'explanation') for item in top_sales_links}
     rentals_explanation_map = {item.get('link'): item.get(
         'explanation') for item in top_rentals_links}
 
-    top_5_sales = [p for p in all_sales if p.get(
-        'link') in sales_explanation_map]
-    top_5_rentals = [p for p in all_rentals if p.get(
-        'link') in rentals_explanation_map]
-
-    for prop in top_5_sales:
-        prop['explanation'] = sales_explanation_map.get(prop['link'])
-
-    for prop in top_5_rentals:
-        prop['explanation'] = rentals_explanation_map.get(prop['link'])
+    # Listings are shared with other requests, so explanations go on copies.
+    top_5_sales = [dict(p, explanation=sales_explanation_map[p['link']])
+                   for p in all_sales if p.get('link') in sales_explanation_map]
+    top_5_rentals = [dict(p, explanation=rentals_explanation_map[p['link']])
+                     for p in all_rentals if p.get('link') in rentals_explanation_map]
 
     print(
         f"[SUCCESS] AI analysis completed for {city_name}. Returning top results.")
     response_data = {
         "city": city_name,
+        "stale": is_stale,
+        "engine": engine,
         "sales_properties": top_5_sales,
         "rentals_properties": top_5_rentals,
     }
-    return JsonResponse(response_data)
-
-
-def analyze_properties_with_ai(property_list, property_type):
-
-    if not property_list:
-        print("[WARN] Property list is empty. Skipping AI analysis.")
-        return []
-
-    properties_for_ai = []
-    for prop in property_list:
-        clean_prop = {
-            "link": prop.get("link"),
-            "area_m2": prop.get("area_m2"),
-            "building_age": prop.get("building_age"),
-            "room_count": prop.get("room_count"),
-        }
-        if prop.get("total_price_toman"):
-            clean_prop["total_price_toman"] = prop.get("total_price_toman")
-            clean_prop["price_per_m2_toman"] = prop.get("price_per_m2_toman")
-        if prop.get("deposit_toman"):
-            clean_prop["deposit_toman"] = prop.get("deposit_toman")
-            clean_prop["monthly_rent_toman"] = prop.get("monthly_rent_toman")
-
-        properties_for_ai.append(clean_prop)
-
-    endpoint = "https://models.github.ai/inference"
-    model = "openai/gpt-4.1"
-    load_dotenv()
-    token = os.getenv("AI_API_TOKEN")
-    client = ChatCompletionsClient(
-        endpoint=endpoint,
-        credential=AzureKeyCredential(token)
-    )
-
-    type_in_persian = "فروش" if property_type == "sale" else "اجاره"
-    system_prompt = "شما یک دستیار هوش مصنوعی و متخصص در تحلیل و ارزیابی املاک در ایران هستید. وظیفه شما انتخاب بهترین گزینه‌ها و ارائه دلیل برای هر انتخاب است."
-
-    user_prompt = f"""
-    در ادامه لیستی از آگهی‌های مسکن برای {type_in_persian} آمده است.
-    لطفاً حداقل ۳ و حداکثر ۵ مورد برتر را بر اساس بهترین ارزش (نسبت قیمت به متراژ، سن بنا و ویژگی‌های دیگر) انتخاب کن.
-
-    برای هر ملک که انتخاب می‌کنی، یک توضیح کوتاه ۲ تا ۳ جمله‌ای به زبان فارسی بنویس که چرا آن را به عنوان یک گزینه خوب انتخاب کردی.
-
-    پاسخ خود را **فقط و فقط** در قالب یک آرایه JSON معتبر برگردان.
-    هر آبجکت در این آرایه باید دقیقاً دو کلید داشته باشد:
-    ۱. "link" (که مقدار آن لینک آگهی است)
-    ۲. "explanation" (که مقدار آن توضیح شماست)
-
-    مثال فرمت خروجی:
-    [
-    {{"link": "https://divar.ir/v/...", "explanation": "این ملک به دلیل قیمت بسیار مناسب به ازای هر متر و سن کم بنا، یک گزینه عالی برای سرمایه‌گذاری است."}},
-    {{"link": "https://divar.ir/v/...", "explanation": "با توجه به متراژ بالا و تعداد اتاق خواب، این آپارتمان برای خانواده‌های پرجمعیت بسیار ارزشمند است."}}
-    ]
-
-    لیست آگهی‌ها:
-    {json.dumps(properties_for_ai, ensure_ascii=False, indent=2)}
-    """
+    cached = await asyncio.to_thread(encode_response, response_data)
+    # Rankings built after a failed AI call are not cached, so the model is
+    # asked again on the next request.
+    if complete:
+        await asyncio.to_thread(
+            response_cache.put, response_cache_key(city_name, engine, refreshed_at, is_stale), cached)
+    return response_data, cached
+
+
+def listings_view(request, city_name):
+    city = get_city_registry().get(city_name)
+    if city is None:
+        return city_not_found()
+    city_name = city_key(city)
+
+    try:
+        return JsonResponse(query_listings(city_name, request.GET))
+    except InvalidQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+def city_stats_view(request, city_name):
+    city = get_city_registry().get(city_name)
+    if city is None:
+        return city_not_found()
 
+    stats = get_city_stats(city_key(city))
+    if stats is None:
+        return JsonResponse({"error": "No data for this city yet."}, status=404)
+    return JsonResponse(stats)
+
+
+def city_trends_view(request, city_name):
+    city = get_city_registry().get(city_name)
+    if city is None:
+        return city_not_found()
+
+    try:
+        return JsonResponse(query_trends(city_key(city), request.GET))
+    except InvalidQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+def city_search_view(request):
     try:
-        response = client.complete(
-            messages=[
-                SystemMessage(system_prompt),
-                UserMessage(user_prompt),
-            ],
-            model=model
-        )
-        ai_response_content = response.choices[0].message.content
-        print("[AI] Raw response received from AI.")
+        limit = max(1, min(int(request.GET.get("limit", 10)), 50))
+    except ValueError:
+        return JsonResponse({"error": "'limit' must be an integer"}, status=400)
+    cities = get_city_registry().search(request.GET.get("q", ""), limit)
+    return JsonResponse({"results": cities})
 
-        ai_results = json.loads(ai_response_content)
 
-        if isinstance(ai_results, list):
-            return ai_results
-        for key in ai_results.keys():
-            if isinstance(ai_results[key], list):
-                return ai_results[key]
-        return []
+def ai_cache_stats_view(request):
+    return JsonResponse(ai_cache.stats())
 
-    except Exception as e:
-        print(f"[ERROR] AI request failed: {e}")
-        return []
 
+def response_cache_stats_view(request):
+    return JsonResponse(response_cache.stats())
 
-USERS_FILE = r'database/users.json'
+
+def metrics_view(request):
+    # Prometheus text exposition format. Metrics are per worker process.
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @csrf_exempt
@@ -192,28 +471,23 @@ def register_view(request):
         if not all([username, email, password]):
             return JsonResponse({'error': 'All fields are required'}, status=400)
 
-        try:
-            with open(USERS_FILE, 'r') as f:
-                users = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            users = []
-
-        if any(u['username'] == username for u in users):
+        if UserAccount.objects.filter(username=username).exists():
             return JsonResponse({'error': 'Username already exists'}, status=400)
-        if any(u['email'] == email for u in users):
+        if UserAccount.objects.filter(email=email).exists():
             return JsonResponse({'error': 'Email already registered'}, status=400)
 
         hashed_password = make_password(password)
 
-        new_user = {
-            'username': username,
-            'email': email,
-            'password': hashed_password
-        }
-        users.append(new_user)
-
-        with open(USERS_FILE, 'w') as f:
-            json.dump(users, f, indent=2)
+        try:
+            # The unique indexes still guard against two concurrent signups
+            # passing the checks above at the same time.
+            with transaction.atomic():
+                UserAccount.objects.create(
+                    username=username, email=email, password=hashed_password)
+        except IntegrityError:
+            if UserAccount.objects.filter(username=username).exists():
+                return JsonResponse({'error': 'Username already exists'}, status=400)
+            return JsonResponse({'error': 'Email already registered'}, status=400)
 
         return JsonResponse({'message': 'User registered successfully!'}, status=201)
 
@@ -230,24 +504,38 @@ def login_view(request):
         if not all([username, password]):
             return JsonResponse({'error': 'Username and password are required'}, status=400)
 
-        try:
-            with open(USERS_FILE, 'r') as f:
-                users = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return JsonResponse({'error': 'Invalid credentials'}, status=400)
+        client_ip = request.META.get('REMOTE_ADDR', '')
+        if not login_rate_limiter.allow(f'user:{username}', f'ip:{client_ip}'):
+            return JsonResponse({'error': 'Too many login attempts, try again later'}, status=429)
 
-        user_found = None
-        for user in users:
-            if user['username'] == username:
-                user_found = user
-                break
+        user_found = UserAccount.objects.filter(username=username).first()
 
-        if user_found and check_password(password, user_found['password']):
+        if user_found and check_password(password, user_found.password):
+            login_rate_limiter.reset(f'user:{username}')
+            token, expires_at = issue_token(user_found)
             return JsonResponse({
                 'message': f'Welcome back, {username}!',
-                'username': user_found['username']
+                'username': user_found.username,
+                'token': token,
+                'expires_at': expires_at.isoformat(),
             })
         else:
             return JsonResponse({'error': 'Invalid credentials'}, status=400)
 
     return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+
+@csrf_exempt
+def logout_view(request):
+    if request.method == 'POST':
+        token = token_from_request(request)
+        if token:
+            revoke_token(token)
+        return JsonResponse({'message': 'Logged out'})
+
+    return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+
+
+@token_required
+def me_view(request):
+    return JsonResponse({'username': request.auth['username']})
@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import CityRefresh, Listing
+
+
+@admin.register(Listing)
+class ListingAdmin(admin.ModelAdmin):
+    list_display = ("link", "source", "city", "listing_type", "area_m2", "first_seen", "last_seen")
+    list_filter = ("source", "listing_type", "city")
+    search_fields = ("link",)
+
+
+@admin.register(CityRefresh)
+class CityRefreshAdmin(admin.ModelAdmin):
+    list_display = ("city", "refreshed_at", "sale_count", "rent_count")
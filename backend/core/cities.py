@@ -0,0 +1,81 @@
+from bisect import bisect_left
+from difflib import get_close_matches
+from functools import lru_cache
+import json
+
+from django.conf import settings
+
+CITIES_FILE = settings.CITIES_FILE
+
+
+def _normalize(name: str):
+    return " ".join(name.strip().lower().split())
+
+
+class CityRegistry:
+    # Indexes over database/cities.json. Lookups accept the English name
+    # (case-insensitive), the Divar or Sheypoor slug, or the Persian name
+    # when the entry has one.
+    def __init__(self, cities: list):
+        self.cities = cities
+        self.by_english = {}
+        self.by_divar = {}
+        self.by_sheypoor = {}
+        self.by_persian = {}
+        for city in cities:
+            self.by_english.setdefault(_normalize(city["english"]), city)
+            self.by_divar.setdefault(city["divar"], city)
+            self.by_sheypoor.setdefault(city["sheypoor"], city)
+            if city.get("persian"):
+                self.by_persian.setdefault(_normalize(city["persian"]), city)
+
+        # Sorted (name, city) pairs for prefix search with bisect.
+        self._prefix_index = sorted(
+            [(name, city) for name, city in self.by_english.items()]
+            + [(name, city) for name, city in self.by_persian.items()],
+            key=lambda item: item[0])
+        self._prefix_keys = [name for name, _ in self._prefix_index]
+
+    def get(self, name: str):
+        key = _normalize(name)
+        return (self.by_english.get(key)
+                or self.by_divar.get(key)
+                or self.by_sheypoor.get(key)
+                or self.by_persian.get(key))
+
+    def search(self, query: str, limit: int = 10):
+        query = _normalize(query)
+        if not query:
+            return []
+
+        results = []
+        start = bisect_left(self._prefix_keys, query)
+        for name, city in self._prefix_index[start:]:
+            if not name.startswith(query) or len(results) >= limit:
+                break
+            if city not in results:
+                results.append(city)
+
+        if len(results) < limit:
+            # Typo tolerance once the prefix matches run out.
+            for name in get_close_matches(query, self.by_english, n=limit, cutoff=0.7):
+                city = self.by_english[name]
+                if city not in results:
+                    results.append(city)
+        return results[:limit]
+
+
+@lru_cache(maxsize=None)
+def get_city_registry():
+    with open(CITIES_FILE, 'r', encoding='utf-8') as f:
+        return CityRegistry(json.load(f))
+
+
+def city_key(city: dict):
+    # Name used for the city in the database, file names and cache keys.
+    return _normalize(city["english"])
+
+
+def city_slugs(city_name: str):
+    city = get_city_registry().get(city_name)
+    return city["divar"], city["sheypoor"]
@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.dedupe import dedupe_listings
+from core.market_stats import compute_city_stats
+from core.models import CityRefresh, Listing
+from core.scrapers.divaar_scrap import DivarScraper
+from core.scrapers.driver_pool import DriverPool
+from core.scrapers.link_cache import LinkCache
+from core.scrapers.sheypoor_scrap import SheypoorScraper
+from core.singleflight import FileLock
+from core.snapshots import snapshot_store
+
+SCRAP_DIR = settings.SCRAP_DIR
+LOCK_DIR = settings.LOCK_DIR
+
+
+def city_lock(city_name: str, timeout: float = None):
+    return FileLock(os.path.join(LOCK_DIR, f"{city_name}.lock"), timeout)
+
+
+def city_refreshed_at(city_name: str):
+    # Time of the city's last successful scrape; it also versions the data.
+    return CityRefresh.objects.filter(
+        city=city_name).values_list("refreshed_at", flat=True).first()
+
+
+def is_refresh_stale(refreshed_at):
+    return refreshed_at is None or timezone.now() - refreshed_at > timedelta(hours=settings.CITY_DATA_MAX_AGE_HOURS)
+
+
+def is_city_data_stale(city_name: str):
+    return is_refresh_stale(city_refreshed_at(city_name))
+
+
+def link_cache_filename(source: str):
+    return f"{SCRAP_DIR}/{source}_link_cache.json"
+
+
+def driver_pool():
+    # None when the pool is disabled.
+    if settings.SCRAPER_DRIVER_POOL_SIZE <= 0:
+        return None
+    return DriverPool.shared(settings.SCRAPER_DRIVER_POOL_SIZE,
+                             max_pages=settings.SCRAPER_DRIVER_MAX_PAGES,
+                             max_heap_mb=settings.SCRAPER_DRIVER_MAX_HEAP_MB,
+                             blocked_urls=settings.SCRAPER_BLOCKED_URLS)
+
+
+def _run_scraper(scraper_class, engine_key: str, city: str, scroll_count: int, progress=None):
+    link_cache = LinkCache.shared(link_cache_filename(engine_key),
+                                  timedelta(hours=settings.SCRAPER_LINK_CACHE_TTL_HOURS))
+    with scraper_class(workers=settings.SCRAPER_WORKERS, engine=settings.SCRAPER_DETAIL_ENGINES[engine_key], link_cache=link_cache, progress=progress, extraction=settings.SCRAPER_EXTRACTION, driver_pool=driver_pool(), blocked_urls=settings.SCRAPER_BLOCKED_URLS) as scraper:
+        return scraper.scrape(city, scroll_count,
+                              target_links=settings.SCRAPER_TARGET_LINKS,
+                              time_budget=settings.SCRAPER_LINK_TIME_BUDGET_SECONDS)
+
+
+class EmptyScrape(Exception):
+    pass
+
+
+def scrape_city(divar_city_name: str, sheypoor_city_name: str, progress=None):
+    # Both sites are scraped at the same time. A failing site only loses its
+    # own listings; an error is raised only when every source failed. A site
+    # that returned no listings at all counts as failed, since a city never
+    # has none. Returns (sales, rentals, failed sources).
+    # progress, when given, receives the scrapers' progress events.
+    sources = [
+        ("Divar", DivarScraper, "divar", divar_city_name, 2),
+        ("Sheypoor", SheypoorScraper, "sheypoor", sheypoor_city_name, 8),
+    ]
+    all_sales = []
+    all_rentals = []
+    errors = []
+    failed_sources = []
+
+    with ThreadPoolExecutor(len(sources)) as executor:
+        futures = [(name, engine_key, executor.submit(_run_scraper, scraper_class, engine_key, city, scroll_count, progress))
+                   for name, scraper_class, engine_key, city, scroll_count in sources]
+        for name, engine_key, future in futures:
+            try:
+                sale, rent = future.result()
+                if not sale and not rent:
+                    raise EmptyScrape(f"{name} returned no listings")
+            except Exception as e:
+                print(f"[ERROR] {name} scraping failed: {e}")
+                errors.append(e)
+                failed_sources.append(engine_key)
+                continue
+            all_sales += sale
+            all_rentals += rent
+
+    if len(errors) == len(sources):
+        raise errors[0]
+    return dedupe_listings(all_sales, "sale"), dedupe_listings(all_rentals, "rent"), failed_sources
+
+
+LISTING_UPDATE_FIELDS = [
+    "source", "city", "listing_type", "image", "alt_links", "area_m2", "building_age", "older_than_30", "age_order", "room_count",
+    "total_price_toman", "price_per_m2_toman", "deposit_toman", "mortgage_toman", "monthly_rent_toman",
+    "last_seen",
+]
+
+
+def save_city_data(city_name: str, all_sales: list, all_rentals: list, failed_sources=()):
+    # Upserts every scraped listing keyed by its link. first_seen is only set
+    # when a listing is inserted, so it keeps the date the ad first appeared.
+    # The refresh is also appended to the snapshot store, which keeps the
+    # prices the upsert overwrites. Returns the new refreshed_at of the city.
+    # When a source failed and the city was refreshed before, the listings
+    # are saved but the refresh is not recorded: refreshed_at, the stats and
+    # the snapshots keep describing the last complete refresh, so the failed
+    # source's listings stay current and the city stays stale until a
+    # refresh succeeds. The unchanged refreshed_at is returned then.
+    now = timezone.now()
+    rows = {}
+    for listing_type, listings in (("sale", all_sales), ("rent", all_rentals)):
+        for data in listings:
+            rows[data["link"]] = Listing.from_dict(
+                data, city_name, listing_type, now)
+
+    with transaction.atomic():
+        Listing.objects.bulk_create(
+            rows.values(), batch_size=500, update_conflicts=True,
+            unique_fields=["link"], update_fields=LISTING_UPDATE_FIELDS)
+        if failed_sources:
+            refreshed_at = city_refreshed_at(city_name)
+            if refreshed_at is not None:
+                print(f"[WARN] Not recording the {city_name} refresh, {', '.join(failed_sources)} failed.")
+                return refreshed_at
+        CityRefresh.objects.update_or_create(
+            city=city_name,
+            defaults={
+                "refreshed_at": now,
+                "sale_count": len(all_sales),
+                "rent_count": len(all_rentals),
+                "stats": compute_city_stats(all_sales, all_rentals),
+            })
+    try:
+        snapshot_store.append(city_name, now)
+    except OSError as e:
+        # The listings are saved; only this refresh's price history is lost.
+        print(f"[ERROR] Could not write the {city_name} snapshot: {e}")
+    return now
+
+
+def current_listings(city_name: str, listing_type: str = None):
+    # Listings seen by the latest refresh of the city.
+    refreshed_at = CityRefresh.objects.filter(
+        city=city_name).values_list("refreshed_at", flat=True).first()
+    if refreshed_at is None:
+        return Listing.objects.none()
+    listings = Listing.objects.filter(city=city_name, last_seen__gte=refreshed_at)
+    if listing_type is not None:
+        listings = listings.filter(listing_type=listing_type)
+    return listings
+
+
+def load_city_data(city_name: str):
+    all_sales = [listing.to_dict()
+                 for listing in current_listings(city_name, "sale").order_by("id")]
+    all_rentals = [listing.to_dict()
+                   for listing in current_listings(city_name, "rent").order_by("id")]
+    return all_sales, all_rentals
+
+
+def refresh_city_data(city_name: str, divar_city_name: str, sheypoor_city_name: str):
+    # Background refresh job. Another worker may have refreshed the city while
+    # this job was queued, so staleness is checked again under the city lock.
+    with city_lock(city_name):
+        if not is_city_data_stale(city_name):
+            return
+        print(f"[SCRAPER] Refreshing {city_name} in the background...")
+        save_city_data(city_name, *scrape_city(
+            divar_city_name, sheypoor_city_name))
+        print(f"[SCRAPER] Background refresh of {city_name} completed.")
+
+
+def get_city_stats(city_name: str):
+    refresh = CityRefresh.objects.filter(city=city_name).first()
+    if refresh is None:
+        return None
+    if not refresh.stats:
+        # Cities refreshed before stats existed get them computed once here.
+        all_sales, all_rentals = load_city_data(city_name)
+        refresh.stats = compute_city_stats(all_sales, all_rentals)
+        refresh.save(update_fields=["stats"])
+    return {
+        "city": city_name,
+        "refreshed_at": refresh.refreshed_at.isoformat(),
+        **refresh.stats,
+    }
@@ -0,0 +1,122 @@
+from collections import defaultdict
+import math
+
+from core.models import Listing
+
+# Two listings are considered the same apartment when rooms match and area,
+# building age and price are all within these tolerances.
+AREA_TOLERANCE = 0.03
+AREA_TOLERANCE_MIN_M2 = 2
+AGE_TOLERANCE = 1
+PRICE_TOLERANCE = 0.03
+# Listings are bucketed by rooms, area and price, and candidates are only
+# looked up in the listing's own and neighbouring buckets, so matching stays
+# close to O(n) instead of comparing every pair. Both tolerances are relative
+# to the larger value, so matching values are at most -log(1 - tolerance)
+# apart on a log scale: with buckets that wide, a match is always in the
+# same or a neighbouring bucket. Areas below the one where the 2 m² minimum
+# takes over share the lowest bucket.
+AREA_BUCKET_BASE = -math.log(1 - AREA_TOLERANCE)
+AREA_BUCKET_FLOOR_M2 = AREA_TOLERANCE_MIN_M2 / AREA_TOLERANCE
+PRICE_BUCKET_BASE = -math.log(1 - PRICE_TOLERANCE)
+
+
+def _deposit(listing):
+    return listing.get("deposit_toman", listing.get("mortgage_toman"))
+
+
+def _close(a, b, tolerance, minimum=0):
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= max(minimum, tolerance * max(abs(a), abs(b)))
+
+
+def _ages_match(a, b):
+    if a == "more than 30" or b == "more than 30":
+        return a == b
+    return _close(a, b, 0, AGE_TOLERANCE)
+
+
+def _prices_match(a, b, property_type):
+    if property_type == "sale":
+        if a.get("total_price_toman") and b.get("total_price_toman"):
+            return _close(a["total_price_toman"], b["total_price_toman"], PRICE_TOLERANCE)
+        return _close(a.get("price_per_m2_toman"), b.get("price_per_m2_toman"), PRICE_TOLERANCE)
+    return (_close(a.get("monthly_rent_toman"), b.get("monthly_rent_toman"), PRICE_TOLERANCE)
+            and _close(_deposit(a), _deposit(b), PRICE_TOLERANCE))
+
+
+def _area_bucket(area):
+    return int(math.log(max(area, AREA_BUCKET_FLOOR_M2)) / AREA_BUCKET_BASE)
+
+
+def _price_bucket(listing, property_type):
+    if property_type == "sale":
+        price = listing.get("total_price_toman") or listing.get("price_per_m2_toman")
+    else:
+        price = listing.get("monthly_rent_toman")
+    if not isinstance(price, int) or price <= 0:
+        return -1
+    return int(math.log(price) / PRICE_BUCKET_BASE)
+
+
+def is_duplicate(a, b, property_type):
+    return (a.get("room_count") == b.get("room_count")
+            and _close(a.get("area_m2"), b.get("area_m2"), AREA_TOLERANCE, AREA_TOLERANCE_MIN_M2)
+            and _ages_match(a.get("building_age"), b.get("building_age"))
+            and _prices_match(a, b, property_type))
+
+
+def _neighbour_keys(rooms, area_bucket, price_bucket):
+    price_buckets = [price_bucket] if price_bucket < 0 else [
+        price_bucket - 1, price_bucket, price_bucket + 1]
+    for area_key in (area_bucket - 1, area_bucket, area_bucket + 1):
+        for price_key in price_buckets:
+            yield rooms, area_key, price_key
+
+
+def dedupe_listings(listings, property_type):
+    # Merges the same apartment posted on both Divar and Sheypoor. The first
+    # listing is kept and gains a "links" list holding every source's link.
+    # Buckets are kept per source and only hold listings that have not been
+    # matched yet, so a listing is only compared with the other site's ads.
+    buckets = defaultdict(lambda: defaultdict(list))
+    sources = {source for source, _ in Listing.SOURCE_CHOICES}
+    result = []
+
+    for listing in listings:
+        area = listing.get("area_m2")
+        if not isinstance(area, int):
+            result.append(listing)
+            continue
+        rooms = listing.get("room_count")
+        area_bucket = _area_bucket(area)
+        price_bucket = _price_bucket(listing, property_type)
+        source = Listing.source_for_link(listing["link"])
+
+        match = None
+        for other_source in sources - {source}:
+            for key in _neighbour_keys(rooms, area_bucket, price_bucket):
+                candidates = buckets[other_source].get(key, ())
+                for index, candidate in enumerate(candidates):
+                    if is_duplicate(candidate, listing, property_type):
+                        match = candidates.pop(index)
+                        break
+                if match is not None:
+                    break
+            if match is not None:
+                break
+
+        if match is not None:
+            match["links"].append(listing["link"])
+            continue
+
+        merged = dict(listing, links=[listing["link"]])
+        buckets[source][(rooms, area_bucket, price_bucket)].append(merged)
+        result.append(merged)
+
+    duplicates = len(listings) - len(result)
+    if duplicates:
+        print(
+            f"[DEDUPE] Merged {duplicates} {property_type} listings posted on both sites.")
+    return result
@@ -0,0 +1,29 @@
+import numpy as np
+
+# Age used for listings scraped as "more than 30" years old.
+OLD_BUILDING_AGE = 35
+
+
+def _number(value):
+    if value == "more than 30":
+        return OLD_BUILDING_AGE
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return np.nan
+
+
+def listing_arrays(property_list):
+    columns = {
+        "area": "area_m2",
+        "age": "building_age",
+        "rooms": "room_count",
+        "total_price": "total_price_toman",
+        "price_per_m2": "price_per_m2_toman",
+        "monthly_rent": "monthly_rent_toman",
+    }
+    arrays = {name: np.fromiter((_number(prop.get(key)) for prop in property_list), dtype=float, count=len(property_list))
+              for name, key in columns.items()}
+    # Divar calls the rent deposit "deposit", Sheypoor calls it "mortgage".
+    arrays["deposit"] = np.fromiter(
+        (_number(prop.get("deposit_toman", prop.get("mortgage_toman"))) for prop in property_list), dtype=float, count=len(property_list))
+    return arrays
@@ -0,0 +1,25 @@
+import glob
+import json
+import os
+from django.core.management.base import BaseCommand
+from core.city_data import SCRAP_DIR, save_city_data
+
+
+class Command(BaseCommand):
+    help = 'Imports listings from the old database/scrap/{city}_sales.json and {city}_rentals.json files.'
+
+    def handle(self, *args, **kwargs):
+        for sale_filename in sorted(glob.glob(os.path.join(SCRAP_DIR, '*_sales.json'))):
+            city = os.path.basename(sale_filename)[:-len('_sales.json')]
+            rent_filename = os.path.join(SCRAP_DIR, f'{city}_rentals.json')
+
+            with open(sale_filename, 'r', encoding='utf-8') as f:
+                all_sales = json.load(f)
+            all_rentals = []
+            if os.path.exists(rent_filename):
+                with open(rent_filename, 'r', encoding='utf-8') as f:
+                    all_rentals = json.load(f)
+
+            save_city_data(city, all_sales, all_rentals)
+            self.stdout.write(self.style.SUCCESS(
+                f'Imported {len(all_sales)} sale and {len(all_rentals)} rent listings for {city}.'))
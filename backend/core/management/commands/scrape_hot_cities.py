@@ -1,11 +1,16 @@
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.core.management.base import BaseCommand
-from core.scrapers.divaar_scrap import DivarScraper
-from core.scrapers.sheypoor_scrap import SheypoorScraper
+from core.cities import city_slugs
+from core.city_data import city_lock, save_city_data, scrape_city
 
 
 class Command(BaseCommand):
-    help = 'Scrapes important cities and saves the data to JSON files.'
+    help = 'Scrapes important cities and saves the listings to the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=2,
+            help='Number of cities scraped at the same time.')
 
     def handle(self, *args, **kwargs):
         hot_cities = [
@@ -23,31 +28,54 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(
             'Starting the scheduled scraping process...'))
 
-        for city in hot_cities:
-            self.stdout.write(f'Scraping data for: {city}')
-            try:
-                with DivarScraper() as divar_scraper:
-                    divar_sale, divar_rent = divar_scraper.scrape(city, 2)
-                with SheypoorScraper() as sheypoor_scraper:
-                    sheypoor_sale, sheypoor_rent = sheypoor_scraper.scrape(city, 8)
-                all_sales = divar_sale + sheypoor_sale
-                all_rentals = divar_rent + sheypoor_rent
+        with ThreadPoolExecutor(max(1, kwargs['concurrency'])) as executor:
+            futures = {executor.submit(self.scrape_and_save, city): city
+                       for city in hot_cities}
+            for future in as_completed(futures):
+                city = futures[future]
+                try:
+                    all_sales, all_rentals, failed_sources, summaries = future.result()
+                    if failed_sources:
+                        self.stderr.write(self.style.WARNING(
+                            f'Scraping {", ".join(failed_sources)} failed for {city}; kept their previous listings. Found {len(all_sales)} sale and {len(all_rentals)} rent listings.'))
+                    else:
+                        self.stdout.write(self.style.SUCCESS(
+                            f'Successfully scraped and saved data for {city}. Found {len(all_sales)} sale and {len(all_rentals)} rent listings.'))
+                    for summary in summaries:
+                        self.write_summary(city, summary)
 
-                sale_filename = f"database/scrap/{city}_sales.json"
-                rent_filename = f"database/scrap/{city}_rentals.json"
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(
+                        f'An error occurred while scraping {city}: {e}'))
 
-                with open(sale_filename, 'w', encoding='utf-8') as f:
-                    json.dump(all_sales, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            'Scheduled scraping process finished successfully!'))
 
-                with open(rent_filename, 'w', encoding='utf-8') as f:
-                    json.dump(all_rentals, f, ensure_ascii=False, indent=2)
+    def scrape_and_save(self, city):
+        # Shares the per-city lock with get-data so they never scrape the
+        # same city at once.
+        summaries = []
 
-                self.stdout.write(self.style.SUCCESS(
-                    f'Successfully scraped and saved data for {city}. Found {len(all_sales)} sale and {len(all_rentals)} rent listings.'))
+        def progress(event):
+            if event["phase"] == "scrape_summary":
+                summaries.append(event["summary"])
 
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(
-                    f'An error occurred while scraping {city}: {e}'))
+        with city_lock(city):
+            self.stdout.write(f'Scraping data for: {city}')
+            all_sales, all_rentals, failed_sources = scrape_city(*city_slugs(city), progress)
+            save_city_data(city, all_sales, all_rentals, failed_sources)
+        return all_sales, all_rentals, failed_sources, summaries
 
-        self.stdout.write(self.style.SUCCESS(
-            'Scheduled scraping process finished successfully!'))
+    def write_summary(self, city, summary):
+        ads = summary['ads']
+        self.stdout.write(
+            f"  [{city} / {summary['source']}] {summary['elapsed_s']}s total, "
+            f"{summary['links']} links, {ads.get('sale', 0)} sale, {ads.get('rent', 0)} rent, "
+            f"{ads.get('failed', 0)} failed, {ads.get('cached', 0)} cached, "
+            f"{summary['ads_per_second']} ads/s")
+        self.stdout.write(
+            f"    drivers: {summary['drivers']} started in {summary['driver_startup_s']}s; "
+            f"phases: {summary['phases_s']}; page loads: {summary['page_loads']} "
+            f"(p50 {summary['page_load_p50_s']}s, p95 {summary['page_load_p95_s']}s)")
+        self.stdout.write(
+            f"    timeouts: {summary['timeouts'] or 'none'}; parse errors: {summary['parse_errors'] or 'none'}")
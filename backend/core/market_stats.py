@@ -0,0 +1,98 @@
+import numpy as np
+
+from core.listing_arrays import listing_arrays
+
+PERCENTILES = [10, 25, 50, 75, 90]
+HISTOGRAM_BINS = 20
+
+
+def _finite(values):
+    return values[np.isfinite(values)]
+
+
+def _summary(values):
+    values = _finite(values)
+    if not values.size:
+        return None
+    points = np.percentile(values, PERCENTILES)
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": {f"p{p}": float(v) for p, v in zip(PERCENTILES, points)},
+    }
+
+
+def _histogram(values):
+    values = _finite(values)
+    if not values.size:
+        return None
+    # The top 1% is clipped into the last bin so that a few luxury listings
+    # do not squeeze every other listing into the first bin.
+    upper = np.percentile(values, 99)
+    counts, edges = np.histogram(np.minimum(values, upper), bins=HISTOGRAM_BINS)
+    return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def _older_than_30(property_list):
+    return np.fromiter((prop.get("building_age") == "more than 30" for prop in property_list),
+                       dtype=bool, count=len(property_list))
+
+
+def _metrics(property_list, property_type):
+    arrays = listing_arrays(property_list)
+    area = np.where(arrays["area"] > 0, arrays["area"], np.nan)
+    # listing_arrays counts "more than 30" as a fixed age for ranking; the
+    # published age stats leave those listings out and count them apart.
+    age = np.where(_older_than_30(property_list), np.nan, arrays["age"])
+    if property_type == "sale":
+        return arrays, {
+            "price_per_m2_toman": arrays["price_per_m2"],
+            "total_price_toman": arrays["total_price"],
+            "area_m2": arrays["area"],
+            "building_age": age,
+        }
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rent_per_m2 = arrays["monthly_rent"] / area
+    return arrays, {
+        "monthly_rent_toman": arrays["monthly_rent"],
+        "deposit_toman": arrays["deposit"],
+        "rent_per_m2_toman": rent_per_m2,
+        "area_m2": arrays["area"],
+        "building_age": age,
+    }
+
+
+def compute_type_stats(property_list, property_type):
+    arrays, metrics = _metrics(property_list, property_type)
+    histogram_metric = "price_per_m2_toman" if property_type == "sale" else "monthly_rent_toman"
+
+    rooms = arrays["rooms"]
+    by_rooms = {}
+    for room_count in np.unique(_finite(rooms)):
+        mask = rooms == room_count
+        by_rooms[str(int(room_count))] = {
+            "count": int(mask.sum()),
+            **{f"median_{name}": (float(np.median(_finite(values[mask])))
+                                  if _finite(values[mask]).size else None)
+               for name, values in metrics.items() if name != "building_age"},
+        }
+
+    return {
+        "count": len(property_list),
+        "older_than_30_count": int(_older_than_30(property_list).sum()),
+        "metrics": {name: _summary(values) for name, values in metrics.items()},
+        "histogram": {
+            "metric": histogram_metric,
+            **(_histogram(metrics[histogram_metric]) or {"edges": [], "counts": []}),
+        },
+        "by_rooms": by_rooms,
+    }
+
+
+def compute_city_stats(all_sales, all_rentals):
+    return {
+        "sales": compute_type_stats(all_sales, "sale"),
+        "rentals": compute_type_stats(all_rentals, "rent"),
+    }
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=64, unique=True)),
+                ('refreshed_at', models.DateTimeField()),
+                ('sale_count', models.PositiveIntegerField(default=0)),
+                ('rent_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Listing',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('link', models.URLField(max_length=500, unique=True)),
+                ('source', models.CharField(choices=[('divar', 'Divar'), ('sheypoor', 'Sheypoor')], max_length=16)),
+                ('city', models.CharField(max_length=64)),
+                ('listing_type', models.CharField(choices=[('sale', 'Sale'), ('rent', 'Rent')], max_length=8)),
+                ('image', models.URLField(blank=True, max_length=1000)),
+                ('area_m2', models.PositiveIntegerField(null=True)),
+                ('building_age', models.PositiveSmallIntegerField(null=True)),
+                ('older_than_30', models.BooleanField(default=False)),
+                ('room_count', models.PositiveSmallIntegerField(null=True)),
+                ('total_price_toman', models.BigIntegerField(null=True)),
+                ('price_per_m2_toman', models.BigIntegerField(null=True)),
+                ('deposit_toman', models.BigIntegerField(null=True)),
+                ('mortgage_toman', models.BigIntegerField(null=True)),
+                ('monthly_rent_toman', models.BigIntegerField(null=True)),
+                ('first_seen', models.DateTimeField()),
+                ('last_seen', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['city', 'listing_type', 'last_seen'], name='core_listin_city_33e82a_idx')],
+            },
+        ),
+    ]
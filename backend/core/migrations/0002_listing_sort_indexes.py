@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city', 'listing_type', 'total_price_toman', 'id'], name='core_listin_city_5512b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city', 'listing_type', 'monthly_rent_toman', 'id'], name='core_listin_city_c52e62_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city', 'listing_type', 'price_per_m2_toman', 'id'], name='core_listin_city_8077e7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city', 'listing_type', 'area_m2', 'id'], name='core_listin_city_6d72e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city', 'listing_type', 'building_age', 'id'], name='core_listin_city_cff10e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city', 'listing_type', 'first_seen', 'id'], name='core_listin_city_02ed5a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_listing_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cityrefresh',
+            name='stats',
+            field=models.JSONField(default=dict),
+        ),
+    ]
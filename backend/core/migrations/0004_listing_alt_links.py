@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_cityrefresh_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='alt_links',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:25
+
+from django.db import migrations, models
+
+# Same as core.models.OLDER_THAN_30_AGE_ORDER when this migration was written.
+OLDER_THAN_30_AGE_ORDER = 1000
+
+
+def fill_age_order(apps, schema_editor):
+    Listing = apps.get_model('core', 'Listing')
+    Listing.objects.filter(older_than_30=True).update(age_order=OLDER_THAN_30_AGE_ORDER)
+    Listing.objects.filter(older_than_30=False).update(age_order=models.F('building_age'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_listing_alt_links'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='listing',
+            name='core_listin_city_cff10e_idx',
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='age_order',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.RunPython(fill_age_order, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['city', 'listing_type', 'age_order', 'id'], name='core_listin_city_abae00_idx'),
+        ),
+    ]
@@ -1,3 +1,130 @@
 from django.db import models
 
-# Create your models here.
+# Largest values of the positive integer columns on every supported database.
+POSITIVE_INTEGER_MAX = 2147483647
+POSITIVE_SMALL_INTEGER_MAX = 32767
+# age_order of listings stored as older than 30 years, whose exact age is
+# unknown; it places them after every listing with a known age.
+OLDER_THAN_30_AGE_ORDER = 1000
+
+
+def _in_range(value, maximum):
+    # The positive columns have a CHECK (>= 0) constraint, and a single
+    # violating row would fail the whole bulk insert of a refresh, so a value
+    # a parser got wrong is stored as unknown instead.
+    if isinstance(value, int) and 0 <= value <= maximum:
+        return value
+    return None
+
+
+class Listing(models.Model):
+    SOURCE_CHOICES = [
+        ("divar", "Divar"),
+        ("sheypoor", "Sheypoor"),
+    ]
+    TYPE_CHOICES = [
+        ("sale", "Sale"),
+        ("rent", "Rent"),
+    ]
+
+    link = models.URLField(max_length=500, unique=True)
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES)
+    city = models.CharField(max_length=64)
+    listing_type = models.CharField(max_length=8, choices=TYPE_CHOICES)
+    image = models.URLField(max_length=1000, blank=True)
+    # Links of the same apartment posted on the other site, see core.dedupe.
+    alt_links = models.JSONField(default=list)
+
+    area_m2 = models.PositiveIntegerField(null=True)
+    # Scrapers report "more than 30" instead of an exact age for old buildings.
+    building_age = models.PositiveSmallIntegerField(null=True)
+    older_than_30 = models.BooleanField(default=False)
+    # Sort key for the age: building_age, or OLDER_THAN_30_AGE_ORDER.
+    age_order = models.PositiveSmallIntegerField(null=True)
+    room_count = models.PositiveSmallIntegerField(null=True)
+
+    total_price_toman = models.BigIntegerField(null=True)
+    price_per_m2_toman = models.BigIntegerField(null=True)
+    deposit_toman = models.BigIntegerField(null=True)
+    mortgage_toman = models.BigIntegerField(null=True)
+    monthly_rent_toman = models.BigIntegerField(null=True)
+
+    first_seen = models.DateTimeField()
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["city", "listing_type", "last_seen"]),
+            # Keyset pagination orders by one of these columns plus id.
+            models.Index(fields=["city", "listing_type", "total_price_toman", "id"]),
+            models.Index(fields=["city", "listing_type", "monthly_rent_toman", "id"]),
+            models.Index(fields=["city", "listing_type", "price_per_m2_toman", "id"]),
+            models.Index(fields=["city", "listing_type", "area_m2", "id"]),
+            models.Index(fields=["city", "listing_type", "age_order", "id"]),
+            models.Index(fields=["city", "listing_type", "first_seen", "id"]),
+        ]
+
+    def __str__(self):
+        return self.link
+
+    @staticmethod
+    def source_for_link(link: str):
+        return "sheypoor" if "sheypoor.com" in link else "divar"
+
+    @classmethod
+    def from_dict(cls, data: dict, city: str, listing_type: str, seen_at):
+        age = data.get("building_age")
+        if isinstance(age, int) and age < 0:
+            # Pre-sale buildings are listed with a construction year that
+            # has not come yet.
+            age = 0
+        building_age = None if age == "more than 30" else _in_range(age, POSITIVE_SMALL_INTEGER_MAX)
+        return cls(
+            link=data["link"],
+            source=cls.source_for_link(data["link"]),
+            city=city,
+            listing_type=listing_type,
+            image=data.get("image") or "",
+            alt_links=[link for link in data.get("links", []) if link != data["link"]],
+            area_m2=_in_range(data.get("area_m2"), POSITIVE_INTEGER_MAX),
+            building_age=building_age,
+            older_than_30=age == "more than 30",
+            age_order=OLDER_THAN_30_AGE_ORDER if age == "more than 30" else building_age,
+            room_count=_in_range(data.get("room_count"), POSITIVE_SMALL_INTEGER_MAX),
+            total_price_toman=data.get("total_price_toman"),
+            price_per_m2_toman=data.get("price_per_m2_toman"),
+            deposit_toman=data.get("deposit_toman"),
+            mortgage_toman=data.get("mortgage_toman"),
+            monthly_rent_toman=data.get("monthly_rent_toman"),
+            first_seen=seen_at,
+            last_seen=seen_at,
+        )
+
+    def to_dict(self):
+        # Same shape the scrapers produce, so callers do not care whether a
+        # listing came from the database or from a fresh scrape.
+        data = {
+            "link": self.link,
+            "image": self.image,
+            "links": [self.link, *self.alt_links],
+            "area_m2": self.area_m2,
+            "building_age": "more than 30" if self.older_than_30 else self.building_age,
+            "room_count": self.room_count,
+        }
+        for field in ("total_price_toman", "price_per_m2_toman", "deposit_toman", "mortgage_toman", "monthly_rent_toman"):
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        return data
+
+
+class CityRefresh(models.Model):
+    city = models.CharField(max_length=64, unique=True)
+    refreshed_at = models.DateTimeField()
+    sale_count = models.PositiveIntegerField(default=0)
+    rent_count = models.PositiveIntegerField(default=0)
+    # Market aggregates computed once per refresh, see core.market_stats.
+    stats = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"{self.city} @ {self.refreshed_at:%Y-%m-%d %H:%M}"
@@ -0,0 +1,38 @@
+from collections import defaultdict
+from threading import Lock
+
+
+class ProgressHub:
+    # Fans the progress events of a running job out to every listener of its
+    # key, so requests that joined an in-flight scrape see its progress too.
+    # The latest event of each phase and source is kept until the job
+    # finishes and is replayed to listeners that subscribe late.
+    def __init__(self):
+        self._lock = Lock()
+        self._listeners = defaultdict(list)
+        self._latest = defaultdict(dict)
+
+    def subscribe(self, key: str, listener):
+        with self._lock:
+            self._listeners[key].append(listener)
+            for event in self._latest.get(key, {}).values():
+                listener(event)
+
+    def unsubscribe(self, key: str, listener):
+        with self._lock:
+            listeners = self._listeners.get(key, [])
+            if listener in listeners:
+                listeners.remove(listener)
+            if not listeners:
+                self._listeners.pop(key, None)
+
+    def publish(self, key: str, event: dict):
+        # Listeners are called under the lock and must not block.
+        with self._lock:
+            self._latest[key][(event.get("phase"), event.get("source"))] = event
+            for listener in self._listeners.get(key, ()):
+                listener(event)
+
+    def finish(self, key: str):
+        with self._lock:
+            self._latest.pop(key, None)
@@ -0,0 +1,49 @@
+from queue import Queue
+from threading import Lock, Thread
+
+from django.db import close_old_connections
+
+
+class RefreshQueue:
+    # In-process background job queue. Jobs are keyed so a city that is
+    # already waiting or being refreshed is not queued a second time.
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self._queue = Queue()
+        self._pending = set()
+        self._lock = Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = Thread(target=self._run,
+                            name=f"refresh-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, key: str, fn, *args):
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            self._ensure_started()
+        self._queue.put((key, fn, args))
+        return True
+
+    def _run(self):
+        while True:
+            key, fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[ERROR] Background refresh of {key} failed: {e}")
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+
+refresh_queue = RefreshQueue()
@@ -1,42 +1,378 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from queue import Queue
+from threading import BoundedSemaphore, Lock
+import time
+
+from requests.adapters import HTTPAdapter
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException
 from selenium import webdriver
+from tqdm import tqdm
+import requests
+
+from .stats import RunStats
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36'
+# Ads whose title contains one of these words are not residential and are skipped.
+SKIP_WORDS = ["روزانه", "صنعتی", "تجاری", "اداری", "پانسیون",
+              "مغازه", "هم خونه", "همخونه", "هم خانه", "همخانه"]
+
+
+# Number of cards and the link of the last one; it changes when a scroll
+# loads more cards, even on lists that recycle their elements.
+CARD_SIGNATURE_SCRIPT = """
+const cards = document.querySelectorAll(arguments[0]);
+return [cards.length, cards.length ? cards[cards.length - 1].href : null];
+"""
+AT_BOTTOM_SCRIPT = """
+return window.scrollY + window.innerHeight >= document.documentElement.scrollHeight - 2;
+"""
+
+
+def chrome_options(is_headless: bool = True):
+    options = Options()
+    prefs = {"profile.managed_default_content_settings.images": 2}
+    options.add_experimental_option("prefs", prefs)
+    options.add_argument('--disable-gpu')
+    options.add_argument('--window-size=1920,1080')
+
+    options.add_argument('--disable-logging')
+    options.add_argument("--log-level=3")
+    options.add_argument('--disable-background-networking')
+    options.add_argument('--disable-client-side-phishing-detection')
+    options.add_argument('--disable-default-apps')
+    options.add_argument('--disable-sync')
+    options.add_argument('--metrics-recording-only')
+    options.add_argument('--no-first-run')
+    options.add_argument('--disable-component-update')
+    options.add_argument('--disable-domain-reliability')
+    options.add_argument('--disable-breakpad')
+
+    options.add_argument(f'user-agent={USER_AGENT}')
+    if is_headless:
+        options.add_argument('--headless=new')
+    return options
+
+
+def block_urls(driver, patterns):
+    # Requests matching one of the wildcard patterns fail in the browser
+    # before they are sent. Network.setBlockedURLs stays in effect for the
+    # tab across navigations.
+    if patterns:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(patterns)})
 
 
-class BaseScraper:
-    def __init__(self, is_headless: bool = True):
+def launch_driver(is_headless: bool = True, blocked_urls=()):
+    driver = webdriver.Chrome(options=chrome_options(is_headless))
+    try:
+        block_urls(driver, blocked_urls)
+    except Exception:
+        driver.quit()
+        raise
+    return driver
+
+
+def is_skipped_title(title: str):
+    return any(word in title for word in SKIP_WORDS)
+
+
+class BaseScraper(ABC):
+    name = "Base"
+    # Upper bound on detail pages fetched at the same time from one site,
+    # shared by every scraper instance in the process.
+    max_concurrency = 4
+    # Link harvesting waits up to this long after a scroll for new cards.
+    scroll_settle_seconds = 3
+
+    _site_slots = {}
+    _site_slots_lock = Lock()
+
+    # "selenium" renders every detail page in Chrome, "http" downloads the
+    # server-rendered HTML over a pooled keep-alive session instead. Link
+    # harvesting always needs the browser because it relies on scrolling.
+    ENGINES = ("selenium", "http")
+    # How data is read from a rendered page: "script" runs one execute_script
+    # per page that returns everything as JSON, "elements" reads it element by
+    # element, which costs a WebDriver round trip per call.
+    EXTRACTIONS = ("script", "elements")
+
+    def __init__(self, is_headless: bool = True, workers: int = 1, engine: str = "selenium", http_timeout: float = 10, link_cache=None, progress=None, extraction: str = "script", driver_pool=None, blocked_urls=()):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scraper engine: {engine}")
+        if extraction not in self.EXTRACTIONS:
+            raise ValueError(f"Unknown extraction mode: {extraction}")
         self.is_headless = is_headless
+        self.workers = max(1, workers)
+        self.engine = engine
+        self.extraction = extraction
+        self.http_timeout = http_timeout
         self.driver = None
+        self.session = None
+        self.link_cache = link_cache
+        # With a DriverPool, drivers are leased from it instead of launched;
+        # blocked_urls only applies to drivers launched by the scraper itself.
+        self.driver_pool = driver_pool
+        self.blocked_urls = blocked_urls
+        self._pooled = None
+        # Optional callable receiving progress events as dicts, for example
+        # {"phase": "details_scraped", "source": "Divar", "done": 3, "total": 40}.
+        self.progress = progress
+        self.stats = RunStats(self.name, engine)
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.max_concurrency, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept-Language": "fa-IR,fa;q=0.9,en;q=0.8",
+        })
+        return session
 
     def __enter__(self):
-        options = Options()
-        prefs = {"profile.managed_default_content_settings.images": 2}
-        options.add_experimental_option("prefs", prefs)
-        options.add_argument('--disable-gpu')
-        options.add_argument('--window-size=1920,1080')
-
-        options.add_argument('--disable-logging')
-        options.add_argument("--log-level=3")
-        options.add_argument('--disable-background-networking')
-        options.add_argument('--disable-client-side-phishing-detection')
-        options.add_argument('--disable-default-apps')
-        options.add_argument('--disable-sync')
-        options.add_argument('--metrics-recording-only')
-        options.add_argument('--no-first-run')
-        options.add_argument('--disable-component-update')
-        options.add_argument('--disable-domain-reliability')
-        options.add_argument('--disable-breakpad')
-
-        options.add_argument(
-            'user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36')
-        if self.is_headless:
-            options.add_argument('--headless=new')
-
-        self.driver = webdriver.Chrome(options=options)
+        if self.driver_pool is not None:
+            self._pooled, startup_seconds = self.driver_pool.lease()
+            self.driver = self._pooled.driver
+        else:
+            started = time.perf_counter()
+            self.driver = launch_driver(self.is_headless, self.blocked_urls)
+            startup_seconds = time.perf_counter() - started
+        # Warm drivers from the pool cost no startup.
+        if startup_seconds is not None:
+            self.stats.driver_started(startup_seconds)
+        if self.engine == "http":
+            self.session = self._build_session()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.driver:
+        if self._pooled is not None:
+            self.driver_pool.release(self._pooled)
+            self._pooled = None
+        elif self.driver:
             self.driver.quit()
+        self.driver = None
+        if self.session:
+            self.session.close()
+
+    @classmethod
+    def _site_semaphore(cls):
+        with cls._site_slots_lock:
+            if cls.name not in cls._site_slots:
+                cls._site_slots[cls.name] = BoundedSemaphore(
+                    cls.max_concurrency)
+            return cls._site_slots[cls.name]
+
+    def _start_worker(self):
+        # Extra driver for _scrape_all_details; it records into this run's stats.
+        worker = type(self)(self.is_headless, extraction=self.extraction,
+                            driver_pool=self.driver_pool, blocked_urls=self.blocked_urls)
+        worker.stats = self.stats
+        return worker.__enter__()
+
+    def _load_page(self, url: str, page: str):
+        started = time.perf_counter()
+        self.driver.get(url)
+        if self._pooled is not None:
+            self._pooled.pages += 1
+        self.stats.page_loaded(page, time.perf_counter() - started)
+
+    def _wait_for_cards(self, card_selector: str, timeout: float):
+        # Waits for the first cards of a listing page; False on timeout.
+        try:
+            with self.stats.timed("wait"):
+                WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, card_selector)))
+            return True
+        except TimeoutException:
+            self.stats.timeout("listing")
+            return False
+
+    def _card_signature(self, card_selector: str):
+        return self.driver.execute_script(CARD_SIGNATURE_SCRIPT, card_selector)
+
+    def _harvest_links(self, page_links, scroll, card_selector: str, max_scrolls: int, target_links: int = None, time_budget: float = None, max_idle_scrolls: int = 2):
+        # Collects page_links() and calls scroll(step) until target_links
+        # unique links are found, time_budget seconds have passed,
+        # max_scrolls scrolls are done, or max_idle_scrolls scrolls in a row
+        # ended at the bottom of the page without a new link. After a scroll
+        # it waits for the card list to change rather than sleeping for a
+        # fixed time.
+        deadline = time.monotonic() + time_budget if time_budget else None
+        links = set()
+        scrolls = 0
+        idle_scrolls = 0
+        while True:
+            found = len(links)
+            links.update(page_links())
+            if scrolls and len(links) == found and self.driver.execute_script(AT_BOTTOM_SCRIPT):
+                idle_scrolls += 1
+            else:
+                idle_scrolls = 0
+            remaining = deadline - time.monotonic() if deadline else None
+
+            if target_links and len(links) >= target_links:
+                reason = f"reached {target_links} links"
+            elif scrolls >= max_scrolls:
+                reason = f"did {max_scrolls} scrolls"
+            elif idle_scrolls >= max_idle_scrolls:
+                reason = f"no new cards in {idle_scrolls} scrolls"
+            elif remaining is not None and remaining <= 0:
+                reason = f"time budget of {time_budget}s used"
+            else:
+                signature = self._card_signature(card_selector)
+                scroll(scrolls)
+                scrolls += 1
+                timeout = self.scroll_settle_seconds
+                if remaining is not None:
+                    timeout = min(timeout, remaining)
+                try:
+                    with self.stats.timed("wait"):
+                        WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(
+                            lambda driver: self._card_signature(card_selector) != signature)
+                except TimeoutException:
+                    pass
+                continue
+
+            print(f"[{self.name} Scraper] Stopped scrolling: {reason}.")
+            return list(links)
+
+    def _wait_for_image(self, selector: str, default: str):
+        try:
+            image_element = WebDriverWait(self.driver, 2).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
+            return image_element.get_attribute("src")
+        except TimeoutException:
+            self.stats.timeout("image")
+            return default
+        except Exception:
+            return default
+
+    @abstractmethod
+    def _scrape_ad_details(self, link: str):
+        # Renders the ad's page in self.driver; returns (ad_data, ad_type).
+        pass
+
+    @abstractmethod
+    def _parse_ad_html(self, link: str, html: str):
+        # Parses a downloaded ad page for the "http" engine; returns
+        # (ad_data, ad_type).
+        pass
+
+    def _fetch_ad_details(self, link: str):
+        started = time.perf_counter()
+        try:
+            response = self.session.get(link, timeout=self.http_timeout)
+            response.raise_for_status()
+        except requests.Timeout:
+            self.stats.timeout("detail")
+            print(f"[{self.name} Scraper] Timed out fetching {link}")
+            return None, None
+        except requests.RequestException as e:
+            self.stats.parse_error("http_error")
+            print(f"[{self.name} Scraper] Error fetching {link}: {e}")
+            return None, None
+        self.stats.page_loaded("detail", time.perf_counter() - started)
+        return self._parse_ad_html(link, response.text)
+
+    def _report(self, phase: str, **data):
+        if self.progress is not None:
+            self.progress({"phase": phase, "source": self.name, **data})
+
+    def _tracked(self, results, done: int, total: int):
+        for result in results:
+            done += 1
+            self._report("details_scraped", done=done, total=total)
+            yield result
+
+    def _collect(self, results, for_sale: list, for_rent: list):
+        for ad_data, ad_type in results:
+            if ad_type == 'sale':
+                for_sale.append(ad_data)
+            elif ad_type == 'rent':
+                for_rent.append(ad_data)
+
+    def _scrape_all_details(self, ad_links: list):
+        for_sale = []
+        for_rent = []
+        total = len(ad_links)
+
+        if self.link_cache is not None:
+            cached = []
+            missing = []
+            for link in ad_links:
+                entry = self.link_cache.get(link)
+                if entry is None:
+                    missing.append(link)
+                else:
+                    cached.append(entry)
+            print(
+                f"[{self.name} Scraper] Reusing {len(cached)} cached ads, fetching {len(missing)}.")
+            self._collect(cached, for_sale, for_rent)
+            self.stats.ad("cached", len(cached))
+            ad_links = missing
+
+        self._report("details_scraped", done=total - len(ad_links), total=total)
+        if not ad_links:
+            return for_sale, for_rent
+
+        pool_size = min(self.workers, self.max_concurrency, len(ad_links))
+        semaphore = self._site_semaphore()
+
+        with self.stats.timed("details"), ExitStack() as stack:
+            scrapers = Queue()
+            scrapers.put(self)
+            if self.engine == "http":
+                # The shared session is thread-safe, so every worker reuses it.
+                for _ in range(pool_size - 1):
+                    scrapers.put(self)
+            elif pool_size > 1:
+                with ThreadPoolExecutor(pool_size - 1) as executor:
+                    futures = [executor.submit(self._start_worker)
+                               for _ in range(pool_size - 1)]
+                for future in futures:
+                    try:
+                        scraper = future.result()
+                    except Exception as e:
+                        print(
+                            f"[{self.name} Scraper] Could not start worker driver: {e}")
+                        pool_size -= 1
+                        continue
+                    stack.push(scraper.__exit__)
+                    scrapers.put(scraper)
+
+            def scrape_one(link):
+                scraper = scrapers.get()
+                try:
+                    with semaphore:
+                        if scraper.engine == "http":
+                            ad_data, ad_type = scraper._fetch_ad_details(link)
+                        else:
+                            ad_data, ad_type = scraper._scrape_ad_details(link)
+                finally:
+                    scrapers.put(scraper)
+                self.stats.ad(ad_type or "failed")
+                # Failed pages are not cached; they may just have timed out.
+                if self.link_cache is not None and ad_type is not None:
+                    self.link_cache.put(link, ad_data, ad_type)
+                return ad_data, ad_type
+
+            with ThreadPoolExecutor(max(1, pool_size)) as executor:
+                results = executor.map(scrape_one, ad_links)
+                results = self._tracked(results, total - len(ad_links), total)
+                self._collect(tqdm(results, total=len(ad_links), desc=f"Scraping {self.name} Details"),
+                              for_sale, for_rent)
+
+        if self.link_cache is not None:
+            self.link_cache.save()
+        return for_sale, for_rent
 
 
 if __name__ == "__main__":
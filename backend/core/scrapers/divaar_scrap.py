@@ -3,134 +3,188 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from persian_tools import digits
-from tqdm import tqdm
-from time import sleep
+from bs4 import BeautifulSoup
 from datetime import datetime
 
-from .base_scraper import BaseScraper
+from .base_scraper import BaseScraper, is_skipped_title
+from .stats import parse_failed
+
+INFO_VALUE_SELECTOR = "td.kt-group-row-item.kt-group-row-item__value.kt-group-row-item--info-row"
+ROW_VALUE_SELECTOR = "p.kt-unexpandable-row__value"
+ROW_TITLE_SELECTOR = "p.kt-base-row__title.kt-unexpandable-row__title"
+IMAGE_SELECTOR = "img.kt-image-block__image.kt-image-block__image--fading"
+DEFAULT_IMAGE = "https://iliadata.ir/images/estate_images/default.jpg"
+CARD_SELECTOR = "a.kt-post-card__action"
+
+# Extraction scripts for the "script" mode, one WebDriver call per page.
+CARDS_SCRIPT = """
+return Array.from(document.querySelectorAll(arguments[0]), card => {
+    const title = card.querySelector("h2");
+    return {href: card.href, title: title ? title.innerText.trim() : ""};
+});
+"""
+DETAILS_SCRIPT = """
+const texts = selector => Array.from(
+    document.querySelectorAll(selector), el => el.innerText.trim());
+const image = document.querySelector(arguments[3]);
+return {
+    info: texts(arguments[0]),
+    values: texts(arguments[1]),
+    keys: texts(arguments[2]),
+    image: image ? image.getAttribute("src") : null,
+};
+"""
+
+
+def parse_ad_fields(link: str, keys: list, value1: list, value2: list, image_url: str, stats=None):
+    try:
+        value1 = [digits.convert_to_en(val) for val in value1]
+        value2 = [digits.convert_to_en(val) for val in value2]
+
+        if value2[2] == "بدون اتاق":
+            value2[2] = 0
+        # The digits are already converted, so the label is compared with
+        # English digits too.
+        if value2[1] == "قبل از 1370":
+            building_age = "more than 30"
+        else:
+            current_year = datetime.now().year - 621
+            building_age = current_year - int(value2[1])
+
+        ad_data = {
+            "link": link,
+            "image": image_url,
+            "area_m2": int(value2[0]),
+            "building_age": building_age,
+            "room_count": int(value2[2])
+        }
+
+        if 'قیمت کل' in keys:
+            total_price = keys.index("قیمت کل")
+            price_per_m2 = keys.index("قیمت هر متر")
+            if value1[total_price].replace("،", "").replace(" تومان", "") == "توافقی":
+                return parse_failed(stats, "negotiable_price")
+            if value1[price_per_m2].replace("،", "").replace(" تومان", "") == "توافقی":
+                return parse_failed(stats, "negotiable_price")
+            ad_data["total_price_toman"] = int(value1[total_price].replace(
+                "،", "").replace(" تومان", ""))
+            ad_data["price_per_m2_toman"] = int(value1[price_per_m2].replace(
+                "،", "").replace(" تومان", ""))
+            return ad_data, "sale"
+        elif 'ودیعه' in keys:
+            deposit = keys.index("ودیعه")
+            rent = keys.index("اجارهٔ ماهانه")
+            ad_data["deposit_toman"] = int(value1[deposit].replace(
+                "،", "").replace(" تومان", ""))
+            ad_data["monthly_rent_toman"] = int(value1[rent].replace(
+                "،", "").replace(" تومان", ""))
+            return ad_data, "rent"
+        else:
+            return parse_failed(stats, "unknown_type")
+
+    except Exception as e:
+        print(f"[Divar Scraper] Error parsing {link}: {e}")
+        return parse_failed(stats, "malformed_fields")
+
+
+def parse_ad_html(link: str, html: str, stats=None):
+    soup = BeautifulSoup(html, "html.parser")
+    value2 = [el.get_text(strip=True)
+              for el in soup.select(INFO_VALUE_SELECTOR)]
+    if not value2:
+        return parse_failed(stats, "missing_details")
+    value1 = [el.get_text(strip=True)
+              for el in soup.select(ROW_VALUE_SELECTOR)]
+    keys = [el.get_text(strip=True)
+            for el in soup.select(ROW_TITLE_SELECTOR)]
+    image = soup.select_one(IMAGE_SELECTOR)
+    image_url = image.get("src") if image and image.get("src") else DEFAULT_IMAGE
+    return parse_ad_fields(link, keys, value1, value2, image_url, stats)
 
 
 class DivarScraper(BaseScraper):
-    def _scrape_ad_links(self, city: str, scroll_count: int = 2):
-        self.ads_link = set()
+    name = "Divar"
+    max_concurrency = 4
 
-        self.driver.get(f"https://divar.ir/s/{city}/real-estate")
+    def _scrape_ad_links(self, city: str, scroll_count: int = 2, target_links: int = None, time_budget: float = None, max_idle_scrolls: int = 2):
+        self._load_page(f"https://divar.ir/s/{city}/real-estate", "listing")
         try:
             close_map_button = self.driver.find_element(
                 By.CSS_SELECTOR, 'div.absolute-c06f1[role="button"]')
             close_map_button.click()
         except NoSuchElementException:
             print("[Divar Scraper] Map not found, continuing...")
-        sleep(1)
+        if not self._wait_for_cards(CARD_SELECTOR, 4):
+            raise TimeoutException("No ad cards on the listing page")
 
-        for _ in range(scroll_count):
-            WebDriverWait(self.driver, 3).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "a.kt-post-card__action")))
-            temp = self.driver.find_elements(
-                By.CSS_SELECTOR, "a.kt-post-card__action")
-            for element in temp:
-                should_skip = False
-                for word in ["روزانه", "صنعتی", "تجاری", "اداری", "پانسیون", "مغازه", "هم خونه", "همخونه", "هم خانه", "همخانه"]:
-                    if word in element.find_element(By.TAG_NAME, "h2").text:
-                        should_skip = True
-                        break
-                if should_skip:
-                    # print(f"&&&&&&&&{element.get_attribute('href')}")
-                    continue
-                self.ads_link.add(element.get_attribute("href"))
+        def page_links():
+            return [href for href, title in self._page_cards()
+                    if not is_skipped_title(title)]
+
+        def scroll(step):
             self.driver.execute_script(
                 "window.scrollTo(0, document.body.scrollHeight);")
-            sleep(0.8)
 
-        return list(self.ads_link)
+        return self._harvest_links(page_links, scroll, CARD_SELECTOR, scroll_count,
+                                   target_links, time_budget, max_idle_scrolls)
+
+    def _page_cards(self):
+        # (href, title) of every ad card currently on the page.
+        if self.extraction == "script":
+            return [(card["href"], card["title"])
+                    for card in self.driver.execute_script(CARDS_SCRIPT, CARD_SELECTOR)]
+        return [(element.get_attribute("href"), element.find_element(By.TAG_NAME, "h2").text)
+                for element in self.driver.find_elements(By.CSS_SELECTOR, CARD_SELECTOR)]
+
+    def _page_fields(self):
+        # (keys, value1, value2, image_url) of the open detail page.
+        if self.extraction == "script":
+            fields = self.driver.execute_script(
+                DETAILS_SCRIPT, INFO_VALUE_SELECTOR, ROW_VALUE_SELECTOR, ROW_TITLE_SELECTOR, IMAGE_SELECTOR)
+            return fields["keys"], fields["values"], fields["info"], fields["image"]
+        value2 = [val.text for val in self.driver.find_elements(
+            By.CSS_SELECTOR, INFO_VALUE_SELECTOR)]
+        value1 = [val.text for val in self.driver.find_elements(
+            By.CSS_SELECTOR, ROW_VALUE_SELECTOR)]
+        keys = [key.text for key in self.driver.find_elements(
+            By.CSS_SELECTOR, ROW_TITLE_SELECTOR)]
+        return keys, value1, value2, None
 
     def _scrape_ad_details(self, link: str):
-        self.driver.get(link)
+        self._load_page(link, "detail")
         try:
             WebDriverWait(self.driver, 3).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "td.kt-group-row-item.kt-group-row-item__value.kt-group-row-item--info-row")))
+                EC.presence_of_element_located((By.CSS_SELECTOR, INFO_VALUE_SELECTOR)))
         except TimeoutException:
+            self.stats.timeout("detail")
             return None, None
         try:
-            value2 = self.driver.find_elements(
-                By.CSS_SELECTOR, "td.kt-group-row-item.kt-group-row-item__value.kt-group-row-item--info-row")
-            value1 = self.driver.find_elements(
-                By.CSS_SELECTOR, "p.kt-unexpandable-row__value")
-            try:
-                image_element = WebDriverWait(self.driver, 2).until(
-                    EC.presence_of_element_located(
-                        (By.CSS_SELECTOR, "img.kt-image-block__image.kt-image-block__image--fading"))
-                )
-                image_url = image_element.get_attribute("src")
-            except:
-                image_url = "https://iliadata.ir/images/estate_images/default.jpg"
-
-            value1 = [digits.convert_to_en(val.text) for val in value1]
-            value2 = [digits.convert_to_en(val.text) for val in value2]
-            keys = self.driver.find_elements(
-                By.CSS_SELECTOR, "p.kt-base-row__title.kt-unexpandable-row__title")
-            keys = list(map(lambda x: x.text, keys))
-
-            if value2[2] == "بدون اتاق":
-                value2[2] = 0
-            if value2[1] == "قبل از ۱۳۷۰":
-                building_age = "more than 30"
-            else:
-                current_year = datetime.now().year - 621
-                building_age = current_year - int(value2[1])
-
-            ad_data = {
-                "link": link,
-                "image": image_url,
-                "area_m2": int(value2[0]),
-                "building_age": building_age,
-                "room_count": int(value2[2])
-            }
-
-            if 'قیمت کل' in keys:
-                total_price = keys.index("قیمت کل")
-                price_per_m2 = keys.index("قیمت هر متر")
-                if value1[total_price].replace("،", "").replace(" تومان", "") == "توافقی":
-                    return None, None
-                if value1[price_per_m2].replace("،", "").replace(" تومان", "") == "توافقی":
-                    return None, None
-                ad_data["total_price_toman"] = int(value1[total_price].replace(
-                    "،", "").replace(" تومان", ""))
-                ad_data["price_per_m2_toman"] = int(value1[price_per_m2].replace(
-                    "،", "").replace(" تومان", ""))
-                return ad_data, "sale"
-            elif 'ودیعه' in keys:
-                deposit = keys.index("ودیعه")
-                rent = keys.index("اجارهٔ ماهانه")
-                ad_data["deposit_toman"] = int(value1[deposit].replace(
-                    "،", "").replace(" تومان", ""))
-                ad_data["monthly_rent_toman"] = int(value1[rent].replace(
-                    "،", "").replace(" تومان", ""))
-                return ad_data, "rent"
-            else:
-                return None, None
-
+            keys, value1, value2, image_url = self._page_fields()
+            if not image_url:
+                # The image may still be loading.
+                image_url = self._wait_for_image(IMAGE_SELECTOR, DEFAULT_IMAGE)
         except Exception as e:
             print(f"[Divar Scraper] Error parsing {link}: {e}")
-            return None, None
-
-    def scrape(self, city: str, scroll_count: int = 2):
-        ad_links = self._scrape_ad_links(city, scroll_count)
+            return parse_failed(self.stats, "page_error")
+        return parse_ad_fields(link, keys, value1, value2, image_url, self.stats)
+
+    def _parse_ad_html(self, link: str, html: str):
+        return parse_ad_html(link, html, self.stats)
+
+    def scrape(self, city: str, scroll_count: int = 2, target_links: int = None, time_budget: float = None, max_idle_scrolls: int = 2):
+        # scroll_count caps the scrolls; target_links and time_budget (in
+        # seconds) stop link harvesting earlier, see BaseScraper._harvest_links.
+        with self.stats.timed("links"):
+            ad_links = self._scrape_ad_links(
+                city, scroll_count, target_links, time_budget, max_idle_scrolls)
+        self.stats.links = len(ad_links)
         print(f"[Divar Scraper] Found {len(ad_links)} unique ad links.")
+        self._report("links_found", count=len(ad_links))
 
-        for_sale = []
-        for_rent = []
-
-        for link in tqdm(ad_links, desc="Scraping Divar Details"):
-            ad_data, ad_type = self._scrape_ad_details(link)
-            if ad_type == 'sale':
-                for_sale.append(ad_data)
-            elif ad_type == 'rent':
-                for_rent.append(ad_data)
-            else:
-                continue
+        for_sale, for_rent = self._scrape_all_details(ad_links)
         print(
             f"[Divar Scraper] Finished. Found {len(for_sale)} sale and {len(for_rent)} rent properties.")
+        self._report("scrape_summary", summary=self.stats.summary())
         return for_sale, for_rent
 
 if __name__ == "__main__":
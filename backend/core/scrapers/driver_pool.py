@@ -0,0 +1,198 @@
+from threading import Condition, Lock, Thread
+import atexit
+import os
+import time
+
+from core.metrics import registry
+
+from .base_scraper import launch_driver
+
+POOL_DRIVERS = registry.gauge(
+    "scraper_pool_drivers", "Chrome drivers held by the driver pool, by state.",
+    ["state"])
+POOL_LEASES = registry.counter(
+    "scraper_pool_leases_total", "Drivers leased from the pool, warm or launched on demand.",
+    ["start"])
+POOL_RECYCLED = registry.counter(
+    "scraper_pool_recycled_total", "Pooled drivers shut down, by reason.",
+    ["reason"])
+
+HEAP_USAGE = "Runtime.getHeapUsage"
+
+
+class PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+class DriverPool:
+    # Process-wide pool of warm Chrome drivers. Scrapers lease a driver
+    # instead of launching one and give it back when they are done. Up to
+    # `size` idle drivers are kept; leases beyond that launch an extra driver
+    # that is shut down on release. A driver is replaced after max_pages page
+    # loads or once its JS heap grows past max_heap_mb, and drivers that fail
+    # the health check on lease are replaced too.
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self, size: int, is_headless: bool = True, max_pages: int = 150, max_heap_mb: float = 512, blocked_urls=()):
+        self.size = size
+        self.is_headless = is_headless
+        self.max_pages = max_pages
+        self.max_heap_mb = max_heap_mb
+        self.blocked_urls = tuple(blocked_urls)
+        self.pid = os.getpid()
+        self._lock = Condition()
+        self._idle = []
+        self._leased = 0
+        self._launching = 0
+        self._waiting = 0
+        self._closed = False
+
+    @classmethod
+    def shared(cls, size: int, is_headless: bool = True, max_pages: int = 150, max_heap_mb: float = 512, blocked_urls=()):
+        # One pool per headless mode and process. The pool is created and
+        # starts warming on the first scrape. A pool inherited through fork
+        # is not reused, since its drivers belong to the parent process.
+        with cls._instances_lock:
+            pool = cls._instances.get(is_headless)
+            if pool is None or pool.pid != os.getpid():
+                pool = cls._instances[is_headless] = cls(
+                    size, is_headless, max_pages, max_heap_mb, blocked_urls)
+                atexit.register(pool.close)
+                pool.warm()
+            return pool
+
+    def _launch(self):
+        return PooledDriver(launch_driver(self.is_headless, self.blocked_urls))
+
+    def _update_gauges(self):
+        POOL_DRIVERS.set(len(self._idle), state="idle")
+        POOL_DRIVERS.set(self._leased, state="leased")
+
+    def warm(self):
+        # Launches drivers in the background until `size` are idle.
+        with self._lock:
+            missing = self.size - len(self._idle) - self._launching
+            if self._closed or missing <= 0:
+                return
+            self._launching += missing
+        for _ in range(missing):
+            Thread(target=self._warm_one, daemon=True).start()
+
+    def _warm_one(self):
+        try:
+            pooled = self._launch()
+        except Exception as e:
+            print(f"[Driver Pool] Could not launch driver: {e}")
+            with self._lock:
+                self._launching -= 1
+                self._lock.notify_all()
+            return
+        with self._lock:
+            self._launching -= 1
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append(pooled)
+                self._update_gauges()
+                self._lock.notify()
+                return
+        self._quit(pooled)
+
+    def _is_healthy(self, pooled: PooledDriver):
+        try:
+            return pooled.driver.execute_script("return 1;") == 1
+        except Exception:
+            return False
+
+    def _heap_mb(self, pooled: PooledDriver):
+        try:
+            usage = pooled.driver.execute_cdp_cmd(HEAP_USAGE, {})
+        except Exception:
+            return 0
+        return usage.get("totalSize", 0) / (1024 * 1024)
+
+    def _quit(self, pooled: PooledDriver):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+
+    def lease(self):
+        # Returns (pooled driver, startup seconds); the seconds are None when
+        # a warm driver was handed out. While the pool is warming up, a lease
+        # waits for a driver that is already launching rather than starting
+        # another one.
+        while True:
+            with self._lock:
+                while not self._idle and self._launching > self._waiting:
+                    self._waiting += 1
+                    self._lock.wait()
+                    self._waiting -= 1
+                pooled = self._idle.pop() if self._idle else None
+                self._leased += 1
+                self._update_gauges()
+            if pooled is None:
+                break
+            if self._is_healthy(pooled):
+                POOL_LEASES.inc(start="warm")
+                return pooled, None
+            POOL_RECYCLED.inc(reason="unhealthy")
+            self._quit(pooled)
+            with self._lock:
+                self._leased -= 1
+                self._update_gauges()
+            self.warm()
+
+        started = time.perf_counter()
+        try:
+            pooled = self._launch()
+        except Exception:
+            with self._lock:
+                self._leased -= 1
+                self._update_gauges()
+            raise
+        POOL_LEASES.inc(start="cold")
+        return pooled, time.perf_counter() - started
+
+    def release(self, pooled: PooledDriver):
+        reason = None
+        if pooled.pages >= self.max_pages:
+            reason = "pages"
+        elif self._heap_mb(pooled) > self.max_heap_mb:
+            reason = "memory"
+        else:
+            try:
+                # The next lease may be for the other site, so nothing of this
+                # one is carried over.
+                pooled.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+                pooled.driver.get("about:blank")
+            except Exception:
+                reason = "unhealthy"
+
+        with self._lock:
+            self._leased -= 1
+            keep = reason is None and not self._closed and len(self._idle) < self.size
+            if keep:
+                self._idle.append(pooled)
+            self._update_gauges()
+        if keep:
+            return
+        if reason is not None:
+            POOL_RECYCLED.inc(reason=reason)
+        # Shutting Chrome down takes a while, so it is not done on the
+        # scraper's thread; the replacement is launched in the background.
+        Thread(target=self._quit, args=(pooled,), daemon=True).start()
+        self.warm()
+
+    def close(self):
+        # Also registered with atexit, which forked children inherit; only
+        # the process that launched the drivers shuts them down.
+        if self.pid != os.getpid():
+            return
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._update_gauges()
+        for pooled in idle:
+            self._quit(pooled)
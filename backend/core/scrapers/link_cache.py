@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from threading import Lock
+import json
+
+from core.singleflight import FileLock
+from core.utils import write_json_atomic
+
+
+# Parsed ad details keyed by ad URL, persisted as one JSON file per site.
+# Entries older than the TTL count as missing so the ad is scraped again.
+# Web workers and scrape_hot_cities share the file: a save merges in the
+# entries other processes saved since, keeping the newer entry per link.
+class LinkCache:
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self, path: str, ttl: timedelta):
+        self.path = path
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries = self._load()
+
+    @classmethod
+    def shared(cls, path: str, ttl: timedelta):
+        # Scrapes running in parallel threads must share one instance per file,
+        # otherwise their saves would overwrite each other's entries.
+        with cls._instances_lock:
+            cache = cls._instances.get(path)
+            if cache is None:
+                cache = cls._instances[path] = cls(path, ttl)
+            cache.ttl = ttl
+            return cache
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _is_fresh(self, entry, now):
+        scraped_at = datetime.fromisoformat(entry["scraped_at"])
+        return now - scraped_at <= self.ttl
+
+    def get(self, link: str):
+        with self._lock:
+            entry = self._entries.get(link)
+        if entry is None or not self._is_fresh(entry, datetime.now()):
+            return None
+        # A copy, so callers can change the ad's fields without touching the
+        # cached entry that later scrapes are served from.
+        return dict(entry["data"]), entry["type"]
+
+    def put(self, link: str, ad_data, ad_type):
+        entry = {
+            "scraped_at": datetime.now().isoformat(timespec="seconds"),
+            "type": ad_type,
+            "data": dict(ad_data),
+        }
+        with self._lock:
+            self._entries[link] = entry
+
+    def save(self):
+        with FileLock(f"{self.path}.lock"):
+            saved = self._load()
+            now = datetime.now()
+            with self._lock:
+                for link, entry in saved.items():
+                    current = self._entries.get(link)
+                    if current is None or entry["scraped_at"] > current["scraped_at"]:
+                        self._entries[link] = entry
+                self._entries = {link: entry for link, entry in self._entries.items()
+                                 if self._is_fresh(entry, now)}
+                entries = dict(self._entries)
+            write_json_atomic(self.path, entries)
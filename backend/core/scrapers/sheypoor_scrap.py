@@ -1,137 +1,222 @@
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from persian_tools import digits
-from tqdm import tqdm
-from time import sleep
+from bs4 import BeautifulSoup
 
-from .base_scraper import BaseScraper
+from .base_scraper import BaseScraper, is_skipped_title
+from .stats import parse_failed
+
+DETAILS_SELECTOR = "div.grid.grid-cols-1.gap-x-8.py-0.desktop\\:grid-cols-2.desktop\\:gap-y-6.desktop\\:py-6.pb-4"
+KEY_SELECTOR = "h3.text-heading-4-lighter"
+VALUE_SELECTOR = "span.text-heading-4-bolder"
+IMAGE_SELECTOR = "img.h-full.w-full.select-none.desktop\\:w-full.object-cover"
+TOTAL_PRICE_SELECTOR = "span.flex.items-center.text-heading-4-bolder.\\!text-heading-3-bolder.\\[\\&_span\\]\\:\\!size-6"
+DEFAULT_IMAGE = "https://iliadata.ir/images/estate_images/default.jpg"
+SECTION_SELECTOR = 'section[item="[object Object]"]'
+SECTION_TITLE_SELECTOR = 'h2.text-heading-4-bolder.text-dark-0'
+CARD_SELECTOR = 'a[data-test-id^="ad-item-"]'
+# Ads showing this badge are promoted agency listings and are skipped.
+BADGE_SELECTOR = 'p.inline-block.pl-1.text-body-2-normal.text-blue-1'
+CARD_PRICE_SELECTOR = "span.text-heading-5-normal"
+# Section of ads promoted across the whole country, not the city.
+SHOWCASE_TITLE = "ویترین سراسری"
+
+# Extraction scripts for the "script" mode, one WebDriver call per page.
+CARDS_SCRIPT = """
+const [sectionSelector, sectionTitleSelector, cardSelector, badgeSelector, priceSelector] = arguments;
+const cards = [];
+for (const section of document.querySelectorAll(sectionSelector)) {
+    const sectionTitle = section.querySelector(sectionTitleSelector);
+    for (const card of section.querySelectorAll(cardSelector)) {
+        const title = card.querySelector("h2");
+        cards.push({
+            section: sectionTitle ? sectionTitle.innerText.trim() : null,
+            href: card.href,
+            title: title ? title.innerText.trim() : "",
+            badge: card.querySelector(badgeSelector) !== null,
+            prices: Array.from(card.querySelectorAll(priceSelector), el => el.innerText.trim()),
+        });
+    }
+}
+return cards;
+"""
+DETAILS_SCRIPT = """
+const details = document.querySelector(arguments[0]);
+if (!details) {
+    return null;
+}
+const texts = selector => Array.from(
+    details.querySelectorAll(selector), el => el.innerText.trim());
+const image = document.querySelector(arguments[3]);
+const totalPrice = document.querySelector(arguments[4]);
+return {
+    keys: texts(arguments[1]),
+    values: texts(arguments[2]),
+    image: image ? image.getAttribute("src") : null,
+    total_price: totalPrice ? totalPrice.innerText.trim() : null,
+};
+"""
+
+
+def parse_ad_fields(link: str, keys: list, values: list, total_price, image_url: str, stats=None):
+    try:
+        values = list(map(digits.convert_to_en, values))
+
+        # The digits are already converted, so the label is compared with
+        # English digits too.
+        if values[keys.index("سن بنا")] == "بیشتر از 30 سال":
+            building_age = "more than 30"
+        else:
+            building_age = int(
+                values[keys.index("سن بنا")].replace(" سال", ""))
+        area_index = keys.index("متراژ")
+        room_index = keys.index("تعداد اتاق")
+        if values[room_index] == "بدون اتاق":
+            values[room_index] = 0
+
+        ad_data = {
+            "link": link,
+            "image": image_url,
+            "area_m2": int(values[area_index]),
+            "building_age": building_age,
+            "room_count": int(values[room_index])
+        }
+
+        if total_price:
+            price_per_m2 = keys.index("قیمت هر متر")
+            ad_data["total_price_toman"] = int(digits.convert_to_en(
+                total_price.replace(",", "")))
+            ad_data["price_per_m2_toman"] = int(values[price_per_m2].replace(
+                ",", ""))
+            return ad_data, "sale"
+        else:
+            mortgage = keys.index("رهن")
+            rent = keys.index("اجاره")
+            if values[mortgage].replace(
+                    ",", "").replace(" تومان", "") == "توافقی":
+                return parse_failed(stats, "negotiable_price")
+            if values[rent].replace(
+                    ",", "").replace(" تومان", "") == "توافقی":
+                return parse_failed(stats, "negotiable_price")
+            ad_data["mortgage_toman"] = int(values[mortgage].replace(
+                ",", "").replace(" تومان", ""))
+            ad_data["monthly_rent_toman"] = int(values[rent].replace(
+                ",", "").replace(" تومان", ""))
+            return ad_data, "rent"
+    except Exception:
+        return parse_failed(stats, "malformed_fields")
+
+
+def parse_ad_html(link: str, html: str, stats=None):
+    soup = BeautifulSoup(html, "html.parser")
+    add_details = soup.select_one(DETAILS_SELECTOR)
+    if add_details is None:
+        return parse_failed(stats, "missing_details")
+    keys = [el.get_text(strip=True)
+            for el in add_details.select(KEY_SELECTOR)]
+    values = [el.get_text(strip=True)
+              for el in add_details.select(VALUE_SELECTOR)]
+    image = soup.select_one(IMAGE_SELECTOR)
+    image_url = image.get("src") if image and image.get("src") else DEFAULT_IMAGE
+    total_price = soup.select_one(TOTAL_PRICE_SELECTOR)
+    total_price = total_price.get_text(strip=True) if total_price else None
+    return parse_ad_fields(link, keys, values, total_price, image_url, stats)
 
 
 class SheypoorScraper(BaseScraper):
-    def _scrape_ad_links(self, city: str, scroll_count: int = 8):
-        self.ads_link = set()
-
-        self.driver.get(f"https://www.sheypoor.com/s/{city}/real-estate")
-        sleep(1)
-        for i in range(scroll_count):
-
-            sections = self.driver.find_elements(
-                By.CSS_SELECTOR, 'section[item="[object Object]"]')
-            for section in sections:
-                section_title = section.find_elements(
-                    By.CSS_SELECTOR, 'h2.text-heading-4-bolder.text-dark-0')
-                if section_title:
-                    if section_title[0].text == "ویترین سراسری":
-                        continue
-                section_ads_link = section.find_elements(
-                    By.CSS_SELECTOR, 'a[data-test-id^="ad-item-"]')
-                for element in section_ads_link:
-                    if element.find_elements(By.CSS_SELECTOR, 'p.inline-block.pl-1.text-body-2-normal.text-blue-1'):
-                        continue
-                    if negotiableـprice := element.find_elements(By.CSS_SELECTOR, "span.text-heading-5-normal"):
-                        negotiableـprice = list(
-                            map(lambda x: x.text, negotiableـprice))
-                        if "توافقی" in negotiableـprice:
-                            # # print(
-                            #     f"TAVAFOGHI {element.get_attribute('href')}")
-                            continue
-                    should_skip = False
-                    for word in ["روزانه", "صنعتی", "تجاری", "اداری", "پانسیون", "مغازه", "هم خونه", "همخونه", "هم خانه", "همخانه"]:
-                        if word in element.find_element(By.TAG_NAME, "h2").text:
-                            should_skip = True
-                            break
-                    if should_skip:
-                        # print(f"&&&&&&&&{element.get_attribute("href")}")
-                        continue
-                    self.ads_link.add(element.get_attribute("href"))
+    name = "Sheypoor"
+    max_concurrency = 3
+    # Scrolls move one screen at a time, so a step often loads nothing new.
+    scroll_settle_seconds = 1
+
+    def _scrape_ad_links(self, city: str, scroll_count: int = 8, target_links: int = None, time_budget: float = None, max_idle_scrolls: int = 2):
+        self._load_page(f"https://www.sheypoor.com/s/{city}/real-estate", "listing")
+        if not self._wait_for_cards(CARD_SELECTOR, 5):
+            raise TimeoutException("No ad cards on the listing page")
+
+        def page_links():
+            links = []
+            for card in self._page_cards():
+                if card["section"] == SHOWCASE_TITLE or card["badge"]:
+                    continue
+                if "توافقی" in card["prices"] or is_skipped_title(card["title"]):
+                    continue
+                links.append(card["href"])
+            return links
+
+        def scroll(step):
             self.driver.execute_script(
-                "window.scrollTo(arguments[0] * 900, (arguments[0] + 1) * 900);", i)
-            sleep(0.3)
-        return list(self.ads_link)
+                "window.scrollTo(arguments[0] * 900, (arguments[0] + 1) * 900);", step)
+
+        return self._harvest_links(page_links, scroll, CARD_SELECTOR, scroll_count,
+                                   target_links, time_budget, max_idle_scrolls)
+
+    def _page_cards(self):
+        # Every ad card currently on the page, with what the filters need.
+        if self.extraction == "script":
+            return self.driver.execute_script(
+                CARDS_SCRIPT, SECTION_SELECTOR, SECTION_TITLE_SELECTOR, CARD_SELECTOR, BADGE_SELECTOR, CARD_PRICE_SELECTOR)
+        cards = []
+        for section in self.driver.find_elements(By.CSS_SELECTOR, SECTION_SELECTOR):
+            section_title = section.find_elements(
+                By.CSS_SELECTOR, SECTION_TITLE_SELECTOR)
+            for element in section.find_elements(By.CSS_SELECTOR, CARD_SELECTOR):
+                cards.append({
+                    "section": section_title[0].text if section_title else None,
+                    "href": element.get_attribute("href"),
+                    "title": element.find_element(By.TAG_NAME, "h2").text,
+                    "badge": bool(element.find_elements(By.CSS_SELECTOR, BADGE_SELECTOR)),
+                    "prices": [price.text for price in element.find_elements(By.CSS_SELECTOR, CARD_PRICE_SELECTOR)],
+                })
+        return cards
+
+    def _page_fields(self):
+        # (keys, values, total_price, image_url) of the open detail page.
+        if self.extraction == "script":
+            fields = self.driver.execute_script(
+                DETAILS_SCRIPT, DETAILS_SELECTOR, KEY_SELECTOR, VALUE_SELECTOR, IMAGE_SELECTOR, TOTAL_PRICE_SELECTOR)
+            if fields is None:
+                raise LookupError("details not found")
+            return fields["keys"], fields["values"], fields["total_price"], fields["image"]
+        add_details = self.driver.find_element(
+            By.CSS_SELECTOR, DETAILS_SELECTOR)
+        keys = [key.text for key in add_details.find_elements(
+            By.CSS_SELECTOR, KEY_SELECTOR)]
+        values = [value.text for value in add_details.find_elements(
+            By.CSS_SELECTOR, VALUE_SELECTOR)]
+        total_price = self.driver.find_elements(
+            By.CSS_SELECTOR, TOTAL_PRICE_SELECTOR)
+        total_price = total_price[0].text if total_price else None
+        return keys, values, total_price, None
 
     def _scrape_ad_details(self, link: str):
-        self.driver.get(link)
+        self._load_page(link, "detail")
         try:
-            add_details = self.driver.find_element(
-                By.CSS_SELECTOR, "div.grid.grid-cols-1.gap-x-8.py-0.desktop\\:grid-cols-2.desktop\\:gap-y-6.desktop\\:py-6.pb-4")
-            keys = add_details.find_elements(
-                By.CSS_SELECTOR, "h3.text-heading-4-lighter")
-            keys = list(map(lambda x: x.text, keys))
-            values = add_details.find_elements(
-                By.CSS_SELECTOR, "span.text-heading-4-bolder")
-            values = list(map(lambda x: digits.convert_to_en(x.text), values))
-
-            try:
-                image_element = WebDriverWait(self.driver, 2).until(
-                    EC.presence_of_element_located(
-                        (By.CSS_SELECTOR, "img.h-full.w-full.select-none.desktop\:w-full.object-cover"))
-                )
-                image_url = image_element.get_attribute("src")
-            except:
-                image_url = "https://iliadata.ir/images/estate_images/default.jpg"
-
-            if values[keys.index("سن بنا")] == "بیشتر از ۳۰ سال":
-                building_age = "more than 30"
-            else:
-                building_age = int(
-                    values[keys.index("سن بنا")].replace(" سال", ""))
-            area_index = keys.index("متراژ")
-            room_index = keys.index("تعداد اتاق")
-            if values[room_index] == "بدون اتاق":
-                values[room_index] = 0
-
-            ad_data = {
-                "link": link,
-                "image": image_url,
-                "area_m2": int(values[area_index]),
-                "building_age": building_age,
-                "room_count": int(values[room_index])
-            }
-
-            total_price = self.driver.find_elements(
-                By.CSS_SELECTOR, "span.flex.items-center.text-heading-4-bolder.\\!text-heading-3-bolder.\\[\\&_span\\]\\:\\!size-6")
-            if total_price:
-                price_per_m2 = keys.index("قیمت هر متر")
-                ad_data["total_price_toman"] = int(digits.convert_to_en(
-                    total_price[0].text.replace(",", "")))
-                ad_data["price_per_m2_toman"] = int(values[price_per_m2].replace(
-                    ",", ""))
-                return ad_data, "sale"
-            else:
-                mortgage = keys.index("رهن")
-                rent = keys.index("اجاره")
-                if values[mortgage].replace(
-                        ",", "").replace(" تومان", "") == "توافقی":
-                    return None, None
-                if values[rent].replace(
-                        ",", "").replace(" تومان", "") == "توافقی":
-                    return None, None
-                ad_data["mortgage_toman"] = int(values[mortgage].replace(
-                    ",", "").replace(" تومان", ""))
-                ad_data["monthly_rent_toman"] = int(values[rent].replace(
-                    ",", "").replace(" تومان", ""))
-                return ad_data, "rent"
-        except:
-            return None, None
-
-    def scrape(self, city: str, scroll_count: int = 8):
-        ad_links = self._scrape_ad_links(city, scroll_count)
+            keys, values, total_price, image_url = self._page_fields()
+            if not image_url:
+                # The image may still be loading.
+                image_url = self._wait_for_image(IMAGE_SELECTOR, DEFAULT_IMAGE)
+        except Exception:
+            return parse_failed(self.stats, "missing_details")
+        return parse_ad_fields(link, keys, values, total_price, image_url, self.stats)
+
+    def _parse_ad_html(self, link: str, html: str):
+        return parse_ad_html(link, html, self.stats)
+
+    def scrape(self, city: str, scroll_count: int = 8, target_links: int = None, time_budget: float = None, max_idle_scrolls: int = 2):
+        # scroll_count caps the scrolls; target_links and time_budget (in
+        # seconds) stop link harvesting earlier, see BaseScraper._harvest_links.
+        with self.stats.timed("links"):
+            ad_links = self._scrape_ad_links(
+                city, scroll_count, target_links, time_budget, max_idle_scrolls)
+        self.stats.links = len(ad_links)
         print(f"[Sheypoor Scraper] Found {len(ad_links)} unique ad links.")
+        self._report("links_found", count=len(ad_links))
 
-        for_sale = []
-        for_rent = []
-
-        for link in tqdm(ad_links, desc="Scraping Sheypoor Details"):
-            ad_data, ad_type = self._scrape_ad_details(link)
-            if ad_type == 'sale':
-                for_sale.append(ad_data)
-            elif ad_type == 'rent':
-                for_rent.append(ad_data)
-            else:
-                continue
+        for_sale, for_rent = self._scrape_all_details(ad_links)
         print(
             f"[Sheypoor Scraper] Finished. Found {len(for_sale)} sale and {len(for_rent)} rent properties.")
+        self._report("scrape_summary", summary=self.stats.summary())
         return for_sale, for_rent
 
 if __name__ == "__main__":
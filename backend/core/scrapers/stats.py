@@ -0,0 +1,118 @@
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock
+import time
+
+import numpy as np
+
+from core.metrics import registry
+
+DRIVER_STARTUP_SECONDS = registry.histogram(
+    "scraper_driver_startup_seconds", "Time to launch a Chrome driver.",
+    ["source"], buckets=(0.5, 1, 2, 3, 5, 10, 20, 30))
+PHASE_SECONDS = registry.histogram(
+    "scraper_phase_seconds", "Time spent per scrape phase (links, details, wait).",
+    ["source", "phase"], buckets=(0.5, 1, 5, 10, 30, 60, 120, 300, 600))
+PAGE_LOAD_SECONDS = registry.histogram(
+    "scraper_page_load_seconds", "Time to load a listing or detail page.",
+    ["source", "engine", "page"], buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20))
+TIMEOUTS = registry.counter(
+    "scraper_timeouts_total", "Waits for a page element that timed out.",
+    ["source", "page"])
+PARSE_ERRORS = registry.counter(
+    "scraper_parse_errors_total", "Ads that could not be parsed, by reason.",
+    ["source", "reason"])
+ADS = registry.counter(
+    "scraper_ads_total", "Ads handled by result (sale, rent, failed or cached).",
+    ["source", "result"])
+ADS_PER_SECOND = registry.gauge(
+    "scraper_ads_per_second", "Detail pages scraped per second in the last run.",
+    ["source"])
+
+
+class RunStats:
+    # Timers and counters of one scraper run, shared by the run's worker
+    # drivers. Everything is also added to the process-wide metrics above.
+    def __init__(self, source: str, engine: str):
+        self.source = source
+        self.engine = engine
+        self.started = time.perf_counter()
+        self.links = 0
+        self._lock = Lock()
+        self._phases = Counter()
+        self._ads = Counter()
+        self._timeouts = Counter()
+        self._parse_errors = Counter()
+        self._driver_startups = []
+        self._page_loads = []
+
+    @contextmanager
+    def timed(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            PHASE_SECONDS.observe(elapsed, source=self.source, phase=phase)
+            with self._lock:
+                self._phases[phase] += elapsed
+
+    def driver_started(self, seconds: float):
+        DRIVER_STARTUP_SECONDS.observe(seconds, source=self.source)
+        with self._lock:
+            self._driver_startups.append(seconds)
+
+    def page_loaded(self, page: str, seconds: float):
+        PAGE_LOAD_SECONDS.observe(
+            seconds, source=self.source, engine=self.engine, page=page)
+        with self._lock:
+            self._page_loads.append(seconds)
+
+    def timeout(self, page: str):
+        TIMEOUTS.inc(source=self.source, page=page)
+        with self._lock:
+            self._timeouts[page] += 1
+
+    def parse_error(self, reason: str):
+        PARSE_ERRORS.inc(source=self.source, reason=reason)
+        with self._lock:
+            self._parse_errors[reason] += 1
+
+    def ad(self, result: str, count: int = 1):
+        if not count:
+            return
+        ADS.inc(count, source=self.source, result=result)
+        with self._lock:
+            self._ads[result] += count
+
+    def summary(self):
+        with self._lock:
+            fetched = self._ads["sale"] + self._ads["rent"] + self._ads["failed"]
+            details_seconds = self._phases["details"]
+            ads_per_second = fetched / details_seconds if details_seconds else 0.0
+            page_loads = np.array(self._page_loads)
+            summary = {
+                "source": self.source,
+                "engine": self.engine,
+                "elapsed_s": round(time.perf_counter() - self.started, 2),
+                "links": self.links,
+                "ads": dict(self._ads),
+                "ads_per_second": round(ads_per_second, 2),
+                "driver_startup_s": round(sum(self._driver_startups), 2),
+                "drivers": len(self._driver_startups),
+                "phases_s": {phase: round(seconds, 2) for phase, seconds in self._phases.items()},
+                "page_loads": len(page_loads),
+                "page_load_p50_s": round(float(np.percentile(page_loads, 50)), 3) if page_loads.size else None,
+                "page_load_p95_s": round(float(np.percentile(page_loads, 95)), 3) if page_loads.size else None,
+                "timeouts": dict(self._timeouts),
+                "parse_errors": dict(self._parse_errors),
+            }
+        ADS_PER_SECOND.set(summary["ads_per_second"], source=self.source)
+        return summary
+
+
+def parse_failed(stats, reason: str):
+    # Return value of the parse functions for an ad that is skipped.
+    if stats is not None:
+        stats.parse_error(reason)
+    return None, None
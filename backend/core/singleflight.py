@@ -0,0 +1,140 @@
+from concurrent.futures import Future
+from functools import partial
+from threading import Event, Lock
+import asyncio
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LockTimeout(TimeoutError):
+    pass
+
+
+class FileLock:
+    # Cross-process lock held as an OS lock on a lock file: flock, or
+    # msvcrt.locking on Windows. The OS drops the lock when its holder exits
+    # or crashes, so a lock is never taken over while a long scrape still
+    # holds it, and the file itself is never removed. With a timeout,
+    # acquire raises LockTimeout after waiting that many seconds.
+    def __init__(self, path: str, timeout: float = None, poll_interval: float = 0.5):
+        self.path = path
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    def _try_lock(self, fd):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self._try_lock(fd):
+            if deadline is not None and time.monotonic() >= deadline:
+                os.close(fd)
+                raise LockTimeout(f"Timed out waiting for {self.path}")
+            time.sleep(self.poll_interval)
+        self._fd = fd
+
+    def release(self):
+        # Only unlocks what this instance acquired; closing the descriptor
+        # drops the flock.
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        if fcntl is None:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Runs at most one call per key at a time. Callers arriving while a call
+    # is in flight wait for it and share its result (or its exception).
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    def do(self, key: str, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    # SingleFlight for coroutines. The call runs as a task of its own, so a
+    # caller that disconnects does not cancel it for the others. Its result
+    # is handed out through a thread-safe future, so callers on other event
+    # loops share it too; under WSGI every request runs on a loop of its own.
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    async def do(self, key: str, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._calls[key] = Future()
+
+        if is_leader:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(partial(self._finish, key, future))
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _finish(self, key: str, future: Future, task):
+        with self._lock:
+            del self._calls[key]
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
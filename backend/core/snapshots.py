@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+from threading import Lock
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import Listing
+from core.utils import write_array_atomic, write_json_atomic
+
+SNAPSHOT_DIR = settings.SNAPSHOT_DIR
+
+# Columns of a snapshot segment, one .npy file each. Missing values are NaN.
+COLUMNS = {
+    "id": np.int64,
+    "sale": np.bool_,
+    "area_m2": np.float32,
+    "total_price": np.float64,
+    "price_per_m2": np.float64,
+    "deposit": np.float64,
+    "monthly_rent": np.float64,
+}
+# Column compared by the price-drop query, per listing type.
+PRICE_COLUMNS = {"sale": "total_price", "rent": "monthly_rent"}
+
+
+def _median(values):
+    return int(round(float(np.median(values)))) if values.size else None
+
+
+def _percentile(values, q):
+    return int(round(float(np.percentile(values, q)))) if values.size else None
+
+
+class SnapshotStore:
+    # Append-only price history. Every city refresh adds a segment directory
+    # {city}/{date}T{time}/ holding one .npy file per column, and an entry in
+    # {city}/manifest.json. Segments are never rewritten, so queries read the
+    # columns they need through memory maps. Appends for a city are
+    # serialized by the city lock of the refresh that saves them.
+    def __init__(self, directory: str = SNAPSHOT_DIR):
+        self.directory = directory
+        self._lock = Lock()
+
+    def _manifest_path(self, city: str):
+        return os.path.join(self.directory, city, "manifest.json")
+
+    def manifest(self, city: str):
+        try:
+            with open(self._manifest_path(city), 'r', encoding='utf-8') as f:
+                return json.load(f)["segments"]
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def append(self, city: str, taken_at):
+        # Snapshots the listings seen by the refresh at taken_at.
+        rows = list(Listing.objects.filter(city=city, last_seen=taken_at).order_by("id").values_list(
+            "id", "listing_type", "area_m2", "total_price_toman", "price_per_m2_toman",
+            "deposit_toman", "mortgage_toman", "monthly_rent_toman"))
+        if not rows:
+            return None
+
+        (ids, types, areas, total_prices, prices_per_m2,
+         deposits, mortgages, monthly_rents) = zip(*rows)
+        columns = {
+            "id": ids,
+            "sale": [listing_type == "sale" for listing_type in types],
+            "area_m2": areas,
+            "total_price": total_prices,
+            "price_per_m2": prices_per_m2,
+            # Divar calls the rent deposit "deposit", Sheypoor calls it "mortgage".
+            "deposit": [deposit if deposit is not None else mortgage
+                        for deposit, mortgage in zip(deposits, mortgages)],
+            "monthly_rent": monthly_rents,
+        }
+
+        name = f"{taken_at:%Y-%m-%dT%H%M%S}"
+        for column, dtype in COLUMNS.items():
+            write_array_atomic(os.path.join(self.directory, city, name, f"{column}.npy"),
+                               np.array(columns[column], dtype=dtype))
+
+        sales = int(np.count_nonzero(columns["sale"]))
+        segment = {
+            "name": name,
+            "taken_at": taken_at.isoformat(),
+            "rows": len(rows),
+            "sale": sales,
+            "rent": len(rows) - sales,
+        }
+        with self._lock:
+            segments = [entry for entry in self.manifest(city) if entry["name"] != name]
+            segments.append(segment)
+            # The manifest is written last, so readers never see a segment
+            # whose columns are incomplete.
+            write_json_atomic(self._manifest_path(city), {"segments": segments}, indent=2)
+        return segment
+
+    def column(self, city: str, segment: dict, column: str):
+        return np.load(os.path.join(self.directory, city, segment["name"], f"{column}.npy"),
+                       mmap_mode="r")
+
+    def _typed(self, city: str, segment: dict, listing_type: str, column: str):
+        # The column's values for one listing type, without missing ones.
+        sale = self.column(city, segment, "sale")
+        values = self.column(city, segment, column)[sale if listing_type == "sale" else ~sale]
+        return values[~np.isnan(values)]
+
+    def trend(self, city: str, listing_type: str = "sale", days: int = 90):
+        # One point per day over the last `days` days, from the day's latest
+        # segment. Days are those of the local time zone, while segment
+        # names are in UTC.
+        since = timezone.now() - timedelta(days=days)
+        latest = {}
+        for segment in self.manifest(city):
+            taken_at = datetime.fromisoformat(segment["taken_at"])
+            if taken_at >= since:
+                latest[timezone.localtime(taken_at).date().isoformat()] = segment
+
+        series = []
+        for date, segment in sorted(latest.items()):
+            point = {
+                "date": date,
+                "taken_at": segment["taken_at"],
+                "listings": segment[listing_type],
+            }
+            if listing_type == "sale":
+                price_per_m2 = self._typed(city, segment, "sale", "price_per_m2")
+                point.update({
+                    "median_price_per_m2": _median(price_per_m2),
+                    "p25_price_per_m2": _percentile(price_per_m2, 25),
+                    "p75_price_per_m2": _percentile(price_per_m2, 75),
+                    "median_total_price": _median(self._typed(city, segment, "sale", "total_price")),
+                })
+            else:
+                point.update({
+                    "median_deposit": _median(self._typed(city, segment, "rent", "deposit")),
+                    "median_monthly_rent": _median(self._typed(city, segment, "rent", "monthly_rent")),
+                })
+            series.append(point)
+        return series
+
+    def price_drops(self, city: str, listing_type: str = "sale", min_drop_pct: float = 0, limit: int = 20):
+        # Listings of the latest segment whose price is lower than in the
+        # first segment they appeared in, largest drop first.
+        segments = self.manifest(city)
+        if not segments:
+            return []
+        price_column = PRICE_COLUMNS[listing_type]
+
+        ids, prices, first_segments = [], [], []
+        for index, segment in enumerate(segments):
+            sale = self.column(city, segment, "sale")
+            segment_prices = self.column(city, segment, price_column)
+            mask = (sale if listing_type == "sale" else ~sale) & ~np.isnan(segment_prices)
+            ids.append(self.column(city, segment, "id")[mask])
+            prices.append(segment_prices[mask])
+            first_segments.append(np.full(np.count_nonzero(mask), index))
+
+        # np.unique returns the index of each id's first occurrence, and the
+        # segments are in the order they were taken.
+        all_ids, first = np.unique(np.concatenate(ids), return_index=True)
+        first_prices = np.concatenate(prices)[first]
+        first_segments = np.concatenate(first_segments)[first]
+
+        current_ids, current_prices = ids[-1], prices[-1]
+        positions = np.searchsorted(all_ids, current_ids)
+        start_prices = first_prices[positions]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drops = (start_prices - current_prices) / start_prices * 100
+        dropped = np.flatnonzero((drops > 0) & (drops >= min_drop_pct))
+        dropped = dropped[np.argsort(-drops[dropped], kind="stable")][:limit]
+
+        return [{
+            "id": int(current_ids[i]),
+            "first_price": int(start_prices[i]),
+            "price": int(current_prices[i]),
+            "drop_pct": round(float(drops[i]), 2),
+            "first_seen_at": segments[first_segments[positions[i]]]["taken_at"],
+        } for i in dropped]
+
+
+snapshot_store = SnapshotStore()
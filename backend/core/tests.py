@@ -1,3 +1,619 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from threading import Event
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+from core import city_data
+from core.cities import CityRegistry, city_key
+from core.dedupe import dedupe_listings, is_duplicate
+from core.market_stats import compute_type_stats
+from core.models import Listing
+from core.scrapers import divaar_scrap, driver_pool, sheypoor_scrap
+from core.scrapers.base_scraper import BaseScraper
+from core.scrapers.driver_pool import HEAP_USAGE, POOL_DRIVERS, POOL_RECYCLED, DriverPool
+from core.scrapers.link_cache import LinkCache
+from core.scrapers.stats import RunStats
+from core.singleflight import AsyncSingleFlight, FileLock, LockTimeout, SingleFlight
+from core.snapshots import COLUMNS, SnapshotStore
+from core.utils import write_array_atomic, write_json_atomic
+
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), "testdata")
+
+
+def read_fixture(name):
+    with open(os.path.join(TESTDATA_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+class DivarParserTests(SimpleTestCase):
+    link = "https://divar.ir/v/test/AaBbCc"
+
+    def test_sale(self):
+        ad_data, ad_type = divaar_scrap.parse_ad_html(self.link, read_fixture("divar_sale.html"))
+        self.assertEqual(ad_type, "sale")
+        self.assertEqual(ad_data, {
+            "link": self.link,
+            "image": "https://s100.divarcdn.com/static/photo/sale.jpg",
+            "area_m2": 85,
+            # Built in 1400 of the Persian calendar.
+            "building_age": datetime.now().year - 621 - 1400,
+            "room_count": 2,
+            "total_price_toman": 8500000000,
+            "price_per_m2_toman": 100000000,
+        })
+
+    def test_rent_older_than_30_without_rooms(self):
+        ad_data, ad_type = divaar_scrap.parse_ad_html(self.link, read_fixture("divar_rent.html"))
+        self.assertEqual(ad_type, "rent")
+        self.assertEqual(ad_data["building_age"], "more than 30")
+        self.assertEqual(ad_data["room_count"], 0)
+        self.assertEqual(ad_data["area_m2"], 120)
+        self.assertEqual(ad_data["deposit_toman"], 200000000)
+        self.assertEqual(ad_data["monthly_rent_toman"], 15000000)
+
+    def test_failure_reasons(self):
+        stats = RunStats("Divar", "http")
+        cases = [
+            ("<html><body></body></html>", "missing_details"),
+            (read_fixture("divar_negotiable.html"), "negotiable_price"),
+        ]
+        for html, reason in cases:
+            with self.subTest(reason=reason):
+                self.assertEqual(divaar_scrap.parse_ad_html(self.link, html, stats), (None, None))
+        self.assertEqual(
+            divaar_scrap.parse_ad_fields(self.link, ["طبقه"], ["۲"], ["۸۰", "۱۴۰۰", "۲"], "", stats),
+            (None, None))
+        self.assertEqual(
+            divaar_scrap.parse_ad_fields(self.link, [], [], ["۸۰"], "", stats),
+            (None, None))
+        self.assertEqual(stats.summary()["parse_errors"], {
+            "missing_details": 1,
+            "negotiable_price": 1,
+            "unknown_type": 1,
+            "malformed_fields": 1,
+        })
+
+
+class SheypoorParserTests(SimpleTestCase):
+    link = "https://www.sheypoor.com/v/test-123.html"
+
+    def test_sale(self):
+        ad_data, ad_type = sheypoor_scrap.parse_ad_html(self.link, read_fixture("sheypoor_sale.html"))
+        self.assertEqual(ad_type, "sale")
+        self.assertEqual(ad_data, {
+            "link": self.link,
+            "image": "https://cdn.sheypoor.com/imgs/sale.jpg",
+            "area_m2": 90,
+            "building_age": 5,
+            "room_count": 2,
+            "total_price_toman": 7200000000,
+            "price_per_m2_toman": 80000000,
+        })
+
+    def test_rent_older_than_30_without_rooms(self):
+        ad_data, ad_type = sheypoor_scrap.parse_ad_html(self.link, read_fixture("sheypoor_rent.html"))
+        self.assertEqual(ad_type, "rent")
+        self.assertEqual(ad_data["building_age"], "more than 30")
+        self.assertEqual(ad_data["room_count"], 0)
+        self.assertEqual(ad_data["area_m2"], 65)
+        self.assertEqual(ad_data["mortgage_toman"], 150000000)
+        self.assertEqual(ad_data["monthly_rent_toman"], 12000000)
+
+    def test_failure_reasons(self):
+        stats = RunStats("Sheypoor", "http")
+        cases = [
+            ("<html><body></body></html>", "missing_details"),
+            (read_fixture("sheypoor_negotiable.html"), "negotiable_price"),
+        ]
+        for html, reason in cases:
+            with self.subTest(reason=reason):
+                self.assertEqual(sheypoor_scrap.parse_ad_html(self.link, html, stats), (None, None))
+        self.assertEqual(
+            sheypoor_scrap.parse_ad_fields(self.link, ["متراژ"], ["۹۰"], None, "", stats),
+            (None, None))
+        self.assertEqual(stats.summary()["parse_errors"], {
+            "missing_details": 1,
+            "negotiable_price": 1,
+            "malformed_fields": 1,
+        })
+
+
+class BaseScraperTests(SimpleTestCase):
+    def test_subclass_without_parsers_cannot_be_created(self):
+        class IncompleteScraper(BaseScraper):
+            def _scrape_ad_details(self, link: str):
+                return None, None
+
+        with self.assertRaises(TypeError):
+            IncompleteScraper()
+
+    def test_listing_page_without_cards_fails(self):
+        # An empty listing page is a failed scrape for every source, not an
+        # empty city.
+        for scraper_class in (divaar_scrap.DivarScraper, sheypoor_scrap.SheypoorScraper):
+            with self.subTest(scraper=scraper_class.name):
+                scraper = scraper_class()
+                scraper.driver = mock.Mock()
+                scraper.driver.find_element.side_effect = NoSuchElementException()
+                with mock.patch.object(scraper, "_load_page"), \
+                        mock.patch.object(scraper, "_wait_for_cards", return_value=False), \
+                        redirect_stdout(io.StringIO()), self.assertRaises(TimeoutException):
+                    scraper.scrape("tehran")
+
+
+class DedupeTests(SimpleTestCase):
+    def listing(self, link, area, price):
+        return {"link": link, "area_m2": area, "room_count": 3, "building_age": 10,
+                "total_price_toman": price}
+
+    def test_matches_across_bucket_boundaries(self):
+        # Pairs at and just past the area and price tolerances, small and
+        # large apartments alike: bucketing must merge exactly the pairs
+        # that is_duplicate accepts.
+        for area in (30, 50, 66, 67, 70, 120, 333, 340, 400, 1000, 5000):
+            for other_area in range(int(area * 0.95), int(area * 1.05) + 3):
+                for price, other_price in ((10 ** 10, 97 * 10 ** 8), (10 ** 10, 96 * 10 ** 8)):
+                    divar = self.listing("https://divar.ir/v/a", area, price)
+                    sheypoor = self.listing("https://www.sheypoor.com/v/b.html", other_area, other_price)
+                    with self.subTest(area=area, other_area=other_area, other_price=other_price), \
+                            redirect_stdout(io.StringIO()):
+                        merged = dedupe_listings([divar, sheypoor], "sale")
+                        self.assertEqual(len(merged) == 1, is_duplicate(divar, sheypoor, "sale"))
+
+    def test_large_apartments_are_merged(self):
+        with redirect_stdout(io.StringIO()):
+            merged = dedupe_listings([
+                self.listing("https://divar.ir/v/a", 400, 4 * 10 ** 10),
+                self.listing("https://www.sheypoor.com/v/b.html", 410, 4 * 10 ** 10),
+            ], "sale")
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0]["links"], ["https://divar.ir/v/a", "https://www.sheypoor.com/v/b.html"])
+
+
+class LinkCacheTests(SimpleTestCase):
+    def test_saves_from_other_processes_are_merged(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "divar_link_cache.json")
+        # Two instances of the same file stand in for a web worker and
+        # scrape_hot_cities.
+        web, hot = LinkCache(path, timedelta(days=1)), LinkCache(path, timedelta(days=1))
+        web.put("https://divar.ir/v/a", {"area_m2": 80}, "sale")
+        hot.put("https://divar.ir/v/b", {"area_m2": 90}, "rent")
+        web.save()
+        hot.save()
+
+        self.assertEqual(hot.get("https://divar.ir/v/a"), ({"area_m2": 80}, "sale"))
+        reloaded = LinkCache(path, timedelta(days=1))
+        self.assertEqual(reloaded.get("https://divar.ir/v/a"), ({"area_m2": 80}, "sale"))
+        self.assertEqual(reloaded.get("https://divar.ir/v/b"), ({"area_m2": 90}, "rent"))
+
+    def test_entries_are_copied(self):
+        cache = LinkCache(os.devnull, timedelta(days=1))
+        ad_data = {"link": "https://divar.ir/v/a", "area_m2": 80}
+        cache.put(ad_data["link"], ad_data, "sale")
+        ad_data["area_m2"] = 0
+
+        cached, ad_type = cache.get(ad_data["link"])
+        self.assertEqual((cached["area_m2"], ad_type), (80, "sale"))
+        cached["city"] = "tehran"
+        self.assertNotIn("city", cache.get(ad_data["link"])[0])
+
+
+class FakeDriver:
+    def __init__(self):
+        self.healthy = True
+        self.urls = []
+        self.quit_called = Event()
+
+    def execute_script(self, script, *args):
+        return 1 if self.healthy else None
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {"totalSize": 0} if cmd == HEAP_USAGE else {}
+
+    def get(self, url):
+        self.urls.append(url)
+
+    def quit(self):
+        self.quit_called.set()
+
+
+class DriverPoolTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(driver_pool, "launch_driver", side_effect=lambda *args: FakeDriver())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pool(self, **kwargs):
+        pool = DriverPool(1, **kwargs)
+        self.addCleanup(pool.close)
+        pool.warm()
+        return pool
+
+    def drivers(self, state):
+        return POOL_DRIVERS._values[(("state", state),)]
+
+    def recycled(self, reason):
+        return POOL_RECYCLED._values.get((("reason", reason),), 0)
+
+    def test_warm_driver_is_reused(self):
+        pool = self.pool()
+        pooled, startup = pool.lease()
+        self.assertIsNone(startup)
+        self.assertEqual((self.drivers("idle"), self.drivers("leased")), (0, 1))
+
+        pool.release(pooled)
+        self.assertEqual(pooled.driver.urls, ["about:blank"])
+        self.assertEqual((self.drivers("idle"), self.drivers("leased")), (1, 0))
+        self.assertIs(pool.lease()[0], pooled)
+
+    def test_extra_lease_launches_a_driver_that_is_not_kept(self):
+        pool = self.pool()
+        warm, _ = pool.lease()
+        extra, startup = pool.lease()
+        self.assertIsNotNone(startup)
+        self.assertEqual(self.drivers("leased"), 2)
+
+        pool.release(warm)
+        pool.release(extra)
+        self.assertTrue(extra.driver.quit_called.wait(1))
+        self.assertFalse(warm.driver.quit_called.is_set())
+        self.assertEqual((self.drivers("idle"), self.drivers("leased")), (1, 0))
+
+    def test_unhealthy_driver_is_replaced(self):
+        pool = self.pool()
+        broken, _ = pool.lease()
+        pool.release(broken)
+        broken.driver.healthy = False
+        recycled = self.recycled("unhealthy")
+
+        pooled, _ = pool.lease()
+        self.assertIsNot(pooled, broken)
+        self.assertTrue(broken.driver.quit_called.is_set())
+        self.assertEqual(self.recycled("unhealthy"), recycled + 1)
+        self.assertEqual(self.drivers("leased"), 1)
+
+    def test_driver_is_replaced_after_max_pages(self):
+        pool = self.pool(max_pages=2)
+        pooled, _ = pool.lease()
+        pooled.pages = 2
+        recycled = self.recycled("pages")
+
+        pool.release(pooled)
+        self.assertTrue(pooled.driver.quit_called.wait(1))
+        self.assertEqual(self.recycled("pages"), recycled + 1)
+        replacement, _ = pool.lease()
+        self.assertIsNot(replacement, pooled)
+        self.assertEqual(replacement.pages, 0)
+
+    def test_close_quits_idle_drivers(self):
+        pool = self.pool()
+        pooled, _ = pool.lease()
+        pool.release(pooled)
+        pool.close()
+        self.assertTrue(pooled.driver.quit_called.is_set())
+        self.assertEqual(self.drivers("idle"), 0)
+        pool.warm()
+        self.assertEqual(pool._launching, 0)
+
+
+class SnapshotTrendTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = SnapshotStore(directory.name)
+
+    def add_segments(self, *taken_ats):
+        segments = []
+        for taken_at in taken_ats:
+            name = f"{taken_at:%Y-%m-%dT%H%M%S}"
+            for column, dtype in COLUMNS.items():
+                write_array_atomic(os.path.join(self.store.directory, "tehran", name, f"{column}.npy"),
+                                   np.array([1], dtype=dtype))
+            segments.append({"name": name, "taken_at": taken_at.isoformat(),
+                             "rows": 1, "sale": 1, "rent": 0})
+        write_json_atomic(self.store._manifest_path("tehran"), {"segments": segments})
+
+    @override_settings(TIME_ZONE="Asia/Tehran")
+    def test_points_are_grouped_by_local_date(self):
+        # 20:00 UTC is 23:30 in Tehran and 21:00 UTC is already the next day
+        # there; 10:00 UTC the next day is the same Tehran day as 21:00.
+        day = (timezone.now() - timedelta(days=5)).replace(hour=0, minute=0, second=0, microsecond=0)
+        evening = day + timedelta(hours=20)
+        night = day + timedelta(hours=21)
+        morning = day + timedelta(days=1, hours=10)
+        self.add_segments(evening, night, morning)
+
+        trend = self.store.trend("tehran")
+        self.assertEqual([(point["date"], point["taken_at"]) for point in trend], [
+            (timezone.localtime(evening).date().isoformat(), evening.isoformat()),
+            (timezone.localtime(morning).date().isoformat(), morning.isoformat()),
+        ])
+
+
+class SaveCityDataTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(city_data.snapshot_store, "append")
+        self.append_snapshot = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sale(self, link, price):
+        return {"link": link, "area_m2": 100, "building_age": 10, "room_count": 2,
+                "total_price_toman": price, "price_per_m2_toman": price // 100}
+
+    def scrape(self, divar, sheypoor):
+        # Runs scrape_city with each site's scraper returning, or raising,
+        # the given result.
+        def run_scraper(scraper_class, engine_key, city, scroll_count, progress=None):
+            result = divar if engine_key == "divar" else sheypoor
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        with mock.patch.object(city_data, "_run_scraper", run_scraper), redirect_stdout(io.StringIO()):
+            return city_data.scrape_city("tehran", "tehran")
+
+    def test_failed_and_empty_sources_are_reported(self):
+        divar = ([self.sale("https://divar.ir/v/a", 10 ** 10)], [])
+        sales, rentals, failed_sources = self.scrape(divar, RuntimeError("blocked"))
+        self.assertEqual(([sale["link"] for sale in sales], rentals, failed_sources),
+                         (["https://divar.ir/v/a"], [], ["sheypoor"]))
+        self.assertEqual(self.scrape(divar, ([], []))[2], ["sheypoor"])
+        with self.assertRaises(city_data.EmptyScrape):
+            self.scrape(([], []), ([], []))
+
+    def test_a_failed_source_keeps_its_listings_and_the_city_stale(self):
+        divar_sale = self.sale("https://divar.ir/v/a", 10 ** 10)
+        sheypoor_sale = self.sale("https://www.sheypoor.com/v/b.html", 2 * 10 ** 10)
+        with redirect_stdout(io.StringIO()):
+            refreshed_at = city_data.save_city_data("tehran", [divar_sale, sheypoor_sale], [])
+        stats = city_data.get_city_stats("tehran")
+        self.append_snapshot.reset_mock()
+
+        cheaper = dict(divar_sale, total_price_toman=9 * 10 ** 9)
+        new_sale = self.sale("https://divar.ir/v/c", 3 * 10 ** 10)
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(city_data.save_city_data("tehran", [cheaper, new_sale], [], ["sheypoor"]),
+                             refreshed_at)
+
+        all_sales, _ = city_data.load_city_data("tehran")
+        self.assertEqual({sale["link"]: sale["total_price_toman"] for sale in all_sales}, {
+            "https://divar.ir/v/a": 9 * 10 ** 9,
+            "https://www.sheypoor.com/v/b.html": 2 * 10 ** 10,
+            "https://divar.ir/v/c": 3 * 10 ** 10,
+        })
+        self.assertEqual(city_data.city_refreshed_at("tehran"), refreshed_at)
+        self.assertEqual(city_data.get_city_stats("tehran"), stats)
+        self.append_snapshot.assert_not_called()
+
+    def test_first_refresh_of_a_city_is_recorded_even_if_a_source_failed(self):
+        with redirect_stdout(io.StringIO()):
+            refreshed_at = city_data.save_city_data(
+                "tehran", [self.sale("https://divar.ir/v/a", 10 ** 10)], [], ["sheypoor"])
+        self.assertEqual(city_data.city_refreshed_at("tehran"), refreshed_at)
+        self.assertEqual(len(city_data.load_city_data("tehran")[0]), 1)
+
+    def test_out_of_range_values_do_not_fail_the_refresh(self):
+        city_data.save_city_data("tehran", [
+            {"link": "https://divar.ir/v/presale", "area_m2": 90, "building_age": -1,
+             "room_count": 2, "total_price_toman": 9 * 10 ** 9},
+            {"link": "https://divar.ir/v/garbled", "area_m2": -80, "building_age": 40000,
+             "room_count": -2, "total_price_toman": 8 * 10 ** 9},
+        ], [])
+
+        presale = Listing.objects.get(link="https://divar.ir/v/presale")
+        self.assertEqual((presale.area_m2, presale.building_age, presale.room_count), (90, 0, 2))
+        garbled = Listing.objects.get(link="https://divar.ir/v/garbled")
+        self.assertEqual((garbled.area_m2, garbled.building_age, garbled.room_count), (None, None, None))
+        self.assertEqual(garbled.total_price_toman, 8 * 10 ** 9)
+
+
+class FileLockTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "locks", "tehran.lock")
+
+    def test_waiters_time_out_while_the_lock_is_held(self):
+        with FileLock(self.path):
+            with self.assertRaises(LockTimeout):
+                FileLock(self.path, timeout=0.2, poll_interval=0.05).acquire()
+            # Releasing a lock this instance never acquired leaves it held.
+            FileLock(self.path).release()
+            with self.assertRaises(LockTimeout):
+                FileLock(self.path, timeout=0, poll_interval=0.05).acquire()
+        with FileLock(self.path, timeout=0):
+            pass
+
+    def test_lock_of_a_killed_holder_is_released(self):
+        holder = subprocess.Popen(
+            [sys.executable, "-c",
+             "import sys, time; from core.singleflight import FileLock; "
+             "FileLock(sys.argv[1]).acquire(); print('locked', flush=True); time.sleep(60)",
+             self.path],
+            cwd=os.path.dirname(os.path.dirname(__file__)), stdout=subprocess.PIPE, text=True)
+        self.addCleanup(holder.stdout.close)
+        self.assertEqual(holder.stdout.readline().strip(), "locked")
+        with self.assertRaises(LockTimeout):
+            FileLock(self.path, timeout=0).acquire()
+
+        holder.kill()
+        holder.wait()
+        with FileLock(self.path, timeout=5, poll_interval=0.05):
+            self.assertTrue(os.path.exists(self.path))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight()
+        release = Event()
+        calls = []
+
+        def load(city):
+            calls.append(city)
+            release.wait(5)
+            return [city]
+
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(flight.do, "tehran", load, "tehran") for _ in range(4)]
+            while not calls:
+                release.wait(0.01)
+            # Give the followers time to join the call in flight.
+            release.wait(0.1)
+            release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(calls, ["tehran"])
+        self.assertTrue(all(result is results[0] for result in results))
+
+        # Once the call finished, the next one runs again.
+        self.assertEqual(flight.do("tehran", load, "karaj"), ["karaj"])
+
+    def test_errors_are_shared_and_not_kept(self):
+        flight = SingleFlight()
+        release = Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError("scrape failed")
+
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(flight.do, "tehran", fail) for _ in range(2)]
+            release.wait(0.1)
+            release.set()
+            for future in futures:
+                with self.assertRaisesMessage(ValueError, "scrape failed"):
+                    future.result()
+        self.assertEqual(flight.do("tehran", lambda: "ok"), "ok")
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+    def test_calls_are_shared_within_and_across_event_loops(self):
+        flight = AsyncSingleFlight()
+        started = Event()
+        release = Event()
+        calls = []
+
+        async def analyse():
+            calls.append(1)
+            started.set()
+            await asyncio.to_thread(release.wait, 5)
+            return {"top": ["a"]}
+
+        async def callers():
+            return await asyncio.gather(flight.do("tehran", analyse), flight.do("tehran", analyse))
+
+        # Under WSGI every request runs on an event loop of its own.
+        with ThreadPoolExecutor(2) as executor:
+            first = executor.submit(asyncio.run, callers())
+            started.wait(5)
+            second = executor.submit(asyncio.run, callers())
+            release.wait(0.1)
+            release.set()
+            results = first.result() + second.result()
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_a_cancelled_caller_does_not_cancel_the_call(self):
+        flight = AsyncSingleFlight()
+
+        async def analyse():
+            await asyncio.sleep(0.1)
+            return "done"
+
+        async def main():
+            first = asyncio.ensure_future(flight.do("tehran", analyse))
+            second = asyncio.ensure_future(flight.do("tehran", analyse))
+            await asyncio.sleep(0)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return await second
+
+        self.assertEqual(asyncio.run(main()), "done")
+
+    def test_errors_are_shared(self):
+        flight = AsyncSingleFlight()
+
+        async def analyse():
+            await asyncio.sleep(0)
+            raise ValueError("model failed")
+
+        async def main():
+            return await asyncio.gather(flight.do("tehran", analyse), flight.do("tehran", analyse),
+                                        return_exceptions=True)
+
+        errors = asyncio.run(main())
+        self.assertIsInstance(errors[0], ValueError)
+        self.assertIs(errors[0], errors[1])
+
+
+class MarketStatsTests(SimpleTestCase):
+    def test_older_than_30_is_counted_apart_from_the_age_stats(self):
+        sales = [
+            {"link": "https://divar.ir/v/a", "area_m2": 80, "building_age": 10, "room_count": 2,
+             "price_per_m2_toman": 100, "total_price_toman": 8000},
+            {"link": "https://divar.ir/v/b", "area_m2": 100, "building_age": 20, "room_count": 2,
+             "price_per_m2_toman": 200, "total_price_toman": 20000},
+            {"link": "https://divar.ir/v/c", "area_m2": 120, "building_age": "more than 30", "room_count": 3,
+             "price_per_m2_toman": 300, "total_price_toman": 36000},
+        ]
+        stats = compute_type_stats(sales, "sale")
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(stats["older_than_30_count"], 1)
+        age = stats["metrics"]["building_age"]
+        self.assertEqual((age["count"], age["mean"], age["max"]), (2, 15.0, 20.0))
+        self.assertEqual(stats["metrics"]["price_per_m2_toman"]["count"], 3)
+        self.assertEqual(stats["by_rooms"]["3"]["count"], 1)
+
+    def test_rentals(self):
+        rentals = [
+            {"link": "https://www.sheypoor.com/v/a.html", "area_m2": 50, "building_age": "more than 30",
+             "room_count": 1, "mortgage_toman": 100, "monthly_rent_toman": 1000},
+        ]
+        stats = compute_type_stats(rentals, "rent")
+        self.assertEqual(stats["older_than_30_count"], 1)
+        self.assertIsNone(stats["metrics"]["building_age"])
+        self.assertEqual(stats["metrics"]["rent_per_m2_toman"]["mean"], 20.0)
+        self.assertEqual(stats["metrics"]["deposit_toman"]["mean"], 100.0)
+
+
+class CityRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = CityRegistry([
+            {"english": "Tehran", "divar": "tehran", "sheypoor": "tehran", "persian": "تهران"},
+            {"english": "Tabriz", "divar": "tabriz", "sheypoor": "tabriz"},
+            {"english": "Tabas", "divar": "tabas", "sheypoor": "tabas"},
+            {"english": "Bandar Abbas", "divar": "bandar-abbas", "sheypoor": "bandarabbas"},
+        ])
+
+    def test_lookup_by_any_name(self):
+        for name in ("Tehran", "  TEHRAN ", "tehran", "تهران"):
+            with self.subTest(name=name):
+                self.assertEqual(self.registry.get(name)["english"], "Tehran")
+        self.assertEqual(self.registry.get("bandar   abbas")["divar"], "bandar-abbas")
+        self.assertEqual(self.registry.get("bandarabbas")["english"], "Bandar Abbas")
+        self.assertIsNone(self.registry.get("atlantis"))
+        self.assertEqual(city_key(self.registry.get("bandar-abbas")), "bandar abbas")
+
+    def test_prefix_search(self):
+        self.assertEqual([city["english"] for city in self.registry.search("tab")], ["Tabas", "Tabriz"])
+        self.assertEqual([city["english"] for city in self.registry.search("TA", limit=1)], ["Tabas"])
+        self.assertEqual([city["english"] for city in self.registry.search("ته")], ["Tehran"])
+        self.assertEqual(self.registry.search("  "), [])
+
+    def test_search_tolerates_typos(self):
+        self.assertEqual([city["english"] for city in self.registry.search("tehrn")], ["Tehran"])
+        self.assertEqual(self.registry.search("zzzz"), [])
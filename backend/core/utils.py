@@ -0,0 +1,33 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+def _write_atomic(filename: str, write, mode: str = 'w', **open_kwargs):
+    # Readers either see the previous file or the complete new one, never a
+    # partially written file.
+    directory = os.path.dirname(filename) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **open_kwargs) as f:
+            write(f)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_json_atomic(filename: str, data, indent=None):
+    _write_atomic(filename, lambda f: json.dump(
+        data, f, ensure_ascii=False, indent=indent), encoding='utf-8')
+
+
+def write_bytes_atomic(filename: str, data: bytes):
+    _write_atomic(filename, lambda f: f.write(data), mode='wb')
+
+
+def write_array_atomic(filename: str, array):
+    _write_atomic(filename, lambda f: np.save(f, array), mode='wb')
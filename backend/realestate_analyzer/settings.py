@@ -80,6 +80,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets requests keep reading listings while a scrape writes.
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'timeout': 20,
+        },
     }
 }
 
@@ -128,4 +133,120 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
     "http://127.0.0.1:5173",
-]
\ No newline at end of file
+]
+
+# Data files
+
+# The app's files live under BASE_DIR, so the server and the management
+# commands share them whatever directory they are started from.
+DATA_DIR = BASE_DIR / 'database'
+CITIES_FILE = DATA_DIR / 'cities.json'
+# Legacy users file read by the import_users command.
+USERS_FILE = DATA_DIR / 'users.json'
+# Link caches, legacy per-city JSON files and the city lock files.
+SCRAP_DIR = DATA_DIR / 'scrap'
+LOCK_DIR = SCRAP_DIR / 'locks'
+SNAPSHOT_DIR = DATA_DIR / 'snapshots'
+AI_CACHE_FILE = DATA_DIR / 'ai_cache.json'
+
+
+# Scraping
+
+# City data older than this is refreshed by scraping both sites again.
+CITY_DATA_MAX_AGE_HOURS = 12
+
+# When True, stale city data is served immediately (marked "stale") while a
+# background worker refreshes it. Cities without any data are always
+# scraped synchronously.
+CITY_DATA_STALE_WHILE_REVALIDATE = True
+
+# A request that has to scrape a city waits this long for a scrape of it
+# running in another worker. It then serves the city's stale data, or fails
+# when there is none.
+CITY_LOCK_TIMEOUT_SECONDS = 300
+
+# Number of Chrome sessions each scraper uses for ad detail pages.
+# Per-site limits in the scraper classes still apply on top of this.
+SCRAPER_WORKERS = 3
+
+# How each site's ad detail pages are fetched: "selenium" renders them in
+# Chrome, "http" parses the server-rendered HTML over a keep-alive session.
+SCRAPER_DETAIL_ENGINES = {
+    "divar": "selenium",
+    "sheypoor": "selenium",
+}
+
+# How data is read from pages rendered in Chrome: "script" gathers a whole
+# page in one execute_script call, "elements" reads it element by element.
+SCRAPER_EXTRACTION = "script"
+
+# Link harvesting stops once a site returned this many unique ad links, or
+# after this many seconds of scrolling. None disables either limit; the
+# per-site scroll counts in core.city_data still cap the depth.
+SCRAPER_TARGET_LINKS = None
+SCRAPER_LINK_TIME_BUDGET_SECONDS = 60
+
+# Warm Chrome drivers kept per worker process and leased to scrapers across
+# requests; 0 launches a new Chrome for every scrape instead. A pooled
+# driver is replaced after SCRAPER_DRIVER_MAX_PAGES page loads or once its
+# JS heap grows past SCRAPER_DRIVER_MAX_HEAP_MB.
+SCRAPER_DRIVER_POOL_SIZE = 4
+SCRAPER_DRIVER_MAX_PAGES = 150
+SCRAPER_DRIVER_MAX_HEAP_MB = 512
+
+# Requests Chrome drops before sending them (Network.setBlockedURLs
+# wildcards): fonts, media and third-party analytics, ads and trackers.
+# Images are already disabled in the browser profile. Stylesheets are not
+# blocked: the extracted innerText, the bottom-of-page check and the
+# infinite-scroll triggers all depend on the page layout.
+SCRAPER_BLOCKED_URLS = [
+    "*.woff", "*.woff?*", "*.woff2", "*.woff2?*", "*.ttf", "*.ttf?*", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*googlesyndication.com*", "*googleadservices.com*", "*fonts.googleapis.com*",
+    "*fonts.gstatic.com*", "*mc.yandex.ru*", "*hotjar.com*", "*clarity.ms*",
+    "*facebook.net*", "*connect.facebook.com*", "*sentry.io*", "*najva.com*",
+    "*pushe.co*", "*webengage.com*",
+]
+
+# Ad details scraped within this many hours are reused instead of being
+# fetched again on the next refresh.
+SCRAPER_LINK_CACHE_TTL_HOURS = 24
+
+
+# AI analysis
+
+# AI top picks are cached per listing set; the oldest entries are evicted
+# past AI_CACHE_MAX_ENTRIES and entries expire after AI_CACHE_TTL_HOURS.
+AI_CACHE_MAX_ENTRIES = 512
+AI_CACHE_TTL_HOURS = 24 * 7
+
+# Upper bound on a single AI request, in seconds.
+AI_REQUEST_TIMEOUT_SECONDS = 60
+
+# Listings are pre-ranked locally and only this many are sent to the model.
+AI_PRERANK_TOP_K = 40
+
+# Default ranking engine for get-data, overridable with ?engine=...
+# "auto" uses the model and falls back to local ranking if it fails,
+# "ai" uses the model only and "local" never calls the model.
+RANKING_ENGINE = "auto"
+
+# Serialized, gzip-compressed get-data responses kept in memory per worker.
+RESPONSE_CACHE_MAX_ENTRIES = 256
+# Directory where cached responses are also written so that every worker
+# process can serve them; None keeps the cache in memory only.
+RESPONSE_CACHE_DIR = None
+
+
+# Authentication
+
+# Lifetime of the tokens handed out by the login endpoint.
+AUTH_TOKEN_TTL_HOURS = 24 * 7
+# Validated tokens are trusted for this long without a database lookup, so
+# a logout takes up to this long to reach the other worker processes.
+AUTH_TOKEN_CACHE_SECONDS = 60
+
+# Login attempts allowed per username and per client IP in the window.
+LOGIN_RATE_LIMIT_ATTEMPTS = 10
+LOGIN_RATE_LIMIT_WINDOW_SECONDS = 60